@@ -5,6 +5,7 @@ from datetime import datetime
 import os
 import time
 import threading
+import uuid
 
 # 设置页面配置
 st.set_page_config(
@@ -75,11 +76,84 @@ except:
 from utils.data_processor import DataProcessor
 from utils.statistics_calculator import StatisticsCalculator
 from utils.data_processor_async import AsyncDataProcessor
+from utils.disk_cache import DiskCache, content_hash, combine_hashes
+from utils.excel_reader import memory_report
+from utils.stats_cube import StatsCube
+from utils.hierarchy_index import HierarchyIndex
+from utils.filter_index import FilterIndex
+from utils.incremental_store import IncrementalStore
+from utils.batch_report import DIMENSION_COLUMNS, details_sql, period_capability, period_capability_sql, summary_sql
+from utils.coefficient_sweep import coefficient_grid, parse_ranges, parse_values, sweep_abnormal_counts, sweep_defaults
+from utils.dataset_registry import DatasetRegistry
+from utils.result_cache import ResultCache, make_key
+from utils.metrics import MetricsRecorder
+from utils.control_charts import CHART_TYPES, ControlCharts
+from utils.sql_backend import DB_PATH, SqlBackend
+from utils.seasons import SEASON_COLUMN
+from config import BOOTSTRAP_CONFIDENCE, BOOTSTRAP_REPLICATES, ROLLING_WINDOW_DAYS
 
 # 初始化数据处理器和统计计算器
 data_processor = DataProcessor()
 stats_calculator = StatisticsCalculator()
-async_processor = AsyncDataProcessor()
+control_charts = ControlCharts()
+disk_cache = DiskCache()
+data_store = IncrementalStore()
+
+
+@st.cache_resource
+def get_dataset_registry():
+    """进程内唯一的数据集注册表，所有会话共享"""
+    return DatasetRegistry(disk_cache=disk_cache)
+
+
+dataset_registry = get_dataset_registry()
+
+
+@st.cache_resource
+def get_result_cache():
+    """进程内唯一的分析结果缓存，所有会话共享"""
+    return ResultCache()
+
+
+result_cache = get_result_cache()
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+session_id = st.session_state['session_id']
+
+# 各阶段的耗时记录（每个会话一个记录器，同时写入 data/metrics.jsonl）
+if 'metrics' not in st.session_state:
+    st.session_state['metrics'] = MetricsRecorder(session_id=session_id)
+metrics = st.session_state['metrics'].activate()
+
+
+def timed(stage_name, rows, func, *args, **kwargs):
+    """记录一次计算的耗时"""
+    with metrics.stage(stage_name, rows=rows):
+        return func(*args, **kwargs)
+
+
+# 后台加载任务（每个会话一个）；数据加载后在后台构建的派生结构
+if 'load_job' not in st.session_state:
+    st.session_state['load_job'] = AsyncDataProcessor()
+load_job = st.session_state['load_job']
+DATASET_PREPARE = {
+    'cube': StatsCube.from_frame,
+    'hierarchy': HierarchyIndex,
+    'filter_index': FilterIndex,
+    'memory_report': memory_report
+}
+
+
+@st.fragment(run_every=1)
+def show_load_progress(job):
+    """后台加载进度，每秒只刷新这一块；加载结束后整页刷新以切换到新数据"""
+    if not job.running:
+        st.rerun()
+    st.text(job.status)
+    st.progress(job.progress)
+    if st.button("取消加载"):
+        job.cancel()
+        st.text(job.status)
 
 # 侧边栏配置
 with st.sidebar:
@@ -87,6 +161,9 @@ with st.sidebar:
     
     # 添加登出按钮
     if st.button("🚪 退出系统", use_container_width=True):
+        if st.session_state.get('dataset_key'):
+            dataset_registry.release(st.session_state['dataset_key'], session_id)
+        load_job.cancel()
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.rerun()
@@ -101,18 +178,33 @@ with st.sidebar:
     # 过程值差值系数配置
     st.subheader("过程值差值系数")
     
-    season = st.radio("选择季节系数", ["夏季", "冬季"])
+    season = st.radio("选择季节系数", ["夏季", "冬季", "按入库日期区分"],
+                      help="按入库日期区分：夏季时间段内的数据用夏季系数，其余用冬季系数，一次计算全年")
     
     if season == "夏季":
         coef_fat = st.number_input("脂肪系数", value=3.2, step=0.1)
         coef_protein = st.number_input("蛋白系数", value=2.9, step=0.1)
         coef_dry = st.number_input("干物质系数", value=11.8, step=0.1)
         coef_cell = st.number_input("体细胞系数", value=20.0, step=1.0)
-    else:
+    elif season == "冬季":
         coef_fat = st.number_input("脂肪系数", value=3.4, step=0.1)
         coef_protein = st.number_input("蛋白系数", value=3.0, step=0.1)
         coef_dry = st.number_input("干物质系数", value=11.9, step=0.1)
         coef_cell = st.number_input("体细胞系数", value=20.0, step=1.0)
+    else:
+        st.caption(f"夏季：每年 {summer_start:%m-%d} 至 {summer_end:%m-%d}，其余日期为冬季")
+        st.markdown("**夏季**")
+        coef_fat = st.number_input("夏季脂肪系数", value=3.2, step=0.1)
+        coef_protein = st.number_input("夏季蛋白系数", value=2.9, step=0.1)
+        coef_dry = st.number_input("夏季干物质系数", value=11.8, step=0.1)
+        coef_cell = st.number_input("夏季体细胞系数", value=20.0, step=1.0)
+        st.markdown("**冬季**")
+        winter_values = {
+            '脂肪': st.number_input("冬季脂肪系数", value=3.4, step=0.1),
+            '蛋白': st.number_input("冬季蛋白系数", value=3.0, step=0.1),
+            '干物质': st.number_input("冬季干物质系数", value=11.9, step=0.1),
+            '体细胞': st.number_input("冬季体细胞系数", value=20.0, step=1.0)
+        }
     
     # 酸度特殊参数
     st.subheader("酸度参数")
@@ -146,6 +238,104 @@ with st.sidebar:
         with col_max:
             cpk_max = st.number_input("最大值", value=999.0, step=0.1, key="cpk_max_input")
         st.caption("CPK在此范围外为异常")
+    
+    # 详细分析的可选指标
+    detail_options = {}
+    if st.checkbox("计算组内CPK", help="详细分析中cpk使用组内全部样本的σ（Ppk，包含日间波动）；"
+                                       "勾选后另加按日子组合并方差得到的组内σ和组内cpk（Cpk）"):
+        detail_options['within_subgroup'] = True
+    
+    # 样本少的分组CPK点估计波动大，可按bootstrap置信区间判定
+    use_bootstrap = st.checkbox("计算CPK置信区间", help=f"详细分析的每个分组做{BOOTSTRAP_REPLICATES}次bootstrap重抽样，给出cpk、cp的置信区间")
+    if use_bootstrap:
+        bootstrap_confidence = st.slider("置信水平", min_value=0.80, max_value=0.99, value=BOOTSTRAP_CONFIDENCE, step=0.01)
+        status_basis = st.radio(
+            "详细分析的异常判定依据",
+            options=["点估计", "置信下限", "置信上限"],
+            help="置信下限：下限不满足判定标准即为异常（确认能力达标）；置信上限：上限也不满足才为异常（只标记确定不达标的分组）"
+        )
+        detail_options.update({
+            'confidence': bootstrap_confidence,
+            'status_bound': {'点估计': None, '置信下限': '下限', '置信上限': '上限'}[status_basis]
+        })
+    
+    # 数据缓存管理
+    st.subheader("数据缓存")
+    cache_stats = disk_cache.stats()
+    st.caption(f"已缓存 {cache_stats['文件数']} 个文件，共 {cache_stats['总大小'] / (1024 * 1024):.1f}MB")
+    registry_stats = dataset_registry.stats()
+    st.caption(f"内存中 {registry_stats['数据集数']} 个数据集，共 {registry_stats['总大小'] / (1024 * 1024):.1f}MB"
+               f"（上限 {registry_stats['上限'] / (1024 * 1024):.0f}MB），{registry_stats['会话数']} 个会话正在使用")
+    result_stats = result_cache.stats()
+    st.caption(f"分析结果缓存 {result_stats['条目数']} 条（{result_stats['总大小'] / (1024 * 1024):.1f}MB），"
+               f"命中 {result_stats['命中']} 次，未命中 {result_stats['未命中']} 次")
+    if st.button("🧹 清除数据缓存", use_container_width=True):
+        disk_cache.invalidate()
+        st.cache_data.clear()
+        dataset_registry.clear()
+        result_cache.clear()
+        st.rerun()
+    
+    # 本地累积数据集：按月追加新文件，只重算受影响的月份
+    with st.expander("本地累积数据集"):
+        manifest = data_store.manifest()
+        if manifest['appends']:
+            last_append = manifest['appends'][-1]
+            st.caption(f"共 {last_append['总记录数']:,} 条记录，已追加 {len(manifest['appends'])} 次，最近一次：{last_append['时间']}")
+        else:
+            st.caption("尚未追加数据")
+        
+        append_file = st.file_uploader("选择要追加的Excel文件", type=['xlsx', 'xls'], key="append_file")
+        if append_file is not None and st.button("追加到本地累积数据集", use_container_width=True):
+            with st.spinner('正在追加数据...'):
+                try:
+                    summary = data_processor.append_data(append_file, data_store)
+                    st.success("追加完成")
+                    st.json(summary)
+                except Exception as e:
+                    st.error(f"追加数据失败: {str(e)}")
+        
+        if data_store.exists() and st.button("删除本地累积数据集", use_container_width=True):
+            data_store.clear()
+            st.session_state['use_store'] = False
+            st.rerun()
+    
+    # SQLite数据库：筛选和分组汇总在数据库中执行，多年数据也不需要读入内存
+    with st.expander("SQLite数据库"):
+        if os.path.exists(DB_PATH):
+            db_backend = SqlBackend()
+            db_sources = db_backend.sources()
+            db_backend.close()
+            st.caption(f"已导入 {len(db_sources)} 个文件，共 {int(db_sources['行数'].sum()):,} 条记录")
+        else:
+            st.caption("尚未导入数据")
+        
+        db_files = st.file_uploader("选择要导入的Excel文件", type=['xlsx', 'xls'], accept_multiple_files=True, key="db_files")
+        if db_files and st.button("导入到数据库", use_container_width=True):
+            with st.spinner('正在导入数据...'):
+                backend = SqlBackend()
+                try:
+                    imported = backend.import_sources(db_files)
+                    st.success(f"新导入 {imported:,} 条记录（已导入过的文件跳过）")
+                except Exception as e:
+                    st.error(f"导入数据失败: {str(e)}")
+                finally:
+                    backend.close()
+
+# 过程值差值系数（按入库日期区分季节时为夏季、冬季两组，酸度参数两季共用）
+coefficients = {
+    '脂肪': coef_fat,
+    '蛋白': coef_protein,
+    '干物质': coef_dry,
+    '体细胞': coef_cell,
+    '酸度_min': acid_min,
+    '酸度_max': acid_max,
+    '酸度_tolerance': tolerance_acid
+}
+summer_window = None
+if season == "按入库日期区分":
+    coefficients = {'夏季': coefficients, '冬季': {**coefficients, **winter_values}}
+    summer_window = (summer_start, summer_end)
 
 # 确保CPK判定变量在全局作用域可用
 if 'cpk_min' not in locals():
@@ -157,581 +347,746 @@ if 'cpk_threshold' not in locals():
 # 主界面
 st.title("🐄 牧场数据CPK分析系统")
 
-# 数据上传
-uploaded_file = st.file_uploader("请选择Excel数据文件", type=['xlsx', 'xls'])
+# 数据上传（可同时选择多个文件，每个文件中的所有数据工作表都会读取）
+uploaded_files = st.file_uploader("请选择Excel数据文件", type=['xlsx', 'xls'], accept_multiple_files=True)
+
+df = None
+dataset_key = None
+from_store = False
+# 分析SQLite数据库中的数据时为 SqlBackend，数据不读入内存（df 为 None）
+sql_backend = None
 
-if uploaded_file is not None:
-    # 检查是否已经加载过这个文件
-    file_key = f"df_{uploaded_file.name}_{uploaded_file.size}"
+if uploaded_files:
+    # 按文件内容计算hash（同一上传文件只计算一次）
+    file_hashes = []
+    for uploaded_file in uploaded_files:
+        hash_key = f"hash_{uploaded_file.name}_{uploaded_file.size}"
+        if hash_key not in st.session_state:
+            st.session_state[hash_key] = content_hash(uploaded_file)
+        file_hashes.append(st.session_state[hash_key])
+    file_hash = combine_hashes(file_hashes)
     
-    if file_key not in st.session_state:
-        # 读取数据
-        progress_container = st.container()
-        with progress_container:
-            progress_text = st.empty()
-            progress_bar = st.progress(0)
-            
-            # 获取文件大小
-            file_size_mb = uploaded_file.size / (1024 * 1024)
-            
-            # 显示文件信息
-            progress_text.text(f"正在读取 {uploaded_file.name} ({file_size_mb:.1f}MB)")
-            status_text = st.empty()
-            
-            # 开始计时
-            start_time = time.time()
-            
-            # 直接读取数据（简化流程）
-            try:
-                status_text.text("正在打开Excel文件...")
-                progress_bar.progress(0.1)
-                
-                # 重置文件指针
-                uploaded_file.seek(0)
-                
-                # 读取数据
-                df = pd.read_excel(uploaded_file, engine='openpyxl')
-                progress_bar.progress(0.4)
-                
-                status_text.text(f"已读取 {len(df):,} 条记录，正在处理...")
-                
-                # 筛选列
-                required_cols = ['大区', '区域', '地区', '奶源地编码', '奶源地名称', 
-                               '入库日期', '上号日期', '脂肪', '蛋白', '干物质', 
-                               '酸度', '体细胞']
-                cols_to_keep = [col for col in required_cols if col in df.columns]
-                df = df[cols_to_keep]
-                progress_bar.progress(0.6)
-                
-                # 转换日期
-                status_text.text("正在转换日期格式...")
-                date_columns = ['上号日期', '入库日期']
-                for col in date_columns:
-                    if col in df.columns:
-                        df[col] = pd.to_datetime(df[col], errors='coerce')
-                progress_bar.progress(0.8)
-                
-                # 添加月份列
-                if '入库日期' in df.columns:
-                    df['年月'] = df['入库日期'].dt.to_period('M')
-                
-                progress_bar.progress(1.0)
-                elapsed_time = int(time.time() - start_time)
-                status_text.text(f"数据加载完成！用时 {elapsed_time} 秒")
-                
-                # 保存到session state
-                st.session_state[file_key] = df
-                
-                # 短暂显示完成信息
-                time.sleep(1)
-                
-            except Exception as e:
-                st.error(f"加载数据失败: {str(e)}")
-                df = None
-            
-            # 清理进度显示
-            progress_text.empty()
-            progress_bar.empty()
-            status_text.empty()
+    # 其他会话已加载过（或重启前已解析过）同样的文件时直接共享，不再解析
+    df = dataset_registry.acquire(file_hash, session_id)
+    
+    if df is not None:
+        dataset_key = file_hash
+        if load_job.key == file_hash and load_job.finished and st.session_state.get('load_notified') != file_hash:
+            st.session_state['load_notified'] = file_hash
+            st.toast(f"数据加载完成！用时 {load_job.elapsed:.1f} 秒")
     else:
-        # 使用缓存的数据
-        df = st.session_state[file_key]
+        if load_job.key != file_hash or load_job.finished:
+            # 新文件在后台解析（注册后数据被淘汰且磁盘缓存已清除时也重新解析）
+            file_size_mb = sum(uploaded_file.size for uploaded_file in uploaded_files) / (1024 * 1024)
+            file_names = '、'.join(uploaded_file.name for uploaded_file in uploaded_files)
+            load_job.start(file_hash, [uploaded_file.getvalue() for uploaded_file in uploaded_files],
+                           dataset_registry, session_id, prepare=DATASET_PREPARE,
+                           description=f"{file_names} ({file_size_mb:.1f}MB)")
         
-    if df is not None:
-        st.success(f"成功加载数据！共 {len(df)} 条记录")
+        if load_job.running:
+            show_load_progress(load_job)
+        else:
+            if load_job.cancelled:
+                st.warning("已取消加载")
+            elif load_job.error:
+                st.error(f"加载数据失败: {load_job.error}")
+            # 取消或失败后不自动重试，避免每次页面刷新都重新解析
+            if st.button("重新加载"):
+                load_job.key = None
+                st.rerun()
+        
+        # 新文件加载完成前继续分析上一份数据
+        previous_key = st.session_state.get('dataset_key')
+        if previous_key and previous_key != file_hash:
+            df = dataset_registry.acquire(previous_key, session_id)
+            if df is not None:
+                dataset_key = previous_key
+                from_store = previous_key.startswith('store_')
+                st.info("新文件加载完成前，以下仍为上一份数据的分析")
+    
+elif st.session_state.get('use_store') and data_store.exists():
+    # 分析本地累积数据集，数据集版本变化（追加后）时重新读取
+    dataset_key = f"store_{data_store.manifest()['version']}"
+    df = dataset_registry.acquire(dataset_key, session_id)
+    if df is None:
+        with st.spinner('正在读取本地累积数据集...'):
+            # 累积数据集本身就在磁盘上，不再写入磁盘缓存
+            df = dataset_registry.put(dataset_key, data_store.load_dataset(), session_id, spill=False)
+    from_store = True
+    st.info(f"正在分析本地累积数据集（{len(df):,} 条记录）")
+    if st.button("返回上传文件"):
+        st.session_state['use_store'] = False
+        st.rerun()
+elif st.session_state.get('use_db') and os.path.exists(DB_PATH):
+    # 分析数据库中的数据，导入新文件后数据版本变化，分析结果按新版本重新计算
+    sql_backend = SqlBackend()
+    dataset_key = f"sql_{sql_backend.version()}"
+    st.info(f"正在分析SQLite数据库中的数据（{sql_backend.row_count():,} 条记录），筛选和分组汇总在数据库中执行")
+    if st.button("返回上传文件"):
+        st.session_state['use_db'] = False
+        st.rerun()
+else:
+    if data_store.exists():
+        if st.button("分析本地累积数据集"):
+            st.session_state['use_store'] = True
+            st.rerun()
+    
+    if os.path.exists(DB_PATH):
+        if st.button("分析SQLite数据库中的数据"):
+            st.session_state['use_db'] = True
+            st.rerun()
+    
+    # 默认数据路径
+    default_path = "/Users/Shared/Files From d.localized/projects/cpk_data_analyze/data/2024年全年数据.xlsx"
+    if os.path.exists(default_path):
+        if st.button("使用默认数据文件"):
+            st.session_state['use_default'] = True
+            st.rerun()
+    
+    # 检查是否需要加载默认数据
+    if 'use_default' in st.session_state and st.session_state['use_default']:
+        with st.spinner('正在读取数据（首次加载需要一些时间）...'):
+            df = data_processor.load_data(default_path)
+            if df is not None:
+                st.session_state['df'] = df
+                st.session_state['use_default'] = False
+                st.rerun()
+
+# 切换到其他数据（或移除文件）后释放对原数据集的引用
+previous_key = st.session_state.get('dataset_key')
+if previous_key and previous_key != dataset_key:
+    dataset_registry.release(previous_key, session_id)
+if previous_key != dataset_key:
+    # 换了数据后不再显示上一份数据的分析结果
+    st.session_state['show_analysis'] = False
+    st.session_state['show_anomalies'] = False
+    st.session_state['show_sweep'] = False
+    st.session_state['show_trend'] = False
+    st.session_state['show_spc'] = False
+st.session_state['dataset_key'] = dataset_key
+
+if df is not None or sql_backend is not None:
+    if sql_backend is not None:
+        # 数据库中的数据：层级索引由去重后的层级组合构建，不读取记录
+        hierarchy = result_cache.get_or_compute(make_key(dataset_key, 'hierarchy'),
+                                                lambda: HierarchyIndex(sql_backend.hierarchy()))
+        total_rows = sql_backend.row_count()
+    else:
+        # 加载后构建一次充分统计量立方体，CPK异常筛选切换粒度/维度时直接汇总
+        cube = dataset_registry.derived(dataset_key, 'cube', lambda: StatsCube.from_frame(df))
         
-        # 数据筛选
-        st.header("数据筛选")
+        # 层级索引：筛选控件的选项直接查字典
+        hierarchy = dataset_registry.derived(dataset_key, 'hierarchy', lambda: HierarchyIndex(df))
         
-        # 添加全选/清除按钮行
-        button_col1, button_col2, button_col3, button_col4, button_col5 = st.columns(5)
+        # 筛选索引：按入库日期排序并记录各取值的行位置
+        filter_index = dataset_registry.derived(dataset_key, 'filter_index', lambda: FilterIndex(df))
         
-        with button_col1:
-            col1_1, col1_2 = st.columns(2)
-            with col1_1:
-                if st.button("全选大区", use_container_width=True):
-                    st.session_state['select_all_zones'] = True
-            with col1_2:
-                if st.button("清除大区", use_container_width=True):
-                    st.session_state['select_all_zones'] = False
+        # 各列内存占用（与按pandas默认类型读取相比）
+        with st.sidebar:
+            with st.expander("数据内存占用"):
+                st.dataframe(dataset_registry.derived(dataset_key, 'memory_report', lambda: memory_report(df)),
+                             hide_index=True, use_container_width=True)
         
-        with button_col2:
-            col2_1, col2_2 = st.columns(2)
-            with col2_1:
-                if st.button("全选区域", use_container_width=True):
-                    st.session_state['select_all_regions'] = True
-            with col2_2:
-                if st.button("清除区域", use_container_width=True):
-                    st.session_state['select_all_regions'] = False
+        total_rows = len(df)
+        st.success(f"成功加载数据！共 {total_rows} 条记录")
+    
+    # 数据筛选
+    st.header("数据筛选")
+    
+    # 添加全选/清除按钮行
+    button_col1, button_col2, button_col3, button_col4, button_col5 = st.columns(5)
+    
+    with button_col1:
+        col1_1, col1_2 = st.columns(2)
+        with col1_1:
+            if st.button("全选大区", use_container_width=True):
+                st.session_state['select_all_zones'] = True
+        with col1_2:
+            if st.button("清除大区", use_container_width=True):
+                st.session_state['select_all_zones'] = False
+    
+    with button_col2:
+        col2_1, col2_2 = st.columns(2)
+        with col2_1:
+            if st.button("全选区域", use_container_width=True):
+                st.session_state['select_all_regions'] = True
+        with col2_2:
+            if st.button("清除区域", use_container_width=True):
+                st.session_state['select_all_regions'] = False
+    
+    with button_col3:
+        col3_1, col3_2 = st.columns(2)
+        with col3_1:
+            if st.button("全选地区", use_container_width=True):
+                st.session_state['select_all_areas'] = True
+        with col3_2:
+            if st.button("清除地区", use_container_width=True):
+                st.session_state['select_all_areas'] = False
+    
+    with button_col4:
+        col4_1, col4_2 = st.columns(2)
+        with col4_1:
+            if st.button("全选奶源地", use_container_width=True):
+                st.session_state['select_all_farms'] = True
+        with col4_2:
+            if st.button("清除奶源地", use_container_width=True):
+                st.session_state['select_all_farms'] = False
+    
+    with button_col5:
+        st.empty()  # 时间段不需要全选
+    
+    # 筛选控件 - 5列布局
+    col1, col2, col3, col4, col5 = st.columns(5)
+    
+    with col1:
+        # 大区筛选
+        all_zones = hierarchy.options('大区')
+        default_zones = all_zones if st.session_state.get('select_all_zones', False) else []
+        zones = st.multiselect(
+            "选择大区",
+            options=all_zones,
+            default=default_zones,
+            key="zone_select"
+        )
+    
+    with col2:
+        # 区域筛选 - 根据选择的大区过滤（没有选择大区时显示所有区域）
+        all_regions = hierarchy.options('区域', zones=zones)
         
-        with button_col3:
-            col3_1, col3_2 = st.columns(2)
-            with col3_1:
-                if st.button("全选地区", use_container_width=True):
-                    st.session_state['select_all_areas'] = True
-            with col3_2:
-                if st.button("清除地区", use_container_width=True):
-                    st.session_state['select_all_areas'] = False
+        default_regions = all_regions if st.session_state.get('select_all_regions', False) else []
+        # 清理无效的默认值
+        default_regions = [region for region in default_regions if region in all_regions]
         
-        with button_col4:
-            col4_1, col4_2 = st.columns(2)
-            with col4_1:
-                if st.button("全选奶源地", use_container_width=True):
-                    st.session_state['select_all_farms'] = True
-            with col4_2:
-                if st.button("清除奶源地", use_container_width=True):
-                    st.session_state['select_all_farms'] = False
+        regions = st.multiselect(
+            "选择区域",
+            options=all_regions,
+            default=default_regions,
+            key="region_select"
+        )
+    
+    with col3:
+        # 地区筛选 - 根据选择的大区和区域过滤
+        all_areas = hierarchy.options('地区', zones=zones, regions=regions)
         
-        with button_col5:
-            st.empty()  # 时间段不需要全选
+        default_areas = all_areas if st.session_state.get('select_all_areas', False) else []
+        # 清理无效的默认值
+        default_areas = [area for area in default_areas if area in all_areas]
         
-        # 筛选控件 - 5列布局
-        col1, col2, col3, col4, col5 = st.columns(5)
+        areas = st.multiselect(
+            "选择地区",
+            options=all_areas,
+            default=default_areas,
+            key="area_select"
+        )
+    
+    with col4:
+        # 奶源地筛选 - 根据选择的大区、区域和地区过滤
+        all_farms = hierarchy.options('奶源地名称', zones=zones, regions=regions, areas=areas)
         
-        with col1:
-            # 大区筛选
-            all_zones = sorted(list(df['大区'].unique())) if '大区' in df.columns else []
-            default_zones = all_zones if st.session_state.get('select_all_zones', False) else []
-            zones = st.multiselect(
-                "选择大区",
-                options=all_zones,
-                default=default_zones,
-                key="zone_select"
-            )
+        default_farms = all_farms if st.session_state.get('select_all_farms', False) else []
+        # 清理无效的默认值
+        default_farms = [farm for farm in default_farms if farm in all_farms]
         
-        with col2:
-            # 区域筛选 - 根据选择的大区过滤
-            if zones:
-                # 只显示选中大区的区域
-                filtered_df_for_regions = df[df['大区'].isin(zones)]
-                all_regions = sorted(list(filtered_df_for_regions['区域'].unique())) if '区域' in filtered_df_for_regions.columns else []
-            else:
-                # 没有选择大区时显示所有区域
-                all_regions = sorted(list(df['区域'].unique())) if '区域' in df.columns else []
-            
-            default_regions = all_regions if st.session_state.get('select_all_regions', False) else []
-            # 清理无效的默认值
-            default_regions = [region for region in default_regions if region in all_regions]
+        farms = st.multiselect(
+            "选择奶源地",
+            options=all_farms,
+            default=default_farms,
+            key="farm_select"
+        )
+    
+    with col5:
+        # 时间段筛选 - 移到最后
+        date_range = st.date_input(
+            "选择时间段",
+            value=[],
+            help="选择开始和结束日期（包含所选日期当天）",
+            key="date_select"
+        )
+    
+    # 添加快捷操作按钮
+    quick_col1, quick_col2, quick_col3 = st.columns([1, 1, 3])
+    with quick_col1:
+        if st.button("🔄 全部选择", use_container_width=True):
+            st.session_state['select_all_zones'] = True
+            st.session_state['select_all_regions'] = True
+            st.session_state['select_all_areas'] = True
+            st.session_state['select_all_farms'] = True
+            st.rerun()
+    
+    with quick_col2:
+        if st.button("🗑️ 全部清除", use_container_width=True):
+            st.session_state['select_all_zones'] = False
+            st.session_state['select_all_regions'] = False
+            st.session_state['select_all_areas'] = False
+            st.session_state['select_all_farms'] = False
+            st.rerun()
+    
+    # 筛选条件（作为分析结果缓存键的一部分，分析数据库中的数据时也是SQL的筛选条件）
+    analysis_filters = {
+        'zones': zones,
+        'regions': regions,
+        'areas': areas,
+        'farms': farms,
+        'date_range': tuple(date_range) if date_range else ()
+    }
+    
+    # 应用筛选：数据库中的数据只统计满足条件的行数，分析时在数据库中筛选和汇总
+    with metrics.stage('筛选', rows=total_rows) as filter_record:
+        if sql_backend is not None:
+            filtered_df = None
+            filtered_rows = sql_backend.row_count(**analysis_filters)
+        else:
+            filtered_df = data_processor.filter_data(df, zones, regions, areas, date_range, farms, index=filter_index)
+            filtered_rows = len(filtered_df)
+        filter_record['筛选后行数'] = filtered_rows
+    
+    def filtered_records(selected_farms=None):
+        """筛选后的逐条数据（CPK趋势、控制图使用）；数据库中的数据只在需要时读取满足条件的记录"""
+        if sql_backend is not None:
+            return sql_backend.records(**{**analysis_filters, 'farms': selected_farms or farms})
+        if selected_farms:
+            return filtered_df[filtered_df['奶源地名称'].isin(selected_farms)]
+        return filtered_df
+    
+    def farm_options():
+        """筛选范围内的奶源地"""
+        if sql_backend is not None:
+            return farms or hierarchy.options('奶源地名称', zones=zones, regions=regions, areas=areas)
+        return sorted(filtered_df['奶源地名称'].dropna().unique().tolist())
+    
+    # 显示筛选结果统计
+    if len(zones) > 0 or len(regions) > 0 or len(areas) > 0 or len(farms) > 0 or date_range:
+        st.info(f"筛选后数据: {filtered_rows} 条记录 (原始数据: {total_rows} 条)")
+    
+    # 计算统计数据：点击后结果在页面重新运行时保持显示，参数变化时按新参数计算，相同参数直接取缓存
+    if st.button("计算分析指标"):
+        st.session_state['show_analysis'] = True
+    
+    if st.session_state.get('show_analysis'):
+        with st.spinner('正在计算...'):
+            # 计算整体汇总统计（按入库日期区分季节时夏季、冬季分别汇总）
+            def compute_summary():
+                if sql_backend is not None:
+                    return timed('整体汇总表（数据库）', filtered_rows, summary_sql, sql_backend, coefficients,
+                                 summer_window, analysis_filters, stats_calculator)
+                return timed('整体汇总表', filtered_rows, stats_calculator.calculate_summary_table,
+                             filtered_df, coefficients, summer_window)
             
-            regions = st.multiselect(
-                "选择区域",
-                options=all_regions,
-                default=default_regions,
-                key="region_select"
+            summary_table = result_cache.get_or_compute(
+                make_key(dataset_key, 'summary', analysis_filters, coefficients=coefficients, summer_window=summer_window),
+                compute_summary
             )
-        
-        with col3:
-            # 地区筛选 - 根据选择的大区和区域过滤
-            temp_df = df.copy()
-            if zones:
-                temp_df = temp_df[temp_df['大区'].isin(zones)]
-            if regions:
-                temp_df = temp_df[temp_df['区域'].isin(regions)]
             
-            all_areas = sorted(list(temp_df['地区'].unique())) if '地区' in temp_df.columns else []
+            # 显示整体分析结果
+            st.header("📊 整体能力分析结果")
             
-            default_areas = all_areas if st.session_state.get('select_all_areas', False) else []
-            # 清理无效的默认值
-            default_areas = [area for area in default_areas if area in all_areas]
+            # 创建样式函数
+            def style_dataframe(df):
+                """为数据框添加样式"""
+                # 创建一个样式数组
+                styles = pd.DataFrame('', index=df.index, columns=df.columns)
+                
+                # 能力分析列设置背景色
+                styles['能力分析'] = 'background-color: #e6f3ff; font-weight: bold'
+                
+                # 找到cpk行（按季节汇总时每季一行）并设置颜色
+                for cpk_idx in df.index[df['能力分析'] == 'cpk']:
+                    for col in df.columns[df.columns.get_loc('能力分析') + 1:]:
+                        try:
+                            val = float(df.loc[cpk_idx, col])
+                            if val < 1.0:
+                                styles.loc[cpk_idx, col] = 'background-color: #ffcccc'  # 浅红色
+                            elif val >= 1.33:
+                                styles.loc[cpk_idx, col] = 'background-color: #ccffcc'  # 浅绿色
+                            else:
+                                styles.loc[cpk_idx, col] = 'background-color: #ffffcc'  # 浅黄色
+                        except:
+                            pass
+                
+                return styles
             
-            areas = st.multiselect(
-                "选择地区",
-                options=all_areas,
-                default=default_areas,
-                key="area_select"
-            )
-        
-        with col4:
-            # 奶源地筛选 - 根据选择的大区、区域和地区过滤
-            temp_df = df.copy()
-            if zones:
-                temp_df = temp_df[temp_df['大区'].isin(zones)]
-            if regions:
-                temp_df = temp_df[temp_df['区域'].isin(regions)]
-            if areas:
-                temp_df = temp_df[temp_df['地区'].isin(areas)]
+            # 应用样式
+            with metrics.stage('样式', rows=len(summary_table)):
+                styled_summary = summary_table.style.apply(style_dataframe, axis=None)
+                st.dataframe(styled_summary, use_container_width=True)
             
-            all_farms = sorted(list(temp_df['奶源地名称'].unique())) if '奶源地名称' in temp_df.columns else []
+            # 添加说明
+            with st.expander("📋 指标说明"):
+                st.markdown("""
+                - **σ（标准差）**：数据的离散程度，越小越好
+                - **X（平均值）**：数据的集中趋势
+                - **过程值差值**：实际均值与目标值的差异
+                - **6σ/3σ**：过程能力的衡量标准
+                - **CPK**：过程能力指数，≥1.33为优秀，1.0-1.33为良好，<1.0需改进
+                - **公差**：允许的变动范围
+                - **CP**：潜在过程能力指数
+                """)
             
-            default_farms = all_farms if st.session_state.get('select_all_farms', False) else []
-            # 清理无效的默认值
-            default_farms = [farm for farm in default_farms if farm in all_farms]
+            # 计算详细统计指标
+            st.header("📈 详细分析结果")
+            detail_args = {
+                'cpk_threshold_type': cpk_threshold_type,
+                'cpk_threshold': cpk_threshold if cpk_threshold_type == "小于阈值为异常" else 1.0,
+                'cpk_min': cpk_min,
+                'cpk_max': cpk_max
+            }
             
-            farms = st.multiselect(
-                "选择奶源地",
-                options=all_farms,
-                default=default_farms,
-                key="farm_select"
+            if sql_backend is not None and detail_options:
+                st.caption("置信区间和组内CPK需要逐条数据，分析数据库中的数据时不计算")
+            
+            def compute_details():
+                if sql_backend is not None:
+                    # 各分组的统计量在数据库中汇总
+                    return timed('详细统计（数据库）', filtered_rows, details_sql, sql_backend, coefficients,
+                                 summer_window, analysis_filters, stats_calculator, **detail_args)
+                if from_store and filtered_rows == total_rows and summer_window is None and not detail_options:
+                    # 未筛选的累积数据集直接使用保存的分组统计量（保存的统计量不区分季节）
+                    return timed('详细统计（累积统计量）', filtered_rows, data_store.statistics, coefficients, **detail_args)
+                return timed('详细统计', filtered_rows, stats_calculator.calculate_statistics, filtered_df, coefficients,
+                             summer_window=summer_window, **detail_args, **detail_options)
+            
+            results = result_cache.get_or_compute(
+                make_key(dataset_key, 'details', analysis_filters, coefficients=coefficients,
+                         summer_window=summer_window, **detail_args, **detail_options),
+                compute_details
             )
-        
-        with col5:
-            # 时间段筛选 - 移到最后
-            date_range = st.date_input(
-                "选择时间段",
-                value=[],
-                help="选择开始和结束日期（包含所选日期当天）",
-                key="date_select"
+            st.dataframe(results, use_container_width=True)
+            
+            # 下载结果
+            col1, col2 = st.columns(2)
+            with col1:
+                # 下载汇总表
+                with metrics.stage('CSV导出', rows=len(summary_table), 表='整体分析结果'):
+                    summary_csv = summary_table.to_csv(index=False, encoding='utf-8-sig')
+                st.download_button(
+                    label="下载整体分析结果",
+                    data=summary_csv,
+                    file_name=f"cpk_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime='text/csv'
+                )
+            
+            with col2:
+                # 下载详细结果
+                with metrics.stage('CSV导出', rows=len(results), 表='详细分析结果'):
+                    csv = results.to_csv(index=False, encoding='utf-8-sig')
+                st.download_button(
+                    label="下载详细分析结果",
+                    data=csv,
+                    file_name=f"cpk_details_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime='text/csv'
+                )
+    
+    # CPK异常筛选
+    st.header("CPK异常筛选")
+    st.info("💡 CPK异常筛选基于上方数据筛选的结果")
+    
+    # 显示当前判定标准
+    if cpk_threshold_type == "小于阈值为异常":
+        st.success(f"📊 当前判定标准：CPK < {cpk_threshold} 为异常")
+    else:
+        st.success(f"📊 当前判定标准：CPK < {cpk_min} 或 CPK > {cpk_max} 为异常")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("分析设置")
+        # 分析粒度
+        analysis_period = st.radio(
+            "分析粒度",
+            options=["按月", "按季度", "按年"],
+            index=0
+        )
+    
+    with col2:
+        st.subheader("分析维度")
+        filter_object = st.radio(
+            "选择分析维度",
+            options=["按大区", "按区域", "按牧场"],
+            index=1  # 默认选中"按区域"
+        )
+    
+    if st.button("筛选CPK异常"):
+        st.session_state['show_anomalies'] = True
+    
+    if st.session_state.get('show_anomalies'):
+        with st.spinner('正在筛选异常数据...'):
+            threshold_args = dict(
+                cpk_threshold_type=cpk_threshold_type,
+                cpk_threshold=cpk_threshold if cpk_threshold_type == "小于阈值为异常" else 1.0,
+                cpk_min=cpk_min,
+                cpk_max=cpk_max
             )
-        
-        # 添加快捷操作按钮
-        quick_col1, quick_col2, quick_col3 = st.columns([1, 1, 3])
-        with quick_col1:
-            if st.button("🔄 全部选择", use_container_width=True):
-                st.session_state['select_all_zones'] = True
-                st.session_state['select_all_regions'] = True
-                st.session_state['select_all_areas'] = True
-                st.session_state['select_all_farms'] = True
-                st.rerun()
-        
-        with quick_col2:
-            if st.button("🗑️ 全部清除", use_container_width=True):
-                st.session_state['select_all_zones'] = False
-                st.session_state['select_all_regions'] = False
-                st.session_state['select_all_areas'] = False
-                st.session_state['select_all_farms'] = False
-                st.rerun()
-        
-        # 应用筛选
-        filtered_df = data_processor.filter_data(df, zones, regions, areas, date_range, farms)
-        
-        # 显示筛选结果统计
-        if len(zones) > 0 or len(regions) > 0 or len(areas) > 0 or len(farms) > 0 or date_range:
-            st.info(f"筛选后数据: {len(filtered_df)} 条记录 (原始数据: {len(df)} 条)")
-        
-        # 计算统计数据
-        if st.button("计算分析指标"):
-            with st.spinner('正在计算...'):
-                # 准备系数
-                coefficients = {
-                    '脂肪': coef_fat,
-                    '蛋白': coef_protein,
-                    '干物质': coef_dry,
-                    '体细胞': coef_cell,
-                    '酸度_min': acid_min,
-                    '酸度_max': acid_max,
-                    '酸度_tolerance': tolerance_acid
-                }
-                
-                # 计算整体汇总统计
-                summary_table = stats_calculator.calculate_summary_table(filtered_df, coefficients)
-                
-                # 显示整体分析结果
-                st.header("📊 整体能力分析结果")
+            
+            
+            # 使用与上方数据筛选相同的条件筛选立方体（数据库中的数据在数据库中筛选），
+            # 再按粒度和维度汇总（相同条件直接取缓存）
+            def compute_capability():
+                if sql_backend is not None:
+                    return timed('CPK异常筛选（数据库）', filtered_rows, period_capability_sql, sql_backend,
+                                 analysis_period, filter_object, coefficients, calculator=stats_calculator,
+                                 summer_window=summer_window, filters=analysis_filters, **threshold_args)
+                return timed('CPK异常筛选', filtered_rows, period_capability,
+                             cube.filter(zones, regions, areas, date_range, farms), analysis_period,
+                             filter_object, coefficients, calculator=stats_calculator,
+                             summer_window=summer_window, **threshold_args)
+            
+            capability_results = result_cache.get_or_compute(
+                make_key(dataset_key, 'period_capability', analysis_filters, coefficients=coefficients,
+                         summer_window=summer_window, period=analysis_period, dimension=filter_object, **threshold_args),
+                compute_capability
+            )
+            
+            if filter_object in ("按大区", "按区域"):
+                # 按大区/区域和时间段汇总，一次得到所有分组的CPK和状态
+                dimension = '大区' if filter_object == "按大区" else '区域'
+                results_df = capability_results
                 
-                # 创建样式函数
-                def style_dataframe(df):
-                    """为数据框添加样式"""
-                    # 创建一个样式数组
-                    styles = pd.DataFrame('', index=df.index, columns=df.columns)
-                    
-                    # 第一列（能力分析）设置背景色
-                    styles.iloc[:, 0] = 'background-color: #e6f3ff; font-weight: bold'
+                if len(results_df) > 0:
+                    abnormal_results = results_df[stats_calculator.abnormal_mask(results_df)]
                     
-                    # 找到cpk行并设置颜色
-                    if 'cpk' in df['能力分析'].values:
-                        cpk_idx = df[df['能力分析'] == 'cpk'].index[0]
-                        for col in df.columns[1:]:
-                            try:
-                                val = float(df.loc[cpk_idx, col])
-                                if val < 1.0:
-                                    styles.loc[cpk_idx, col] = 'background-color: #ffcccc'  # 浅红色
-                                elif val >= 1.33:
-                                    styles.loc[cpk_idx, col] = 'background-color: #ccffcc'  # 浅绿色
-                                else:
-                                    styles.loc[cpk_idx, col] = 'background-color: #ffffcc'  # 浅黄色
-                            except:
-                                pass
-                    
-                    return styles
-                
-                # 应用样式
-                styled_summary = summary_table.style.apply(style_dataframe, axis=None)
-                st.dataframe(styled_summary, use_container_width=True)
-                
-                # 添加说明
-                with st.expander("📋 指标说明"):
-                    st.markdown("""
-                    - **σ（标准差）**：数据的离散程度，越小越好
-                    - **X（平均值）**：数据的集中趋势
-                    - **过程值差值**：实际均值与目标值的差异
-                    - **6σ/3σ**：过程能力的衡量标准
-                    - **CPK**：过程能力指数，≥1.33为优秀，1.0-1.33为良好，<1.0需改进
-                    - **公差**：允许的变动范围
-                    - **CP**：潜在过程能力指数
-                    """)
+                    if len(abnormal_results) > 0:
+                        st.warning(f"发现 {len(abnormal_results)} 个{dimension}/时间段存在CPK异常")
+                        st.dataframe(abnormal_results, use_container_width=True)
+                        
+                        # 下载异常结果
+                        file_prefix = 'cpk_zone_period_abnormal' if dimension == '大区' else 'cpk_period_abnormal'
+                        with metrics.stage('CSV导出', rows=len(abnormal_results), 表='CPK异常'):
+                            csv = abnormal_results.to_csv(index=False, encoding='utf-8-sig')
+                        st.download_button(
+                            label="下载异常数据",
+                            data=csv,
+                            file_name=f"{file_prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime='text/csv'
+                        )
+                    else:
+                        st.success("未发现CPK异常数据")
+                else:
+                    st.warning("没有足够的数据进行分析")
+            
+            elif filter_object == "按牧场":
+                # 按牧场和时间段汇总
+                results = capability_results
                 
-                # 计算详细统计指标
-                st.header("📈 详细分析结果")
-                results = stats_calculator.calculate_statistics(
-                    filtered_df, 
-                    coefficients,
-                    cpk_threshold_type=cpk_threshold_type,
-                    cpk_threshold=cpk_threshold if cpk_threshold_type == "小于阈值为异常" else 1.0,
-                    cpk_min=cpk_min,
-                    cpk_max=cpk_max
+                if len(results) > 0:
+                    # 筛选包含异常的行
+                    abnormal_results = results[stats_calculator.abnormal_mask(results)]
+                    
+                    if len(abnormal_results) > 0:
+                        st.warning(f"发现 {len(abnormal_results)} 条CPK异常记录")
+                        st.dataframe(abnormal_results, use_container_width=True)
+                        
+                        # 下载异常结果
+                        with metrics.stage('CSV导出', rows=len(abnormal_results), 表='CPK异常'):
+                            csv = abnormal_results.to_csv(index=False, encoding='utf-8-sig')
+                        st.download_button(
+                            label="下载异常数据",
+                            data=csv,
+                            file_name=f"cpk_period_farm_abnormal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime='text/csv'
+                        )
+                    else:
+                        st.success("未发现CPK异常数据")
+                else:
+                    st.warning("没有足够的数据进行分析")
+
+    # CPK趋势：各牧场按入库日期的滚动窗口CPK，观察能力随时间的变化
+    st.header("CPK趋势")
+    st.info("💡 每个入库日期的CPK由截至当天的窗口内全部样本计算，窗口内少于2个样本时不显示")
+    
+    trend_col1, trend_col2, trend_col3 = st.columns([3, 1, 1])
+    with trend_col1:
+        trend_farm_options = farm_options()
+        trend_farms = st.multiselect(
+            "选择奶源地",
+            options=trend_farm_options,
+            default=trend_farm_options[:3],
+            key="trend_farms"
+        )
+    with trend_col2:
+        trend_trait = st.selectbox("性状", stats_calculator.display_traits, key="trend_trait")
+    with trend_col3:
+        trend_window = st.number_input("窗口天数", min_value=1, max_value=365, value=ROLLING_WINDOW_DAYS, step=1,
+                                       key="trend_window")
+    
+    if st.button("显示CPK趋势"):
+        st.session_state['show_trend'] = True
+    
+    if st.session_state.get('show_trend'):
+        if not trend_farms:
+            st.warning("请选择至少一个奶源地")
+        else:
+            with st.spinner('正在计算...'):
+                # 一次算出筛选范围内所有牧场的序列，切换牧场和性状时直接取缓存
+                rolling = result_cache.get_or_compute(
+                    make_key(dataset_key, 'rolling_capability', analysis_filters, coefficients=coefficients,
+                             summer_window=summer_window, window_days=int(trend_window)),
+                    lambda: timed('滚动CPK', filtered_rows, stats_calculator.rolling_capability,
+                                  filtered_records(), coefficients, int(trend_window), summer_window=summer_window)
                 )
-                st.dataframe(results, use_container_width=True)
-                
-                # 下载结果
-                col1, col2 = st.columns(2)
-                with col1:
-                    # 下载汇总表
-                    summary_csv = summary_table.to_csv(index=False, encoding='utf-8-sig')
-                    st.download_button(
-                        label="下载整体分析结果",
-                        data=summary_csv,
-                        file_name=f"cpk_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime='text/csv'
-                    )
-                
-                with col2:
-                    # 下载详细结果
-                    csv = results.to_csv(index=False, encoding='utf-8-sig')
-                    st.download_button(
-                        label="下载详细分析结果",
-                        data=csv,
-                        file_name=f"cpk_details_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime='text/csv'
-                    )
+            
+            trend = rolling[rolling['奶源地名称'].isin(trend_farms)]
+            trend_table = trend.pivot(index='日期', columns='奶源地名称', values=f'{trend_trait}_cpk')
+            st.line_chart(trend_table, x_label="入库日期", y_label=f"{trend_trait} CPK（{int(trend_window)}天窗口）")
+            if cpk_threshold_type == "小于阈值为异常":
+                st.caption(f"当前判定标准：CPK < {cpk_threshold} 为异常")
+            else:
+                st.caption(f"当前判定标准：CPK < {cpk_min} 或 CPK > {cpk_max} 为异常")
+            
+            trend_columns = ['奶源地名称', '日期', '数据量'] + [
+                col for col in trend.columns if col.startswith(f'{trend_trait}_')
+            ]
+            with metrics.stage('CSV导出', rows=len(trend), 表='CPK趋势'):
+                csv = trend[trend_columns].to_csv(index=False, encoding='utf-8-sig')
+            st.download_button(
+                label="下载趋势数据",
+                data=csv,
+                file_name=f"cpk_trend_{trend_trait}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime='text/csv'
+            )
+
+    # SPC控制图：各牧场按日子组判异，找出过程失控的时间点
+    st.header("SPC控制图")
+    st.info("💡 每个牧场每个入库日期的样本为一个子组，控制限由该牧场在筛选范围内的全部数据估计")
+    
+    if st.button("计算控制图"):
+        st.session_state['show_spc'] = True
+    
+    if st.session_state.get('show_spc'):
+        with st.spinner('正在计算...'):
+            # 只缓存判异记录（完整的控制图数据与原始数据同量级），单个牧场的控制图显示时再算
+            spc_violations = result_cache.get_or_compute(
+                make_key(dataset_key, 'control_violations', analysis_filters),
+                lambda: timed('控制图判异', filtered_rows,
+                              lambda: control_charts.violations(control_charts.calculate(filtered_records())))
+            )
         
-        # CPK异常筛选
-        st.header("CPK异常筛选")
-        st.info("💡 CPK异常筛选基于上方数据筛选的结果")
+        spc_col1, spc_col2 = st.columns(2)
+        with spc_col1:
+            spc_types = st.multiselect("控制图", options=CHART_TYPES, default=CHART_TYPES, key="spc_types")
+        with spc_col2:
+            spc_traits = st.multiselect("性状", options=stats_calculator.display_traits,
+                                        default=stats_calculator.display_traits, key="spc_traits")
+        shown_violations = spc_violations[spc_violations['图表'].isin(spc_types) & spc_violations['性状'].isin(spc_traits)]
         
-        # 显示当前判定标准
-        if cpk_threshold_type == "小于阈值为异常":
-            st.success(f"📊 当前判定标准：CPK < {cpk_threshold} 为异常")
+        if len(shown_violations) > 0:
+            st.warning(f"发现 {len(shown_violations)} 条判异记录，涉及 {shown_violations['奶源地名称'].nunique()} 个奶源地")
+            st.dataframe(shown_violations, hide_index=True, use_container_width=True)
+            with metrics.stage('CSV导出', rows=len(shown_violations), 表='SPC判异记录'):
+                csv = shown_violations.to_csv(index=False, encoding='utf-8-sig')
+            st.download_button(
+                label="下载判异记录",
+                data=csv,
+                file_name=f"spc_violations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime='text/csv'
+            )
         else:
-            st.success(f"📊 当前判定标准：CPK < {cpk_min} 或 CPK > {cpk_max} 为异常")
+            st.success("未发现判异记录")
         
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("分析设置")
-            # 分析粒度
-            analysis_period = st.radio(
-                "分析粒度",
-                options=["按月", "按季度", "按年"],
-                index=0
+        # 单个牧场的控制图
+        spc_farm_options = farm_options()
+        spc_farm_default = shown_violations['奶源地名称'].iloc[0] if len(shown_violations) > 0 else None
+        spc_col3, spc_col4 = st.columns(2)
+        with spc_col3:
+            spc_farm = st.selectbox(
+                "查看奶源地",
+                options=spc_farm_options,
+                index=spc_farm_options.index(spc_farm_default) if spc_farm_default in spc_farm_options else 0,
+                key="spc_farm"
             )
+        with spc_col4:
+            spc_trait = st.selectbox("查看性状", stats_calculator.display_traits, key="spc_trait")
         
-        with col2:
-            st.subheader("分析维度")
-            filter_object = st.radio(
-                "选择分析维度",
-                options=["按大区", "按区域", "按牧场"],
-                index=1  # 默认选中"按区域"
-            )
+        if spc_farm is not None:
+            farm_charts = control_charts.calculate(filtered_records([spc_farm]))
+            if len(farm_charts) > 0:
+                farm_charts = farm_charts[farm_charts['性状'] == spc_trait].set_index('日期')
+            if len(farm_charts) > 0:
+                st.line_chart(farm_charts[['均值', '中心线', 'X̄上限', 'X̄下限']], y_label=f"{spc_trait} X̄图")
+                st.line_chart(farm_charts[['EWMA', 'EWMA上限', 'EWMA下限']], y_label=f"{spc_trait} EWMA")
+                st.line_chart(farm_charts[['CUSUM上', 'CUSUM下']], y_label=f"{spc_trait} CUSUM（判定界限 {control_charts.cusum_h:g}）")
+            else:
+                st.caption("该奶源地没有此性状的数据")
+
+    # 系数假设分析：分组统计量只计算一次，批量评估多组系数和判定阈值
+    st.header("系数假设分析")
+    st.info("💡 按上方CPK异常筛选的分析粒度和维度分组，统计各组系数和阈值下CPK异常的分组数")
+    if summer_window is not None:
+        st.caption("按入库日期区分季节：两季取值不同的系数分夏季、冬季分别设置，相同的同时作用于两季")
+    
+    with st.expander("设置系数取值", expanded=not st.session_state.get('show_sweep')):
+        st.caption("多个取值用逗号分隔（如 3.0, 3.2），或用 起始:结束:步长（如 3.0:3.4:0.1）")
+        current_values = sweep_defaults(coefficients)
+        sweep_texts = {}
+        sweep_cols = st.columns(3)
+        for position, (name, value) in enumerate(current_values.items()):
+            with sweep_cols[position % 3]:
+                sweep_texts[name] = st.text_input(f"{name}取值", value=f"{value:g}", key=f"sweep_{name}")
         
-        if st.button("筛选CPK异常"):
-            with st.spinner('正在筛选异常数据...'):
-                # 计算统计数据
-                coefficients = {
-                    '脂肪': coef_fat,
-                    '蛋白': coef_protein,
-                    '干物质': coef_dry,
-                    '体细胞': coef_cell,
-                    '酸度_min': acid_min,
-                    '酸度_max': acid_max,
-                    '酸度_tolerance': tolerance_acid
-                }
-                
-                # 使用筛选后的数据进行CPK异常筛选
-                cpk_df = filtered_df.copy()  # 使用筛选后的数据
+        if cpk_threshold_type == "小于阈值为异常":
+            threshold_text = st.text_input("CPK阈值（逗号分隔）", value=f"0.67, {cpk_threshold:g}, 1.33", key="sweep_thresholds")
+        else:
+            threshold_text = st.text_input("CPK正常范围（最小值~最大值，多个用分号分隔）",
+                                           value=f"{cpk_min:g}~{cpk_max:g}", key="sweep_ranges")
+    
+    if st.button("运行假设分析"):
+        st.session_state['show_sweep'] = True
+    
+    if st.session_state.get('show_sweep'):
+        try:
+            sweep_values = {name: parse_values(text) for name, text in sweep_texts.items()}
+            if cpk_threshold_type == "小于阈值为异常":
+                sweep_thresholds = parse_values(threshold_text)
+            else:
+                sweep_thresholds = parse_ranges(threshold_text)
+            sweep_grid = coefficient_grid(current_values, sweep_values)
+        except ValueError as e:
+            st.error(f"取值格式有误: {str(e)}")
+            sweep_grid = None
+        
+        if sweep_grid is not None:
+            with st.spinner('正在计算...'):
+                # 按季节给出系数时与CPK异常筛选相同，时间段内再按夏季/冬季分组
+                season_keys = [SEASON_COLUMN] if summer_window is not None else []
                 
-                # 根据分析粒度添加时间列
-                if '入库日期' in cpk_df.columns:
-                    if analysis_period == "按月":
-                        cpk_df['时间段'] = cpk_df['入库日期'].dt.to_period('M')
-                    elif analysis_period == "按季度":
-                        cpk_df['时间段'] = cpk_df['入库日期'].dt.to_period('Q')
-                    elif analysis_period == "按年":
-                        cpk_df['时间段'] = cpk_df['入库日期'].dt.to_period('Y')
+                def compute_sweep_moments():
+                    if sql_backend is not None:
+                        return timed('分组统计量（数据库）', filtered_rows, sql_backend.group_moments,
+                                     season_keys + DIMENSION_COLUMNS[filter_object], analysis_period,
+                                     summer_window=summer_window, **analysis_filters)
+                    return timed('分组统计量', filtered_rows, cube.filter(zones, regions, areas, date_range, farms).rollup,
+                                 analysis_period, DIMENSION_COLUMNS[filter_object], summer_window)
                 
-                # 根据筛选范围计算
-                if True:  # 始终执行分析
-                    # 单月分析
-                    if filter_object == "按大区":
-                        # 按大区和月份分组计算
-                        results_list = []
-                        
-                        # 获取所有大区和时间段的组合
-                        if '时间段' in cpk_df.columns and '大区' in cpk_df.columns:
-                            grouped = cpk_df.groupby(['时间段', '大区'])
-                            
-                            for (period, zone), group_data in grouped:
-                                # 计算每个大区每个时间段的统计指标
-                                period_summary = stats_calculator.calculate_summary_table(group_data, coefficients)
-                                
-                                # 提取CPK值
-                                cpk_row = period_summary[period_summary['能力分析'] == 'cpk']
-                                if not cpk_row.empty:
-                                    row_dict = {
-                                        '时间段': str(period),
-                                        '大区': zone,
-                                        '数据量': len(group_data)
-                                    }
-                                    
-                                    # 添加各性状的CPK值
-                                    for trait in ['脂肪', '蛋白', '干物质', '酸度', '体细胞']:
-                                        if trait in cpk_row.columns:
-                                            cpk_value = cpk_row[trait].values[0]
-                                            try:
-                                                cpk_float = float(cpk_value)
-                                                row_dict[f'{trait}_CPK'] = cpk_float
-                                                # 判断是否异常
-                                                if cpk_threshold_type == "小于阈值为异常":
-                                                    row_dict[f'{trait}_状态'] = '异常' if cpk_float < cpk_threshold else '正常'
-                                                else:
-                                                    row_dict[f'{trait}_状态'] = '异常' if (cpk_float < cpk_min or cpk_float > cpk_max) else '正常'
-                                            except:
-                                                row_dict[f'{trait}_CPK'] = '-'
-                                                row_dict[f'{trait}_状态'] = '-'
-                                    
-                                    results_list.append(row_dict)
-                        
-                        if results_list:
-                            results_df = pd.DataFrame(results_list)
-                            
-                            # 筛选异常记录
-                            status_columns = [col for col in results_df.columns if col.endswith('_状态')]
-                            if status_columns:
-                                mask = results_df[status_columns].apply(lambda row: '异常' in row.values, axis=1)
-                                abnormal_results = results_df[mask]
-                                
-                                if len(abnormal_results) > 0:
-                                    st.warning(f"发现 {len(abnormal_results)} 个大区/时间段存在CPK异常")
-                                    st.dataframe(abnormal_results, use_container_width=True)
-                                    
-                                    # 下载异常结果
-                                    csv = abnormal_results.to_csv(index=False, encoding='utf-8-sig')
-                                    st.download_button(
-                                        label="下载异常数据",
-                                        data=csv,
-                                        file_name=f"cpk_zone_period_abnormal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                        mime='text/csv'
-                                    )
-                                else:
-                                    st.success("未发现CPK异常数据")
-                            else:
-                                st.error("无法计算CPK值")
-                        else:
-                            st.warning("没有足够的数据进行分析")
-                    
-                    elif filter_object == "按区域":
-                        # 按区域和时间段分组计算
-                        results_list = []
-                        
-                        # 获取所有区域和时间段的组合
-                        if '时间段' in cpk_df.columns and '区域' in cpk_df.columns:
-                            grouped = cpk_df.groupby(['时间段', '区域'])
-                            
-                            for (period, region), group_data in grouped:
-                                # 计算每个区域每个时间段的统计指标
-                                period_summary = stats_calculator.calculate_summary_table(group_data, coefficients)
-                                
-                                # 提取CPK值
-                                cpk_row = period_summary[period_summary['能力分析'] == 'cpk']
-                                if not cpk_row.empty:
-                                    row_dict = {
-                                        '时间段': str(period),
-                                        '区域': region,
-                                        '数据量': len(group_data)
-                                    }
-                                    
-                                    # 添加各性状的CPK值
-                                    for trait in ['脂肪', '蛋白', '干物质', '酸度', '体细胞']:
-                                        if trait in cpk_row.columns:
-                                            cpk_value = cpk_row[trait].values[0]
-                                            try:
-                                                cpk_float = float(cpk_value)
-                                                row_dict[f'{trait}_CPK'] = cpk_float
-                                                # 判断是否异常
-                                                if cpk_threshold_type == "小于阈值为异常":
-                                                    row_dict[f'{trait}_状态'] = '异常' if cpk_float < cpk_threshold else '正常'
-                                                else:
-                                                    row_dict[f'{trait}_状态'] = '异常' if (cpk_float < cpk_min or cpk_float > cpk_max) else '正常'
-                                            except:
-                                                row_dict[f'{trait}_CPK'] = '-'
-                                                row_dict[f'{trait}_状态'] = '-'
-                                    
-                                    results_list.append(row_dict)
-                        
-                        if results_list:
-                            results_df = pd.DataFrame(results_list)
-                            
-                            # 筛选异常记录
-                            status_columns = [col for col in results_df.columns if col.endswith('_状态')]
-                            if status_columns:
-                                mask = results_df[status_columns].apply(lambda row: '异常' in row.values, axis=1)
-                                abnormal_results = results_df[mask]
-                                
-                                if len(abnormal_results) > 0:
-                                    st.warning(f"发现 {len(abnormal_results)} 个区域/时间段存在CPK异常")
-                                    st.dataframe(abnormal_results, use_container_width=True)
-                                    
-                                    # 下载异常结果
-                                    csv = abnormal_results.to_csv(index=False, encoding='utf-8-sig')
-                                    st.download_button(
-                                        label="下载异常数据",
-                                        data=csv,
-                                        file_name=f"cpk_period_abnormal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                        mime='text/csv'
-                                    )
-                                else:
-                                    st.success("未发现CPK异常数据")
-                            else:
-                                st.error("无法计算CPK值")
-                        else:
-                            st.warning("没有足够的数据进行分析")
-                    
-                    elif filter_object == "按牧场":
-                        # 按牧场和时间段分组计算
-                        results = stats_calculator.calculate_statistics(
-                            cpk_df, 
-                            coefficients,
-                            cpk_threshold_type=cpk_threshold_type,
-                            cpk_threshold=cpk_threshold if cpk_threshold_type == "小于阈值为异常" else 1.0,
-                            cpk_min=cpk_min,
-                            cpk_max=cpk_max
-                        )
-                        
-                        # 筛选包含异常的行（状态列已经在calculate_statistics中生成）
-                        abnormal_columns = [col for col in results.columns if col.endswith('_cpk_状态')]
-                        mask = results[abnormal_columns].apply(lambda row: '异常' in row.values, axis=1)
-                        abnormal_results = results[mask]
-                        
-                        if len(abnormal_results) > 0:
-                            st.warning(f"发现 {len(abnormal_results)} 条CPK异常记录")
-                            st.dataframe(abnormal_results, use_container_width=True)
-                            
-                            # 下载异常结果
-                            csv = abnormal_results.to_csv(index=False, encoding='utf-8-sig')
-                            st.download_button(
-                                label="下载异常数据",
-                                data=csv,
-                                file_name=f"cpk_period_farm_abnormal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                mime='text/csv'
-                            )
-                        else:
-                            st.success("未发现CPK异常数据")
-                else:
-                    # 整体分析（原有逻辑）
-                    st.info("整体分析模式已移除，请选择单月分析")
+                # 分组统计量与系数无关，相同筛选条件和分组直接取缓存
+                sweep_moments = result_cache.get_or_compute(
+                    make_key(dataset_key, 'rollup_moments', analysis_filters, summer_window=summer_window,
+                             period=analysis_period, dimension=filter_object),
+                    compute_sweep_moments
+                )
+                sweep_results = timed('系数假设分析', len(sweep_moments) * len(sweep_grid), sweep_abnormal_counts,
+                                      sweep_moments, sweep_grid, sweep_thresholds, cpk_threshold_type, stats_calculator,
+                                      coefficients=coefficients)
+            
+            st.caption(f"共评估 {len(sweep_grid)} 组系数 × {len(sweep_thresholds)} 个判定标准，"
+                       f"{len(sweep_moments)} 个分组（{filter_object}，{analysis_period}）")
+            st.dataframe(sweep_results, hide_index=True, use_container_width=True)
+            
+            with metrics.stage('CSV导出', rows=len(sweep_results), 表='系数假设分析'):
+                csv = sweep_results.to_csv(index=False, encoding='utf-8-sig')
+            st.download_button(
+                label="下载假设分析结果",
+                data=csv,
+                file_name=f"cpk_coefficient_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime='text/csv'
+            )
 
-else:
-    # 默认数据路径
-    default_path = "/Users/Shared/Files From d.localized/projects/cpk_data_analyze/data/2024年全年数据.xlsx"
-    if os.path.exists(default_path):
-        if st.button("使用默认数据文件"):
-            st.session_state['use_default'] = True
-            st.rerun()
-    
-    # 检查是否需要加载默认数据
-    if 'use_default' in st.session_state and st.session_state['use_default']:
-        with st.spinner('正在读取数据（首次加载需要一些时间）...'):
-            df = data_processor.load_data(default_path)
-            if df is not None:
-                st.session_state['df'] = df
-                st.session_state['use_default'] = False
-                st.rerun()
\ No newline at end of file
+if sql_backend is not None:
+    sql_backend.close()
+
+# 性能指标（放在脚本末尾，包含本次运行的各阶段）
+with st.sidebar:
+    with st.expander("⏱ 性能指标"):
+        if metrics.records:
+            st.dataframe(pd.DataFrame(list(metrics.records)[::-1]), hide_index=True, use_container_width=True)
+        else:
+            st.caption("暂无记录")
+        st.caption(f"完整记录保存在 {metrics.log_path}")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+性能测试：用合成数据测量读取Excel、筛选、汇总表、详细统计和各CPK异常筛选模式的耗时与峰值内存，
+并与保存的基准结果比较
+
+示例：
+    python3 -m benchmarks.run_benchmarks --rows 1000000 --farms 2000
+    python3 -m benchmarks.run_benchmarks --rows 100000 --farms 500 --save-baseline
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_data import generate, write_excel
+from utils.batch_report import DIMENSION_COLUMNS, default_coefficients, period_capability
+from utils.data_processor import DataProcessor
+from utils.excel_reader import finalize_columns
+from utils.filter_index import FilterIndex
+from utils.parallel_loader import load_workbooks
+from utils.statistics_calculator import StatisticsCalculator
+from utils.stats_cube import StatsCube
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# 耗时超过基准的此比例时标记为变慢
+REGRESSION_TOLERANCE = 0.2
+
+
+def measure(func, repeat):
+    """返回 (结果, 最短耗时秒数, 峰值内存字节)；耗时取多次运行的最小值，峰值内存另外单独运行一次测量"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def run(rows, farms, excel_rows, repeat, seed=0):
+    """运行全部测试项，返回 {测试项: {'seconds', 'rows', 'peak_mb'}}"""
+    results = {}
+
+    def record(name, func, n_rows, times=repeat):
+        value, seconds, peak = measure(func, times)
+        results[name] = {'seconds': seconds, 'rows': n_rows, 'peak_mb': peak / 1024 ** 2}
+        print(f"  {name:<28} {seconds:>9.3f}s  {n_rows / seconds if seconds > 0 else float('inf'):>14,.0f} 行/秒"
+              f"  峰值 {peak / 1024 ** 2:>8.1f}MB")
+        return value
+
+    print(f"生成合成数据：{rows:,} 行，{farms:,} 个牧场")
+    raw = generate(rows, farms, seed=seed)
+
+    # 读取Excel（写出的文件较大，只用前 excel_rows 行；读取只运行一次）
+    if excel_rows:
+        excel_part = raw.iloc[:min(rows, excel_rows)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'benchmark.xlsx')
+            print(f"写出测试用Excel：{len(excel_part):,} 行")
+            write_excel(excel_part, path)
+            record('读取Excel', lambda: load_workbooks([path]), len(excel_part), times=1)
+
+    df = record('统一类型', lambda: finalize_columns(raw.copy()), rows)
+    del raw
+
+    calculator = StatisticsCalculator()
+    processor = DataProcessor()
+    coefficients = default_coefficients('夏季')
+    threshold_args = {'cpk_threshold_type': '小于阈值为异常', 'cpk_threshold': 1.0, 'cpk_min': -999, 'cpk_max': 1.0}
+
+    index = record('构建筛选索引', lambda: FilterIndex(df), rows)
+    cube = record('构建统计立方体', lambda: StatsCube.from_frame(df), rows)
+
+    # 典型筛选：一个大区 + 一个季度
+    zone = df['大区'].cat.categories[0]
+    first_day = df['入库日期'].min()
+    date_range = (first_day.date(), (first_day + pd.Timedelta(days=90)).date())
+    record('筛选（掩码）', lambda: processor.filter_data(df, [zone], None, None, date_range), rows)
+    record('筛选（索引）', lambda: processor.filter_data(df, [zone], None, None, date_range, index=index), rows)
+
+    record('整体汇总表', lambda: calculator.calculate_summary_table(df, coefficients), rows)
+    record('详细统计', lambda: calculator.calculate_statistics(df, coefficients, **threshold_args), rows)
+
+    for dimension in DIMENSION_COLUMNS:
+        for period in StatsCube.period_freqs:
+            record(f'CPK异常 {dimension} {period}',
+                   lambda: period_capability(cube, period, dimension, coefficients, calculator=calculator, **threshold_args),
+                   rows)
+
+    return results
+
+
+def compare(results, baseline):
+    """与基准比较，返回变慢的测试项"""
+    regressions = []
+    print("\n与基准比较（耗时 当前/基准）：")
+    for name, current in results.items():
+        if name not in baseline:
+            print(f"  {name:<28} 无基准")
+            continue
+        ratio = current['seconds'] / baseline[name]['seconds'] if baseline[name]['seconds'] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + REGRESSION_TOLERANCE:
+            flag = '  ← 变慢'
+            regressions.append(name)
+        elif ratio < 1 - REGRESSION_TOLERANCE:
+            flag = '  ← 变快'
+        print(f"  {name:<28} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="牧场数据CPK分析 - 性能测试")
+    parser.add_argument("--rows", type=int, default=100000, help="数据行数（1万至1000万，默认10万）")
+    parser.add_argument("--farms", type=int, default=500, help="牧场数（50至5000，默认500）")
+    parser.add_argument("--excel-rows", type=int, default=100000, help="读取Excel测试使用的行数（0表示跳过，默认10万）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，耗时取最小值（默认3）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准结果文件（JSON）")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为该规模的基准")
+    parser.add_argument("--output", help="把本次结果另存为JSON")
+    args = parser.parse_args(argv)
+
+    scenario = f"{args.rows}x{args.farms}"
+    print(f"测试规模 {scenario}，Python {platform.python_version()}，{platform.machine()}，{os.cpu_count()} 核")
+    results = run(args.rows, args.farms, args.excel_rows, args.repeat)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    regressions = []
+    if scenario in baselines:
+        regressions = compare(results, baselines[scenario]['results'])
+    else:
+        print(f"\n{args.baseline} 中没有 {scenario} 的基准")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'scenario': scenario, 'results': results}, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        baselines[scenario] = {
+            'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'machine': f"{platform.machine()} / {os.cpu_count()} 核 / Python {platform.python_version()}",
+            'results': results
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"已保存基准到 {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
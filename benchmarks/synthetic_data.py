@@ -0,0 +1,89 @@
+"""
+合成牧场质检数据生成器（与真实Excel相同的列），用于性能测试
+"""
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# Excel单个工作表的行数上限（含表头），超过时分多个工作表写入
+EXCEL_MAX_ROWS = 1048575
+
+# 各性状的基准均值和标准差（夏季略低于冬季，与 config.py 的季节系数一致）
+TRAIT_PARAMS = {
+    '脂肪': (3.6, 0.25, 2),
+    '蛋白': (3.15, 0.12, 2),
+    '干物质': (12.2, 0.35, 2),
+    '酸度': (14.5, 1.0, 1),
+    '体细胞': (22.0, 6.0, 1)
+}
+
+ZONE_NAMES = ['华北', '华东', '华南', '华中', '西北', '西南', '东北']
+
+
+def generate(rows=100000, farms=500, start='2024-01-01', days=365, seed=0):
+    """生成 rows 条、farms 个牧场的数据，列与读取Excel的原始结果相同（文字为object，数值为float64）
+
+    层级为 大区 → 区域 → 地区 → 奶源地 的树；每个牧场有自己的均值偏移，夏季（5-9月）脂肪、蛋白偏低；
+    约2%的性状值缺失
+    """
+    rng = np.random.default_rng(seed)
+
+    # 层级：约每8个牧场一个地区，每3个地区一个区域，区域平均分配到大区
+    n_areas = max(4, farms // 8)
+    n_regions = max(2, n_areas // 3)
+    n_zones = min(len(ZONE_NAMES), max(2, n_regions // 3))
+    farm_area = rng.integers(0, n_areas, farms)
+    area_region = np.arange(n_areas) % n_regions
+    region_zone = np.arange(n_regions) % n_zones
+
+    zone_names = np.array(ZONE_NAMES[:n_zones], dtype=object)
+    region_names = np.array([f'{zone_names[region_zone[i]]}区域{i + 1:02d}' for i in range(n_regions)], dtype=object)
+    area_names = np.array([f'地区{i + 1:03d}' for i in range(n_areas)], dtype=object)
+    farm_names = np.array([f'牧场{i + 1:04d}' for i in range(farms)], dtype=object)
+    farm_codes = 100000 + np.arange(farms)
+
+    # 牧场规模不均：部分大牧场的记录多
+    weights = rng.pareto(1.5, farms) + 1
+    farm = rng.choice(farms, size=rows, p=weights / weights.sum())
+    area = farm_area[farm]
+    region = area_region[area]
+
+    day = rng.integers(0, days, rows)
+    received = pd.Timestamp(start) + pd.to_timedelta(day, unit='D') + pd.to_timedelta(rng.integers(0, 86400, rows), unit='s')
+    registered = received.normalize() - pd.to_timedelta(rng.integers(0, 3, rows), unit='D')
+    summer = np.isin(received.month, [5, 6, 7, 8, 9])
+
+    data = {
+        '大区': zone_names[region_zone[region]],
+        '区域': region_names[region],
+        '地区': area_names[area],
+        '奶源地编码': farm_codes[farm],
+        '奶源地名称': farm_names[farm],
+        '入库日期': received,
+        '上号日期': registered
+    }
+    for trait, (mean, std, decimals) in TRAIT_PARAMS.items():
+        farm_offset = rng.normal(0, std * 0.5, farms)
+        seasonal = np.where(summer, -0.2 * std, 0.0) if trait in ('脂肪', '蛋白') else 0.0
+        values = np.round(mean + farm_offset[farm] + seasonal + rng.normal(0, std, rows), decimals)
+        values[rng.random(rows) < 0.02] = np.nan
+        data[trait] = values
+
+    return pd.DataFrame(data)
+
+
+def write_excel(df, path):
+    """以openpyxl只写模式写出Excel，超过单表行数上限时分多个工作表"""
+    workbook = Workbook(write_only=True)
+    columns = list(df.columns)
+    for sheet_number, start in enumerate(range(0, max(len(df), 1), EXCEL_MAX_ROWS), start=1):
+        worksheet = workbook.create_sheet(f'数据{sheet_number}')
+        worksheet.append(columns)
+        chunk = df.iloc[start:start + EXCEL_MAX_ROWS]
+        for row in chunk.itertuples(index=False, name=None):
+            worksheet.append([None if isinstance(value, float) and np.isnan(value)
+                              else value.to_pydatetime() if isinstance(value, pd.Timestamp)
+                              else value.item() if hasattr(value, 'item')
+                              else value
+                              for value in row])
+    workbook.save(path)
@@ -1,4 +1,5 @@
 # 系统配置文件
+import os
 
 # 密码配置
 SYSTEM_PASSWORD = "cpk2025"  # 可以在这里修改系统密码
@@ -18,6 +19,10 @@ WINTER_COEFFICIENTS = {
     '体细胞': 20.0
 }
 
+# 夏季时间段（月-日，每年相同，包含首尾两天），其余日期为冬季
+SUMMER_START = '05-01'
+SUMMER_END = '09-30'
+
 # 酸度默认参数
 ACID_PARAMS = {
     '最小值': 12.0,
@@ -30,3 +35,49 @@ CPK_THRESHOLDS = {
     '最小值': 0.0,
     '最大值': 1.0
 }
+
+# 数据缓存配置（解析后的Excel按文件内容hash存为Parquet）
+DATA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cache')
+DATA_CACHE_MAX_MB = 2048  # 缓存总大小上限，超出后淘汰最久未使用的文件
+
+# 本地累积数据集目录（按月追加的数据及分组统计量）
+DATA_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'store')
+
+# 多文件/多工作表并行解析的进程数上限（None表示使用全部CPU核）
+INGEST_MAX_WORKERS = None
+
+# 共享数据集注册表：各会话共用同一份解析后的数据，超出内存上限时淘汰没有会话使用的数据集
+DATASET_MEMORY_MAX_MB = 4096
+DATASET_REF_TTL = 3600  # 会话超过此秒数未访问数据集时视为已释放
+
+# 读取Excel时不保留的列（可加入如'上号日期'以节省内存；去掉上号日期后累积数据集按奶源地编码和入库日期去重）
+DROPPED_COLUMNS = []
+
+# 分析结果缓存：按数据集、筛选条件和参数复用计算结果，超出条目数或大小时淘汰最久未使用的结果
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_MB = 512
+
+# 各处理阶段的耗时、行数和内存变化日志（JSON-lines，每行一条记录）
+METRICS_LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metrics.jsonl')
+
+# 分块统计（数据量超出内存时使用）每次读取的行数
+STREAM_CHUNK_ROWS = 200000
+
+# 滚动CPK趋势的默认窗口天数
+ROLLING_WINDOW_DAYS = 30
+
+# CPK置信区间（bootstrap重抽样）的默认重抽样次数、置信水平和随机种子（固定种子使结果可复现）
+BOOTSTRAP_REPLICATES = 1000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+
+# 统计过程控制图参数：EWMA平滑系数λ和控制限宽度L，CUSUM参考值k和判定界限h（以标准误为单位），
+# 判定"连续多点在中心线同侧"的点数
+SPC_EWMA_LAMBDA = 0.2
+SPC_EWMA_L = 3.0
+SPC_CUSUM_K = 0.5
+SPC_CUSUM_H = 5.0
+SPC_RUN_LENGTH = 9
+
+# 嵌入式SQLite数据库（命令行 --backend sqlite 和页面上的数据库分析）：数据库文件目录
+SQL_DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'db')
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+命令行批量生成CPK报告（不依赖Streamlit，可用于定时任务）
+
+示例：
+    python3 cpk_report.py data/2024年全年数据.xlsx -o reports
+    python3 cpk_report.py 华东.xlsx 华北.xlsx --season 冬季 --period 按季度 --dimension 按牧场 --format xlsx
+    python3 cpk_report.py data/2024年全年数据.xlsx --season 按日期 --summer-window 05-01 09-30
+    python3 cpk_report.py 2025年1月.xlsx --backend sqlite --start 2023-01-01
+"""
+import argparse
+import json
+import sys
+import time
+
+import pandas as pd
+
+from config import CPK_THRESHOLDS, SUMMER_END, SUMMER_START
+from utils.batch_report import (DIMENSION_COLUMNS, OUTPUT_FORMATS, build_report, build_report_sql,
+                                build_report_streaming, default_coefficients, seasonal_coefficients, write_report)
+from utils.data_processor import DataProcessor
+from utils.parallel_loader import load_workbooks
+from utils.sql_backend import SqlBackend
+from utils.stats_cube import StatsCube
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="牧场数据CPK分析 - 批量生成报告")
+    parser.add_argument("files", nargs="*",
+                        help="Excel数据文件（可多个，读取每个文件中的所有数据工作表）；使用 --backend 时先导入数据库，可不给出")
+    parser.add_argument("-o", "--output-dir", default="reports", help="输出目录（默认 reports）")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="输出格式（默认 csv）")
+    parser.add_argument("--season", choices=["夏季", "冬季", "按日期"], default="夏季",
+                        help="使用 config.py 中的哪组季节系数（默认 夏季）；按日期：夏季时间段内用夏季系数，其余用冬季系数")
+    parser.add_argument("--summer-window", nargs=2, metavar=("START", "END"), default=[SUMMER_START, SUMMER_END],
+                        help=f"--season 按日期 时的夏季时间段（月-日，每年相同，默认 {SUMMER_START} {SUMMER_END}）")
+    parser.add_argument("--coefficients", help="系数JSON文件，键与页面上的系数相同（如 脂肪、酸度_min），未给出的键使用默认值；"
+                                               "按日期时可按季节给出（{\"夏季\": {...}, \"冬季\": {...}}）")
+    parser.add_argument("--period", choices=list(StatsCube.period_freqs), default="按月", help="CPK异常筛选的时间粒度")
+    parser.add_argument("--dimension", choices=list(DIMENSION_COLUMNS), default="按区域", help="CPK异常筛选的分析维度")
+    parser.add_argument("--cpk-threshold", type=float, default=CPK_THRESHOLDS['最大值'],
+                        help="CPK小于此值为异常（默认取 config.py 中的 CPK_THRESHOLDS）")
+    parser.add_argument("--cpk-range", type=float, nargs=2, metavar=("MIN", "MAX"),
+                        help="改为自定义范围判定：CPK在此范围外为异常")
+    parser.add_argument("--zones", nargs="+", help="只分析这些大区")
+    parser.add_argument("--regions", nargs="+", help="只分析这些区域")
+    parser.add_argument("--start", help="开始日期，如 2024-01-01")
+    parser.add_argument("--end", help="结束日期，如 2024-12-31")
+    parser.add_argument("--workers", type=int, help="并行解析的进程数（默认使用全部CPU核）")
+    parser.add_argument("--streaming", action="store_true",
+                        help="分块读取并合并统计量，内存占用只与分组数有关（用于超出内存的多年数据）")
+    parser.add_argument("--chunk-rows", type=int, help="分块读取时每块的行数（默认取 config.py 中的 STREAM_CHUNK_ROWS）")
+    parser.add_argument("--backend", choices=["sqlite"],
+                        help="把文件导入嵌入式SQLite数据库（已导入的跳过），筛选和分组汇总在数据库中完成，报告覆盖库中全部历史数据")
+    parser.add_argument("--db", help="--backend 使用的数据库文件（默认在 config.py 的 SQL_DB_DIR 下）")
+    parser.add_argument("--reload", action="store_true",
+                        help="与 --backend 一起使用：清空数据库后重新导入给出的文件，并按全部数据重算各性状的偏移")
+    args = parser.parse_args(argv)
+    if not args.files and not args.backend:
+        parser.error("需要给出数据文件（或使用 --backend 分析已导入的数据）")
+    if args.reload and not (args.backend and args.files):
+        parser.error("--reload 需要与 --backend 一起使用，并给出全部数据文件")
+    return args
+
+
+def filter_chunk(chunk, args):
+    """分块读取时对每块应用命令行给出的筛选条件"""
+    chunk = DataProcessor().filter_data(chunk, args.zones, args.regions)
+    # 与 filter_data 的日期条件相同；只给出一端时另一端不限
+    if args.start:
+        chunk = chunk[chunk['入库日期'] >= pd.Timestamp(args.start).replace(hour=0, minute=0, second=0)]
+    if args.end:
+        chunk = chunk[chunk['入库日期'] <= pd.Timestamp(args.end).replace(hour=23, minute=59, second=59)]
+    return chunk
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_time = time.time()
+
+    summer_window = None
+    if args.season == "按日期":
+        coefficients = seasonal_coefficients()
+        summer_window = tuple(args.summer_window)
+    else:
+        coefficients = default_coefficients(args.season)
+    if args.coefficients:
+        with open(args.coefficients, encoding='utf-8') as f:
+            overrides = json.load(f)
+        if summer_window is None:
+            coefficients.update(overrides)
+        else:
+            # 按季节给出的键只更新对应季节，其余键两季都更新
+            for season, values in coefficients.items():
+                values.update({key: value for key, value in overrides.items() if not isinstance(value, dict)})
+                values.update(overrides.get(season, {}))
+
+    if args.cpk_range:
+        threshold_args = {'cpk_threshold_type': '自定义范围', 'cpk_min': args.cpk_range[0], 'cpk_max': args.cpk_range[1]}
+    else:
+        threshold_args = {'cpk_threshold_type': '小于阈值为异常', 'cpk_threshold': args.cpk_threshold,
+                          'cpk_min': -999, 'cpk_max': args.cpk_threshold}
+
+    if args.backend:
+        backend = SqlBackend(args.db)
+        try:
+            if args.reload:
+                print(f"正在清空 {backend.path} 并重新导入 {len(args.files)} 个文件...")
+                imported = backend.reload(args.files, args.chunk_rows)
+                print(f"共导入 {imported:,} 条记录，用时 {time.time() - start_time:.1f} 秒")
+            elif args.files:
+                print(f"正在导入 {len(args.files)} 个文件到 {backend.path}...")
+                imported = backend.import_sources(args.files, args.chunk_rows)
+                print(f"新导入 {imported:,} 条记录（已导入过的文件跳过），用时 {time.time() - start_time:.1f} 秒")
+
+            # 与读入内存时相同；只给出一端时另一端取库中的最早/最晚日期
+            date_range = None
+            if args.start or args.end:
+                first, last = backend.date_bounds()
+                date_range = (args.start or first, args.end or last)
+            filters = {'zones': args.zones, 'regions': args.regions, 'date_range': date_range}
+            if date_range and None in date_range or backend.row_count(**filters) == 0:
+                print("筛选后没有数据", file=sys.stderr)
+                return 1
+
+            tables = build_report_sql(backend, coefficients, args.period, args.dimension,
+                                      summer_window=summer_window, filters=filters, **threshold_args)
+        finally:
+            backend.close()
+    elif args.streaming:
+        print(f"正在分块读取 {len(args.files)} 个文件...")
+        tables = build_report_streaming(args.files, coefficients, args.period, args.dimension,
+                                        chunk_rows=args.chunk_rows, chunk_filter=lambda chunk: filter_chunk(chunk, args),
+                                        summer_window=summer_window, **threshold_args)
+        if len(tables['details']) == 0:
+            print("筛选后没有数据", file=sys.stderr)
+            return 1
+    else:
+        print(f"正在读取 {len(args.files)} 个文件...")
+        df = load_workbooks(args.files, max_workers=args.workers)
+        if df is None or len(df) == 0:
+            print("没有读取到数据：各文件中没有包含数据的工作表", file=sys.stderr)
+            return 1
+        print(f"共 {len(df):,} 条记录，用时 {time.time() - start_time:.1f} 秒")
+
+        date_range = None
+        if args.start or args.end:
+            date_range = (args.start or df['入库日期'].min(), args.end or df['入库日期'].max())
+        df = DataProcessor().filter_data(df, args.zones, args.regions, None, date_range)
+        if len(df) == 0:
+            print("筛选后没有数据", file=sys.stderr)
+            return 1
+
+        tables = build_report(df, coefficients, args.period, args.dimension, summer_window=summer_window,
+                              **threshold_args)
+    paths = write_report(tables, args.output_dir, args.format)
+
+    print(f"发现 {len(tables['anomalies'])} 条CPK异常（{args.dimension}，{args.period}）")
+    for path in paths:
+        print(f"已写入 {path}")
+    print(f"完成，总用时 {time.time() - start_time:.1f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import generate
+from utils.excel_reader import finalize_columns
+
+
+@pytest.fixture
+def sample_df():
+    """小规模合成数据（与读取Excel后的列类型相同），含缺失值、只有一条记录的分组和某性状全部缺失的分组"""
+    df = finalize_columns(generate(rows=4000, farms=40, seed=1))
+    # 某牧场的酸度全部缺失，另加一条只有一行的牧场-月份分组
+    farm = df['奶源地名称'].cat.categories[0]
+    df.loc[df['奶源地名称'] == farm, '酸度'] = np.nan
+    single = df.iloc[[0]].copy()
+    single['入库日期'] = single['入库日期'] + np.timedelta64(400, 'D')
+    single['年月'] = single['入库日期'].dt.to_period('M')
+    return finalize_columns(pd.concat([df, single], ignore_index=True))
+
+
+@pytest.fixture
+def sample_file(sample_df, tmp_path):
+    """sample_df 保存的Parquet文件（用于分块读取和导入数据库）"""
+    path = str(tmp_path / 'sample.parquet')
+    sample_df.to_parquet(path, index=False)
+    return path
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+# 分块、立方体和数据库汇总与一次性读入计算只在浮点舍入上不同：保留三位小数后最多相差一个显示单位
+DISPLAY_TOLERANCE = 0.001
+
+
+def assert_frame_close(result, expected, tolerance=DISPLAY_TOLERANCE):
+    """两张结果表的列、行和文字相同，数值（整体分析表中的数字文本也按数值比较）相差不超过 tolerance"""
+    result = result.reset_index(drop=True)
+    expected = expected.reset_index(drop=True)
+    assert list(result.columns) == list(expected.columns)
+    assert len(result) == len(expected)
+    for col in expected.columns:
+        left = pd.to_numeric(result[col].astype(object), errors='coerce').to_numpy(dtype=float)
+        right = pd.to_numeric(expected[col].astype(object), errors='coerce').to_numpy(dtype=float)
+        numeric = ~np.isnan(right)
+        assert (np.isnan(left) == np.isnan(right)).all(), col
+        text = ~numeric & expected[col].notna().to_numpy()
+        assert (result[col].notna().to_numpy() == expected[col].notna().to_numpy()).all(), col
+        assert (result[col].astype(str)[text] == expected[col].astype(str)[text]).all(), col
+        assert (np.abs(left[numeric] - right[numeric]) <= tolerance + 1e-9).all(), col
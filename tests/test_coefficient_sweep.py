@@ -0,0 +1,44 @@
+import pytest
+
+from utils.batch_report import default_coefficients, period_capability, seasonal_coefficients
+from utils.coefficient_sweep import SWEEP_COEFFICIENTS, coefficient_grid, sweep_abnormal_counts, sweep_defaults
+from utils.seasons import default_window, is_seasonal
+from utils.statistics_calculator import StatisticsCalculator
+from utils.stats_cube import StatsCube
+
+THRESHOLDS = [0.67, 1.0, 1.33]
+
+
+@pytest.mark.parametrize('coefficients', [default_coefficients(), seasonal_coefficients()], ids=['普通', '按季节'])
+def test_sweep_counts_match_period_capability(sample_df, coefficients):
+    """每组系数、每个阈值下的异常分组数与用该组系数做CPK异常筛选得到的异常分组数相同"""
+    calculator = StatisticsCalculator()
+    cube = StatsCube.from_frame(sample_df)
+    summer_window = default_window() if is_seasonal(coefficients) else None
+    moments = cube.rollup('按月', ['区域'], summer_window)
+
+    defaults = sweep_defaults(coefficients)
+    fat = next(name for name in defaults if name.endswith('脂肪'))
+    grid = coefficient_grid(defaults, {fat: [defaults[fat] - 0.2, defaults[fat]], '酸度_min': [12.0, 13.0]})
+    results = sweep_abnormal_counts(moments, grid, THRESHOLDS, calculator=calculator, coefficients=coefficients)
+
+    for position, setting in grid.iterrows():
+        setting_coefficients = _apply(coefficients, setting)
+        for threshold in THRESHOLDS:
+            capability = period_capability(cube, '按月', '按区域', setting_coefficients, calculator=calculator,
+                                           cpk_threshold_type='小于阈值为异常', cpk_threshold=threshold)
+            assert results.loc[position, f'CPK<{threshold:g}'] == calculator.abnormal_mask(capability).sum()
+
+
+def _apply(coefficients, setting):
+    """把一组假设取值写回页面上的系数字典"""
+    if not is_seasonal(coefficients):
+        return {**coefficients, **setting.to_dict()}
+    seasons = {season: dict(values) for season, values in coefficients.items()}
+    for name, value in setting.items():
+        for season, values in seasons.items():
+            if name in SWEEP_COEFFICIENTS:
+                values[name] = value
+            elif name.startswith(season):
+                values[name[len(season):]] = value
+    return seasons
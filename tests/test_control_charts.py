@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.control_charts import ControlCharts
+
+# 牧场A：只有4个日子组（少于 MIN_RANGE_SUBGROUPS），用日均值的移动极差估计σ
+FARM_A = [[3.1, 3.3], [3.6, 3.4], [3.0, 3.2], [3.5, 3.9]]
+# 牧场B：5个日子组、每组3个样本，用组内极差估计σ
+FARM_B = [[3.0, 3.2, 3.4], [3.1, 3.5, 3.3], [3.6, 3.2, 3.4], [3.0, 3.1, 3.5], [3.3, 3.7, 3.4]]
+
+
+def _frame(farm, days):
+    rows = []
+    for day, values in enumerate(days):
+        for value in values:
+            rows.append({'区域': '华北区域01', '地区': '地区001', '奶源地名称': farm,
+                         '入库日期': pd.Timestamp('2024-05-01') + pd.Timedelta(days=day), '脂肪': value})
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def charts():
+    df = pd.concat([_frame('牧场A', FARM_A), _frame('牧场B', FARM_B)], ignore_index=True)
+    return ControlCharts(traits=['脂肪']).calculate(df)
+
+
+def test_moving_range_fallback_matches_individuals_chart(charts):
+    """移动极差估计的是日均值的波动：X̄限 = 中心线 ± 2.66·MR̄（I-MR图），R图用换算后的单样本σ"""
+    chart = charts[charts['奶源地名称'] == '牧场A']
+    means = np.array([np.mean(values) for values in FARM_A])
+    center = np.mean(np.concatenate(FARM_A))
+    mr_bar = np.abs(np.diff(means)).mean()
+    sigma = mr_bar / 1.128 * np.sqrt(2)
+
+    np.testing.assert_allclose(chart['中心线'], center)
+    np.testing.assert_allclose(chart['X̄上限'], center + 3 / 1.128 * mr_bar)
+    np.testing.assert_allclose(chart['X̄下限'], center - 3 / 1.128 * mr_bar)
+    np.testing.assert_allclose(chart['R中心线'], 1.128 * sigma)
+    np.testing.assert_allclose(chart['R上限'], (1.128 + 3 * 0.853) * sigma)
+
+
+def test_range_estimate_matches_xbar_r_constants(charts):
+    """组内极差估计σ时与X̄-R图常数一致：n=3 时 A2=1.023、D4=2.574、D3=0"""
+    chart = charts[charts['奶源地名称'] == '牧场B']
+    center = np.mean(np.concatenate(FARM_B))
+    r_bar = np.mean([max(values) - min(values) for values in FARM_B])
+
+    np.testing.assert_allclose(chart['中心线'], center)
+    np.testing.assert_allclose(chart['X̄上限'], center + 1.023 * r_bar, rtol=1e-4)
+    np.testing.assert_allclose(chart['X̄下限'], center - 1.023 * r_bar, rtol=1e-4)
+    np.testing.assert_allclose(chart['R中心线'], r_bar)
+    np.testing.assert_allclose(chart['R上限'], 2.574 * r_bar, rtol=1e-3)
+    np.testing.assert_allclose(chart['R下限'], 0.0)
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from utils import data_processor_async
+from utils.data_processor_async import AsyncDataProcessor
+from utils.dataset_registry import DatasetRegistry
+from utils.disk_cache import DiskCache
+
+
+def _registry(tmp_path):
+    return DatasetRegistry(disk_cache=DiskCache(str(tmp_path)))
+
+
+def test_error_after_register_releases_session(sample_df, tmp_path, monkeypatch):
+    """注册后构建派生结构出错时释放本会话对数据集的引用"""
+    monkeypatch.setattr(data_processor_async, 'load_workbooks', lambda sources, **kwargs: sample_df)
+    registry = _registry(tmp_path)
+
+    def broken(df):
+        raise RuntimeError("构建失败")
+
+    job = AsyncDataProcessor()
+    job.start('key', [b''], registry, 'session', prepare={'立方体': broken})
+    job._thread.join()
+
+    assert job.error == "构建失败"
+    assert registry._entries['key']['refs'] == {}
+
+
+def test_restart_does_not_wait_for_previous_job(sample_df, tmp_path, monkeypatch):
+    """重新开始加载时只通知上一个任务取消，不等待它结束；旧任务不再改写新任务的状态"""
+    monkeypatch.setattr(data_processor_async, 'load_workbooks', lambda sources, **kwargs: sample_df)
+    registry = _registry(tmp_path)
+    release = threading.Event()
+
+    def slow(df):
+        release.wait(10)
+        return len(df)
+
+    job = AsyncDataProcessor()
+    job.start('first', [b''], registry, 'session', prepare={'立方体': slow, '索引': slow})
+    while job.status != "正在准备数据（立方体）...":
+        time.sleep(0.01)
+    first = job._thread
+
+    started = time.perf_counter()
+    job.start('second', [b''], registry, 'session')
+    assert time.perf_counter() - started < 1
+    assert first.is_alive()
+
+    job._thread.join()
+    release.set()
+    first.join()
+
+    assert job.key == 'second' and job.finished and job.status == "数据加载完成！"
+    # 被取消的旧任务释放了自己的引用
+    assert registry._entries['first']['refs'] == {}
+    assert 'session' in registry._entries['second']['refs']
@@ -0,0 +1,21 @@
+import pandas as pd
+
+from utils.disk_cache import DiskCache
+from utils.excel_reader import is_validated
+
+
+def test_round_trip_keeps_schema(sample_df, tmp_path):
+    """缓存命中得到的数据与新解析的类型相同（含取值为数字的分类列 奶源地编码）"""
+    cache = DiskCache(str(tmp_path))
+    assert cache.put('key', sample_df)
+    cached = cache.get('key')
+
+    assert is_validated(cached)
+    pd.testing.assert_frame_equal(cached, sample_df)
+
+
+def test_marker_alone_is_not_validated(sample_df):
+    """只带标记、层级列类型不对的数据不视为已统一类型"""
+    df = sample_df.astype({'奶源地编码': 'int64'})
+    df.attrs = dict(sample_df.attrs)
+    assert not is_validated(df)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.data_processor import DataProcessor
+from utils.filter_index import FilterIndex
+
+CONDITIONS = [
+    {},
+    {'date_range': ('2024-03-01', '2024-05-31')},
+    {'zones': ['华北'], 'date_range': ('2024-02-10', '2024-11-30')},
+    {'regions': ['华东区域02', '华北区域01'], 'areas': ['地区001', '地区002', '地区003']},
+]
+
+
+@pytest.mark.parametrize('conditions', CONDITIONS)
+def test_index_matches_mask_filter(sample_df, conditions):
+    """索引筛选与掩码筛选得到相同的行（索引结果按入库日期稳定排序）"""
+    shuffled = sample_df.sample(frac=1, random_state=0)
+    processor = DataProcessor()
+    expected = processor.filter_data(shuffled, **conditions)
+    result = processor.filter_data(shuffled, index=FilterIndex(shuffled), **conditions)
+
+    if conditions:
+        expected = expected.sort_values('入库日期', kind='stable')
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_index_keeps_no_sorted_copy(sample_df):
+    """未按日期排序的数据只保存行号，不另存一份排序后的数据"""
+    shuffled = sample_df.sample(frac=1, random_state=0)
+    index = FilterIndex(shuffled)
+    assert index.frame is shuffled
+    assert index.order is not None and len(index.order) == len(shuffled)
+
+    ordered = shuffled.sort_values('入库日期', kind='stable')
+    index = FilterIndex(ordered)
+    assert index.order is None
+    assert np.shares_memory(index.filter(date_range=('2024-03-01', '2024-03-31'))['脂肪'].to_numpy(),
+                            ordered['脂肪'].to_numpy())
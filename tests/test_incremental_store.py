@@ -0,0 +1,41 @@
+import os
+
+import pandas as pd
+
+from utils.batch_report import default_coefficients
+from utils.incremental_store import IncrementalStore, UNDATED_PARTITION
+from utils.statistics_calculator import StatisticsCalculator
+
+
+def _month(df, month):
+    return df[df['年月'].astype(str) == month]
+
+
+def test_append_rewrites_only_touched_months(sample_df, tmp_path):
+    """追加某月数据只改写该月分区，统计量与对全部数据重新计算的结果相同"""
+    store = IncrementalStore(str(tmp_path))
+    first = sample_df[sample_df['入库日期'] < '2024-07-01']
+    store.append(first, 'first')
+    january = os.stat(store.partition_path('2024-01')).st_mtime_ns
+
+    # 追加8月数据，其中一部分是对7月以前已有记录的更正
+    corrected = _month(first, '2024-03').head(20).copy()
+    corrected['脂肪'] = corrected['脂肪'] + 0.5
+    summary = store.append(pd.concat([_month(sample_df, '2024-08'), corrected]), 'second')
+
+    assert summary['改写分区'] == 2
+    assert summary['更新记录'] == 20
+    assert os.stat(store.partition_path('2024-01')).st_mtime_ns == january
+    assert store.partitions()[-1] != UNDATED_PARTITION
+
+    dataset = store.load_dataset()
+    assert len(dataset) == len(first) + len(_month(sample_df, '2024-08')) == summary['总记录数']
+    keys = ['奶源地编码', '入库日期', '上号日期']
+    stored = dataset.set_index(keys).loc[corrected.set_index(keys).index, '脂肪']
+    assert (stored.to_numpy() == corrected['脂肪'].to_numpy()).all()
+
+    coefficients = default_coefficients()
+    calculator = StatisticsCalculator()
+    expected = calculator.calculate_statistics(dataset, coefficients)
+    pd.testing.assert_frame_equal(store.statistics(coefficients).reset_index(drop=True),
+                                  expected.reset_index(drop=True))
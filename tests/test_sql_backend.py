@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+from tests.helpers import assert_frame_close
+from utils.batch_report import build_report, build_report_sql, default_coefficients, seasonal_coefficients
+from utils.data_processor import DataProcessor
+from utils.excel_reader import HIERARCHY_COLUMNS, finalize_columns, trait_values
+from utils.sql_backend import SqlBackend
+from utils.statistics_calculator import StatisticsCalculator
+
+THRESHOLD_ARGS = {'cpk_threshold_type': '小于阈值为异常', 'cpk_threshold': 1.0}
+FILTERS = {'regions': ['华东区域02', '华北区域01'], 'date_range': ('2024-02-10', '2024-11-30')}
+
+
+@pytest.fixture
+def backend(sample_file, tmp_path):
+    backend = SqlBackend(str(tmp_path / 'cpk.sqlite'))
+    backend.import_sources([sample_file], chunk_rows=700)
+    yield backend
+    backend.close()
+
+
+@pytest.mark.parametrize('dimension', ['按区域', '按牧场'])
+@pytest.mark.parametrize('coefficients', [default_coefficients(), seasonal_coefficients()], ids=['普通', '按季节'])
+@pytest.mark.parametrize('filters', [{}, FILTERS], ids=['全部', '筛选'])
+def test_sql_report_matches_in_memory(backend, sample_file, coefficients, dimension, filters):
+    """数据库中汇总得到的三张报告表与读入内存筛选后生成的相同（保留三位小数后最多相差一个显示单位）"""
+    df = finalize_columns(pd.read_parquet(sample_file))
+    df = DataProcessor().filter_data(df, None, filters.get('regions'), None, filters.get('date_range'))
+    expected = build_report(df, coefficients, '按月', dimension, **THRESHOLD_ARGS)
+    result = build_report_sql(backend, coefficients, '按月', dimension, filters=filters, **THRESHOLD_ARGS)
+    for name in expected:
+        assert_frame_close(result[name], expected[name])
+
+
+def test_records_match_filter_data(backend, sample_file):
+    """按筛选条件从数据库读回的记录与内存中筛选的记录相同"""
+    df = finalize_columns(pd.read_parquet(sample_file))
+    expected = DataProcessor().filter_data(df, None, FILTERS['regions'], None, FILTERS['date_range'])
+    result = backend.records(**FILTERS)
+
+    assert backend.row_count(**FILTERS) == len(expected) == len(result)
+    columns = ['奶源地名称', '入库日期', '脂肪', '体细胞']
+    expected = pd.DataFrame({col: expected[col] if col in ('奶源地名称', '入库日期') else trait_values(expected[col])
+                             for col in columns})
+    expected['奶源地名称'] = expected['奶源地名称'].astype(str)
+    result = result[columns].assign(奶源地名称=result['奶源地名称'].astype(str))
+    pd.testing.assert_frame_equal(result.sort_values(columns).reset_index(drop=True),
+                                  expected.sort_values(columns).reset_index(drop=True))
+
+
+def test_shifts_recomputed_on_full_load(backend, sample_df, sample_file, tmp_path):
+    """向空数据库导入后偏移为全部数据的均值（不是第一块的均值），重新导入时按新数据重算"""
+    shifts = backend.shifts()
+    for trait in backend.traits:
+        assert shifts[trait] == pytest.approx(sample_df[trait].astype(float).mean())
+
+    changed = sample_df.copy()
+    changed['脂肪'] = changed['脂肪'] + 1.0
+    path = str(tmp_path / 'changed.parquet')
+    changed.to_parquet(path, index=False)
+    assert backend.reload([path], chunk_rows=700) == len(changed)
+    assert backend.shifts()['脂肪'] == pytest.approx(shifts['脂肪'] + 1.0)
+    assert len(backend.sources()) == 1
+
+    # 之后追加的文件不改变偏移
+    assert backend.import_sources([sample_file]) == len(sample_df)
+    assert backend.shifts()['脂肪'] == pytest.approx(shifts['脂肪'] + 1.0)
+
+
+def test_group_order_and_categories_match_in_memory(sample_df, tmp_path):
+    """数字编码按整数保存和排序：数据库分组的顺序、读回记录的分类类型与读入内存时相同"""
+    # 编码位数不同时按文字排序（'15' < '8'）与按数字排序不同
+    df = sample_df.assign(奶源地编码=sample_df['奶源地编码'].cat.rename_categories(lambda code: (code - 100000) * 7 + 1))
+    path = str(tmp_path / 'codes.parquet')
+    df.to_parquet(path, index=False)
+    backend = SqlBackend(str(tmp_path / 'codes.sqlite'))
+    try:
+        backend.import_sources([path], chunk_rows=700)
+        group_cols = ['奶源地编码', '区域']
+        expected = StatisticsCalculator().calculate_group_moments(df, group_cols)
+        result = backend.group_moments(group_cols)
+        records = backend.records()
+    finally:
+        backend.close()
+
+    for col in group_cols:
+        assert result[col].dtype == df[col].dtype
+        assert result[col].tolist() == expected[col].tolist()
+    for col in HIERARCHY_COLUMNS:
+        assert records[col].dtype == df[col].dtype
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import generate
+from utils.batch_report import default_coefficients, seasonal_coefficients
+from utils.excel_reader import finalize_columns, trait_values
+from utils.statistics_calculator import StatisticsCalculator
+
+THRESHOLDS = [
+    {},
+    {'cpk_threshold_type': '小于阈值为异常', 'cpk_threshold': 1.0},
+    {'cpk_threshold_type': '自定义范围', 'cpk_min': 1.0, 'cpk_max': 1.67},
+]
+
+
+@pytest.mark.parametrize('threshold_args', THRESHOLDS)
+@pytest.mark.parametrize('coefficients', [default_coefficients(), seasonal_coefficients()], ids=['普通', '按季节'])
+def test_vectorized_matches_loop(sample_df, coefficients, threshold_args):
+    """向量化引擎与逐组计算的参考实现逐位相同（_segment_sums 需与pandas的成对求和一致）"""
+    calculator = StatisticsCalculator()
+    loop = calculator.calculate_statistics(sample_df.copy(), coefficients, engine='loop', **threshold_args)
+    vectorized = calculator.calculate_statistics(sample_df.copy(), coefficients, **threshold_args)
+    pd.testing.assert_frame_equal(loop.reset_index(drop=True), vectorized.reset_index(drop=True))
+
+
+def test_sample_covers_edge_groups(sample_df):
+    """测试数据确实包含单行分组和某性状全部缺失的分组"""
+    sizes = sample_df.groupby(['年月', '奶源地名称'], observed=True).size()
+    assert (sizes == 1).any()
+    assert sample_df.groupby('奶源地名称', observed=True)['酸度'].count().eq(0).any()
+
+
+def baseline_statistics(df, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
+    """改写前的 calculate_statistics（逐组计算，原样保留公式和舍入），作为向量化引擎的基准"""
+    traits = ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
+    results = []
+    for (period, farm, region, area), group_data in df.groupby(['年月', '奶源地名称', '区域', '地区']):
+        row_data = {'时间': str(period), '区域': region, '地区': area, '奶源地': farm}
+        for trait in traits:
+            trait_data = group_data[trait].dropna()
+            if len(trait_data) > 0:
+                sigma_raw = trait_data.std(ddof=1)
+                mean_raw = trait_data.mean()
+                if trait == '酸度':
+                    acid_min = coefficients.get('酸度_min', 12)
+                    acid_max = coefficients.get('酸度_max', 17.5)
+                    process_diff_raw = min(mean_raw - acid_min, acid_max - mean_raw)
+                    tolerance = coefficients.get('酸度_tolerance', 5.5)
+                else:
+                    coef = coefficients.get(trait, 0)
+                    process_diff_raw = abs(mean_raw - coef)
+                    tolerance = None
+                six_sigma_raw = sigma_raw * 6
+                three_sigma_raw = sigma_raw * 3
+                if three_sigma_raw > 0:
+                    cpk_raw = process_diff_raw / three_sigma_raw
+                else:
+                    cpk_raw = 0
+                if tolerance and six_sigma_raw > 0:
+                    cp_raw = tolerance / six_sigma_raw
+                else:
+                    cp_raw = None
+                row_data[f'{trait}_σ'] = round(sigma_raw, 3)
+                row_data[f'{trait}_均值'] = round(mean_raw, 3)
+                row_data[f'{trait}_过程值差值'] = round(process_diff_raw, 3)
+                row_data[f'{trait}_6σ'] = round(six_sigma_raw, 3)
+                row_data[f'{trait}_3σ'] = round(three_sigma_raw, 3)
+                row_data[f'{trait}_cpk'] = round(cpk_raw, 3)
+                row_data[f'{trait}_公差'] = round(tolerance, 3) if tolerance else '/'
+                row_data[f'{trait}_cp'] = round(cp_raw, 3) if cp_raw else '/'
+                if cpk_threshold_type == "小于阈值为异常":
+                    row_data[f'{trait}_cpk_状态'] = '异常' if cpk_raw < cpk_threshold else '正常'
+                elif cpk_threshold_type == "自定义范围":
+                    row_data[f'{trait}_cpk_状态'] = '异常' if (cpk_raw < cpk_min or cpk_raw > cpk_max) else '正常'
+                else:
+                    row_data[f'{trait}_cpk_状态'] = '-'
+            else:
+                for suffix in ['σ', '均值', '过程值差值', '6σ', '3σ', 'cpk', '公差', 'cp', 'cpk_状态']:
+                    row_data[f'{trait}_{suffix}'] = np.nan if suffix != 'cpk_状态' else '-'
+        results.append(row_data)
+    return pd.DataFrame(results).sort_values(['时间', '区域', '奶源地'])
+
+
+def baseline_frame(df):
+    """改写前读入的数据：层级列为普通文字，性状为float64"""
+    frame = df[['年月', '奶源地名称', '区域', '地区']].astype({'奶源地名称': object, '区域': object, '地区': object})
+    for trait in StatisticsCalculator().traits:
+        frame[trait] = trait_values(df[trait])
+    return frame
+
+
+@pytest.mark.parametrize('rows, threshold_args', [(None, args) for args in THRESHOLDS] + [(50000, THRESHOLDS[1])],
+                         ids=['样例-不判定', '样例-阈值', '样例-范围', '5万行'])
+def test_vectorized_matches_baseline(sample_df, rows, threshold_args):
+    """向量化引擎的结果与改写前的逐组公式和舍入逐位相同"""
+    df = sample_df if rows is None else finalize_columns(generate(rows=rows, farms=300, seed=7))
+    coefficients = default_coefficients()
+    expected = baseline_statistics(baseline_frame(df), coefficients, **threshold_args).reset_index(drop=True)
+    result = StatisticsCalculator().calculate_statistics(df, coefficients, **threshold_args).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result.astype(object), expected.astype(object))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import assert_frame_close
+from utils.batch_report import build_report, build_report_streaming, default_coefficients, seasonal_coefficients
+from utils.excel_reader import finalize_columns
+from utils.statistics_calculator import StatisticsCalculator
+from utils.streaming_stats import DETAIL_KEYS, MomentAccumulator, accumulate, streaming_statistics
+
+THRESHOLD_ARGS = {'cpk_threshold_type': '小于阈值为异常', 'cpk_threshold': 1.0}
+
+
+@pytest.mark.parametrize('chunk_rows', [333, 1000])
+def test_streaming_moments_match_in_memory(sample_file, chunk_rows):
+    """逐块合并的各组均值和σ与一次性计算的只差浮点舍入"""
+    calculator = StatisticsCalculator()
+    df = finalize_columns(pd.read_parquet(sample_file))
+    expected = calculator.calculate_group_moments(df, DETAIL_KEYS)
+    accumulator = MomentAccumulator(DETAIL_KEYS, calculator=calculator)
+    result = accumulate([sample_file], [accumulator], chunk_rows)[0].moments()
+
+    assert len(result) == len(expected)
+    for col in DETAIL_KEYS:
+        assert (result[col].astype(str) == expected[col].astype(str)).all()
+    for trait in calculator.traits:
+        np.testing.assert_array_equal(result[f'{trait}_n'], expected[f'{trait}_n'])
+        for stat in ['均值', 'σ']:
+            np.testing.assert_allclose(result[f'{trait}_{stat}'], expected[f'{trait}_{stat}'], rtol=1e-12)
+
+
+@pytest.mark.parametrize('chunk_rows', [333, 1000])
+def test_streaming_matches_calculate_statistics(sample_file, chunk_rows):
+    """分块计算的详细分析结果与整体计算相同（保留三位小数后最多相差一个显示单位）"""
+    coefficients = default_coefficients()
+    df = finalize_columns(pd.read_parquet(sample_file))
+    expected = StatisticsCalculator().calculate_statistics(df, coefficients, **THRESHOLD_ARGS)
+    result = streaming_statistics([sample_file], coefficients, chunk_rows=chunk_rows, **THRESHOLD_ARGS)
+    assert_frame_close(result, expected)
+
+
+@pytest.mark.parametrize('dimension', ['按区域', '按牧场'])
+@pytest.mark.parametrize('coefficients', [default_coefficients(), seasonal_coefficients()], ids=['普通', '按季节'])
+def test_streaming_report_matches_in_memory(sample_file, coefficients, dimension):
+    """分块生成的三张报告表与读入内存生成的相同（允许的差异同上）"""
+    df = finalize_columns(pd.read_parquet(sample_file))
+    expected = build_report(df, coefficients, '按月', dimension, **THRESHOLD_ARGS)
+    result = build_report_streaming([sample_file], coefficients, '按月', dimension, chunk_rows=500, **THRESHOLD_ARGS)
+    for name in expected:
+        assert_frame_close(result[name], expected[name])
@@ -0,0 +1,196 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from config import SUMMER_COEFFICIENTS, WINTER_COEFFICIENTS, ACID_PARAMS
+from .disk_cache import stringify_mixed_columns
+from .seasons import SEASON_COLUMN, SEASONS, default_window, is_seasonal, season_coefficients
+from .statistics_calculator import StatisticsCalculator
+from .stats_cube import StatsCube
+from .streaming_stats import DETAIL_KEYS, MomentAccumulator, accumulate, seasonal_chunks
+
+# CPK异常筛选的分析维度 → 汇总分组列
+DIMENSION_COLUMNS = {
+    '按大区': ['大区'],
+    '按区域': ['区域'],
+    '按牧场': ['奶源地名称', '区域', '地区']
+}
+
+# 报告中各表的名称（也用作输出文件名前缀）
+REPORT_TABLES = {
+    'summary': '整体分析结果',
+    'details': '详细分析结果',
+    'anomalies': 'CPK异常'
+}
+
+OUTPUT_FORMATS = ['csv', 'parquet', 'xlsx']
+
+
+def default_coefficients(season='夏季'):
+    """由 config.py 中的季节系数和酸度参数组成系数字典"""
+    season_coefficients = SUMMER_COEFFICIENTS if season == '夏季' else WINTER_COEFFICIENTS
+    coefficients = dict(season_coefficients)
+    coefficients['酸度_min'] = ACID_PARAMS['最小值']
+    coefficients['酸度_max'] = ACID_PARAMS['最大值']
+    coefficients['酸度_tolerance'] = ACID_PARAMS['公差']
+    return coefficients
+
+
+def seasonal_coefficients():
+    """config.py 中夏季、冬季两组系数，按入库日期分别使用"""
+    return {season: default_coefficients(season) for season in SEASONS}
+
+
+def period_capability(cube, period, dimension, coefficients, calculator=None, summer_window=None, **threshold_args):
+    """按时间粒度和分析维度汇总立方体，返回所有分组的CPK结果（与页面上的CPK异常筛选相同）
+
+    按大区/按区域返回 screen_cpk_anomalies 的格式，按牧场返回详细分析结果的格式；没有数据时返回空表。
+    系数按季节给出时各时间段再按夏季/冬季分组
+    """
+    if is_seasonal(coefficients):
+        summer_window = summer_window or default_window()
+    else:
+        summer_window = None
+    moments = cube.rollup(period, DIMENSION_COLUMNS[dimension], summer_window)
+    return rollup_capability(moments, dimension, coefficients, calculator, **threshold_args)
+
+
+def rollup_capability(moments, dimension, coefficients, calculator=None, **threshold_args):
+    """由 时间段 × 分析维度 的分组统计量得到CPK结果（格式同 period_capability）"""
+    calculator = calculator or StatisticsCalculator()
+    if len(moments) == 0:
+        return pd.DataFrame()
+
+    if dimension == '按牧场':
+        return calculator.statistics_from_moments(moments, coefficients, **threshold_args)
+    return calculator.screen_cpk_anomalies(moments, coefficients, **threshold_args)
+
+
+def build_report(df, coefficients, period='按月', dimension='按区域', summer_window=None, **threshold_args):
+    """计算整体分析、详细分析和CPK异常三张表"""
+    calculator = StatisticsCalculator()
+
+    summary = calculator.calculate_summary_table(df, coefficients, summer_window)
+    details = calculator.calculate_statistics(df, coefficients, summer_window=summer_window, **threshold_args)
+
+    results = period_capability(StatsCube.from_frame(df), period, dimension, coefficients,
+                                calculator=calculator, summer_window=summer_window, **threshold_args)
+    anomalies = results[calculator.abnormal_mask(results)] if len(results) > 0 else results
+
+    return {'summary': summary, 'details': details, 'anomalies': anomalies}
+
+
+def build_report_streaming(sources, coefficients, period='按月', dimension='按区域',
+                           chunk_rows=None, chunk_filter=None, summer_window=None, **threshold_args):
+    """与 build_report 相同的三张表，但分块读取数据源，内存占用只与分组数有关（用于超出内存的数据）"""
+    calculator = StatisticsCalculator()
+    # 系数按季节给出时每块数据加上季节列，各分组再按季节细分
+    season_keys, chunk_filter = seasonal_chunks(coefficients, summer_window, chunk_filter)
+
+    total = MomentAccumulator(season_keys, calculator=calculator)
+    details = MomentAccumulator(DETAIL_KEYS[:1] + season_keys + DETAIL_KEYS[1:], calculator=calculator)
+    periods = MomentAccumulator(season_keys + DIMENSION_COLUMNS[dimension], period=period, calculator=calculator)
+    accumulate(sources, [total, details, periods], chunk_rows, chunk_filter)
+
+    summary = _summary_from_moments(total.moments(), coefficients, season_keys, calculator)
+    details_table = calculator.statistics_from_moments(details.moments(), coefficients, **threshold_args)
+
+    results = rollup_capability(periods.moments(), dimension, coefficients, calculator, **threshold_args)
+    anomalies = results[calculator.abnormal_mask(results)] if len(results) > 0 else results
+
+    return {'summary': summary, 'details': details_table, 'anomalies': anomalies}
+
+
+def build_report_sql(backend, coefficients, period='按月', dimension='按区域', summer_window=None, filters=None,
+                     **threshold_args):
+    """与 build_report 相同的三张表，筛选和分组汇总在数据库（SqlBackend）中完成，只取回各组的统计量"""
+    calculator = StatisticsCalculator()
+    summary = summary_sql(backend, coefficients, summer_window, filters, calculator)
+    details = details_sql(backend, coefficients, summer_window, filters, calculator, **threshold_args)
+
+    results = period_capability_sql(backend, period, dimension, coefficients, calculator,
+                                    summer_window, filters, **threshold_args)
+    anomalies = results[calculator.abnormal_mask(results)] if len(results) > 0 else results
+
+    return {'summary': summary, 'details': details, 'anomalies': anomalies}
+
+
+def summary_sql(backend, coefficients, summer_window=None, filters=None, calculator=None):
+    """数据库中满足筛选条件的数据的整体分析表（与 calculate_summary_table 相同）"""
+    calculator = calculator or StatisticsCalculator()
+    season_keys, summer_window = _sql_seasons(coefficients, summer_window)
+    total = backend.group_moments(season_keys, summer_window=summer_window, **(filters or {}))
+    return _summary_from_moments(total, coefficients, season_keys, calculator)
+
+
+def details_sql(backend, coefficients, summer_window=None, filters=None, calculator=None, **threshold_args):
+    """数据库中满足筛选条件的数据的详细分析表（与 calculate_statistics 相同）"""
+    calculator = calculator or StatisticsCalculator()
+    season_keys, summer_window = _sql_seasons(coefficients, summer_window)
+    details = backend.group_moments(DETAIL_KEYS[:1] + season_keys + DETAIL_KEYS[1:],
+                                    summer_window=summer_window, **(filters or {}))
+    return calculator.statistics_from_moments(details, coefficients, **threshold_args)
+
+
+def period_capability_sql(backend, period, dimension, coefficients, calculator=None, summer_window=None, filters=None,
+                          **threshold_args):
+    """与 period_capability 相同的CPK结果，分组统计量在数据库中汇总"""
+    season_keys, summer_window = _sql_seasons(coefficients, summer_window)
+    moments = backend.group_moments(season_keys + DIMENSION_COLUMNS[dimension], period=period,
+                                    summer_window=summer_window, **(filters or {}))
+    return rollup_capability(moments, dimension, coefficients, calculator, **threshold_args)
+
+
+def _sql_seasons(coefficients, summer_window):
+    """系数按季节给出时返回 ([季节列], 夏季时间段)，否则返回 ([], None)"""
+    if is_seasonal(coefficients):
+        return [SEASON_COLUMN], summer_window or default_window()
+    return [], None
+
+
+def _summary_from_moments(total_moments, coefficients, season_keys, calculator):
+    """由总计（或按季节的总计）统计量得到整体分析表"""
+    if not season_keys:
+        if len(total_moments) > 0 and total_moments['数据量'].iloc[0] > 0:
+            return calculator.summary_from_moments(total_moments.iloc[0], coefficients)
+        return calculator.calculate_summary_table(pd.DataFrame(), coefficients)
+
+    # 与 calculate_summary_table 相同，夏季在前
+    tables = []
+    for season in SEASONS:
+        rows = total_moments[total_moments[SEASON_COLUMN] == season]
+        if len(rows) == 0:
+            continue
+        table = calculator.summary_from_moments(rows.iloc[0], season_coefficients(coefficients, season))
+        table.insert(0, SEASON_COLUMN, season)
+        tables.append(table)
+    if tables:
+        return pd.concat(tables, ignore_index=True)
+    return calculator.calculate_summary_table(pd.DataFrame(), season_coefficients(coefficients, '夏季'))
+
+
+def write_report(tables, output_dir, output_format='csv', timestamp=None):
+    """把报告写入输出目录，返回写出的文件路径
+
+    csv/parquet 每张表一个文件，xlsx 写入同一个工作簿的不同工作表
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    if output_format == 'xlsx':
+        path = os.path.join(output_dir, f"cpk_report_{timestamp}.xlsx")
+        with pd.ExcelWriter(path) as writer:
+            for name, table in tables.items():
+                table.to_excel(writer, sheet_name=REPORT_TABLES[name], index=False)
+        return [path]
+
+    paths = []
+    for name, table in tables.items():
+        path = os.path.join(output_dir, f"cpk_{name}_{timestamp}.{output_format}")
+        if output_format == 'parquet':
+            stringify_mixed_columns(table).to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False, encoding='utf-8-sig')
+        paths.append(path)
+    return paths
@@ -1,42 +1,28 @@
 import streamlit as st
-import pandas as pd
-import hashlib
 import os
+from .disk_cache import DiskCache, content_hash
+from .parallel_loader import load_workbooks
 
 @st.cache_data(show_spinner=False)
 def load_excel_file(file_path_or_buffer, file_hash=None):
     """缓存的Excel文件读取函数"""
-    # 使用更快的引擎
-    if hasattr(file_path_or_buffer, 'read'):
-        # 上传的文件对象
-        df = pd.read_excel(file_path_or_buffer, engine='openpyxl')
-    else:
-        # 文件路径
-        df = pd.read_excel(file_path_or_buffer, engine='openpyxl')
+    # 先查磁盘缓存（按文件内容hash），命中则跳过Excel解析
+    disk_cache = DiskCache()
+    if file_hash is None:
+        file_hash = content_hash(file_path_or_buffer)
+    df = disk_cache.get(file_hash)
+    if df is not None:
+        return df
     
-    # 只保留需要的列 - 确保大区列也被包含
-    required_cols = ['大区', '区域', '地区', '奶源地编码', '奶源地名称', 
-                   '入库日期', '上号日期', '脂肪', '蛋白', '干物质', 
-                   '酸度', '体细胞']
+    # 流式读取所有数据工作表，只保留需要的列
+    df = load_workbooks([file_path_or_buffer])
     
-    # 筛选存在的列
-    cols_to_keep = [col for col in required_cols if col in df.columns]
-    df = df[cols_to_keep]
-    
-    # 转换日期列
-    date_columns = ['上号日期', '入库日期']
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # 添加月份列用于月度分析
-    if '入库日期' in df.columns:
-        df['年月'] = df['入库日期'].dt.to_period('M')
+    disk_cache.put(file_hash, df)
     
     return df
 
 def get_file_hash(file_path):
-    """获取文件的hash值"""
+    """获取文件内容的hash值"""
     if os.path.exists(file_path):
-        return str(os.path.getmtime(file_path))
-    return None
\ No newline at end of file
+        return content_hash(file_path)
+    return None
@@ -0,0 +1,153 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from .seasons import SEASONS, is_seasonal, season_coefficients
+from .statistics_calculator import StatisticsCalculator
+
+# 可批量评估的系数（酸度公差只影响CP，不影响CPK异常判定）
+SWEEP_COEFFICIENTS = ['脂肪', '蛋白', '干物质', '体细胞', '酸度_min', '酸度_max']
+
+# 一次评估的系数组合数上限
+MAX_SETTINGS = 5000
+
+# 每批评估的 系数组合 × 阈值 × 分组 单元数上限（控制中间数组的内存）
+BATCH_CELLS = 5_000_000
+
+
+def parse_values(text):
+    """解析取值：逗号分隔的数值（如 '3.0, 3.2'），或 起始:结束:步长（如 '3.0:3.4:0.1'，包含结束值）"""
+    values = []
+    for part in str(text).replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            start, end, step = (float(item) for item in part.split(':'))
+            if step <= 0:
+                raise ValueError(f"步长必须大于0: {part}")
+            count = int(np.floor((end - start) / step + 1e-9)) + 1
+            # 舍入掉累加误差，避免出现 3.0000000000000004 之类的取值
+            values.extend(np.round(start + step * np.arange(count), 10).tolist())
+        else:
+            values.append(float(part))
+    if not values:
+        raise ValueError("没有取值")
+    return list(dict.fromkeys(values))
+
+
+def parse_ranges(text):
+    """解析CPK正常范围：分号分隔的 最小值~最大值（如 '1.0~999; 1.33~999'）"""
+    ranges = []
+    for part in str(text).replace('；', ';').split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        low, high = (float(item) for item in part.split('~'))
+        ranges.append((low, high))
+    if not ranges:
+        raise ValueError("没有取值")
+    return ranges
+
+
+def sweep_defaults(coefficients):
+    """各可评估系数的当前取值（作为假设分析的默认取值）
+
+    系数按季节给出时，两季取值不同的系数分为 夏季脂肪、冬季脂肪 两项，取值相同的合为一项、同时作用于两季
+    """
+    if not is_seasonal(coefficients):
+        return {name: coefficients[name] for name in SWEEP_COEFFICIENTS if name in coefficients}
+
+    seasons = [season_coefficients(coefficients, season) for season in SEASONS]
+    values = {}
+    for name in SWEEP_COEFFICIENTS:
+        if not all(name in season_values for season_values in seasons):
+            continue
+        if seasons[0][name] == seasons[1][name]:
+            values[name] = seasons[0][name]
+        else:
+            values.update({f'{season}{name}': season_values[name] for season, season_values in zip(SEASONS, seasons)})
+    return values
+
+
+def coefficient_grid(base_values, values):
+    """由各系数的取值列表生成全部组合；values 中未给出的系数取 base_values（通常为 sweep_defaults 的结果）中的值"""
+    names = list(dict.fromkeys([*base_values, *values]))
+    choices = [values.get(name) or [base_values[name]] for name in names]
+
+    total = int(np.prod([len(choice) for choice in choices]))
+    if total > MAX_SETTINGS:
+        raise ValueError(f"系数组合共 {total} 组，超过上限 {MAX_SETTINGS} 组，请减少取值")
+    return pd.DataFrame(list(itertools.product(*choices)), columns=names)
+
+
+def sweep_abnormal_counts(moments, settings, thresholds, cpk_threshold_type='小于阈值为异常', calculator=None,
+                          coefficients=None):
+    """批量评估系数组合和CPK判定阈值，返回每种设置下CPK异常的分组数
+
+    moments 为分组统计量（calculate_group_moments 或 StatsCube.rollup 的结果），只需计算一次；
+    settings 为 coefficient_grid 生成的系数组合，thresholds 为阈值列表（自定义范围时为 (最小值, 最大值) 列表）；
+    coefficients 为页面上的系数，settings 中没有的系数取其中的值。系数按季节给出时 moments 需含 季节 列，
+    各分组按所属季节取系数，与CPK异常筛选的结果一致。
+    过程值差值、CPK和异常状态用 StatisticsCalculator 的同一套函数按 组合 × 阈值 × 分组 的数组广播计算：
+    任一性状异常即计为异常分组。返回 settings 的各列加上每个阈值一列异常分组数
+    """
+    calculator = calculator or StatisticsCalculator()
+    traits = [trait for trait in calculator.traits if f'{trait}_n' in moments.columns]
+
+    if cpk_threshold_type == "自定义范围":
+        lows = np.array([low for low, _ in thresholds], dtype=float)[None, :, None]
+        highs = np.array([high for _, high in thresholds], dtype=float)[None, :, None]
+        limits = None
+        labels = [f"CPK不在[{low:g}, {high:g}]" for low, high in thresholds]
+    else:
+        limits = np.array(thresholds, dtype=float)[None, :, None]
+        lows = highs = None
+        labels = [f"CPK<{threshold:g}" for threshold in thresholds]
+
+    n_groups = len(moments)
+    batch = max(1, BATCH_CELLS // max(len(thresholds) * n_groups, 1))
+    counts = np.zeros((len(settings), len(thresholds)), dtype=np.int64)
+
+    for start in range(0, len(settings), batch):
+        part = settings.iloc[start:start + batch]
+        # 各系数为 组合 × 1 的数组，按季节给出时展开为 组合 × 分组
+        part_coefficients = calculator._group_coefficients(moments, _setting_coefficients(coefficients or {}, part))
+        abnormal = np.zeros((len(part), len(thresholds), n_groups), dtype=bool)
+
+        for trait in traits:
+            count = moments[f'{trait}_n'].to_numpy()
+            mean_raw = moments[f'{trait}_均值'].to_numpy(dtype=float)
+            three_sigma_raw = moments[f'{trait}_σ'].to_numpy(dtype=float) * 3
+
+            process_diff_raw, _ = calculator._process_diff(trait, mean_raw, part_coefficients)
+            cpk_raw = np.broadcast_to(calculator._cpk(process_diff_raw, three_sigma_raw), (len(part), n_groups))
+            status = calculator._cpk_status(cpk_raw[:, None, :], cpk_threshold_type, limits, lows, highs)
+            # 没有样本的分组状态为'-'，不计为异常
+            abnormal |= (status == '异常') & (count > 0)[None, None, :]
+
+        counts[start:start + len(part)] = abnormal.sum(axis=2)
+
+    results = settings.reset_index(drop=True).copy()
+    for position, label in enumerate(labels):
+        results[label] = counts[:, position]
+    return results
+
+
+def _setting_coefficients(coefficients, settings):
+    """把一批系数组合并入页面上的系数；夏季脂肪 之类的项只作用于该季节，其余同时作用于两季"""
+    columns = {name: settings[name].to_numpy(dtype=float)[:, None] for name in settings.columns}
+    if not is_seasonal(coefficients):
+        return {**coefficients, **columns}
+
+    resolved = {}
+    for season in SEASONS:
+        season_values = dict(coefficients[season])
+        for name, values in columns.items():
+            if name in SWEEP_COEFFICIENTS:
+                season_values[name] = values
+            elif name.startswith(season):
+                season_values[name[len(season):]] = values
+        resolved[season] = season_values
+    return resolved
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from config import SPC_CUSUM_H, SPC_CUSUM_K, SPC_EWMA_L, SPC_EWMA_LAMBDA, SPC_RUN_LENGTH
+from .excel_reader import trait_values
+
+# 每条控制图序列（一个牧场）的分组列，与详细分析相同
+SERIES_KEYS = ['区域', '地区', '奶源地名称']
+
+# 极差控制图常数 d2、d3（子组样本数 2~25，更大的子组按25取值）
+D2 = {2: 1.128, 3: 1.693, 4: 2.059, 5: 2.326, 6: 2.534, 7: 2.704, 8: 2.847, 9: 2.970, 10: 3.078,
+      11: 3.173, 12: 3.258, 13: 3.336, 14: 3.407, 15: 3.472, 16: 3.532, 17: 3.588, 18: 3.640,
+      19: 3.689, 20: 3.735, 21: 3.778, 22: 3.819, 23: 3.858, 24: 3.895, 25: 3.931}
+D3 = {2: 0.853, 3: 0.888, 4: 0.880, 5: 0.864, 6: 0.848, 7: 0.833, 8: 0.820, 9: 0.808, 10: 0.797,
+      11: 0.787, 12: 0.778, 13: 0.770, 14: 0.763, 15: 0.756, 16: 0.750, 17: 0.744, 18: 0.739,
+      19: 0.734, 20: 0.729, 21: 0.724, 22: 0.720, 23: 0.716, 24: 0.712, 25: 0.708}
+
+# 一个牧场至少有这么多个样本数≥2的日子组时才用组内极差估计σ，否则用相邻日均值的移动极差
+MIN_RANGE_SUBGROUPS = 5
+
+# 违规记录的图表和规则
+CHART_TYPES = ['X̄图', 'R图', 'EWMA', 'CUSUM']
+
+
+class ControlCharts:
+    """全部牧场、全部性状的统计过程控制图（X̄-R、EWMA、CUSUM）
+
+    每个牧场每个入库日期的样本为一个子组，一次分组求出各子组的样本数、均值和极差；
+    控制限用该牧场的全部子组估计（回顾性分析）：中心线为总均值，σ = 各子组 R/d2 的平均值
+    （样本数≥2的子组不足时用子组均值的移动极差/1.128 × √n̄），
+    X̄图控制限为 中心线 ± 3σ/√n（n为该子组样本数，子组大小不同时控制限随之变化）。
+    EWMA 和 CUSUM 是按时间的递推，全部牧场排成 牧场 × 子组序号 的矩阵，
+    沿时间方向逐列推进、每一步同时计算所有牧场，循环次数只与最长序列的子组数有关，与牧场数无关。
+    """
+
+    def __init__(self, ewma_lambda=SPC_EWMA_LAMBDA, ewma_l=SPC_EWMA_L, cusum_k=SPC_CUSUM_K, cusum_h=SPC_CUSUM_H,
+                 run_length=SPC_RUN_LENGTH, traits=None):
+        self.ewma_lambda = ewma_lambda
+        self.ewma_l = ewma_l
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.run_length = run_length
+        self.traits = traits or ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
+
+    def calculate(self, df):
+        """各牧场、各性状每个子组的控制图数据（长表，每行一个 牧场 × 性状 × 日期）
+
+        返回 SERIES_KEYS、性状、日期、样本数、均值、极差，各图的中心线/控制限/统计量，
+        以及 {图表}_{规则} 形式的布尔列（见 violations）
+        """
+        df = df[df['入库日期'].notna()]
+        traits = [trait for trait in self.traits if trait in df.columns]
+        if len(df) == 0 or not traits:
+            return pd.DataFrame()
+
+        # 一次分组求出所有性状的子组统计量
+        frame = pd.DataFrame({col: df[col] for col in SERIES_KEYS})
+        frame['日期'] = df['入库日期'].dt.normalize()
+        for trait in traits:
+            frame[trait] = trait_values(df[trait])
+        daily = frame.groupby(SERIES_KEYS + ['日期'], observed=True, sort=True)[traits].agg(['count', 'mean', 'max', 'min'])
+        keys = daily.index.to_frame(index=False)
+        series_codes = keys.groupby(SERIES_KEYS, observed=True, sort=False).ngroup().to_numpy()
+
+        charts = []
+        for trait in traits:
+            count = daily[(trait, 'count')].to_numpy()
+            present = count > 0
+            chart = keys[present].reset_index(drop=True)
+            chart.insert(len(SERIES_KEYS), '性状', trait)
+            charts.append(self._trait_chart(
+                chart,
+                series_codes[present],
+                count[present],
+                daily[(trait, 'mean')].to_numpy(dtype=float)[present],
+                (daily[(trait, 'max')] - daily[(trait, 'min')]).to_numpy(dtype=float)[present]
+            ))
+
+        return pd.concat(charts, ignore_index=True)
+
+    def violations(self, charts):
+        """把 calculate 结果中的判异标记展开为违规记录表：每行一个 牧场 × 性状 × 日期 × 规则"""
+        columns = SERIES_KEYS + ['性状', '日期', '图表', '规则', '统计量', '控制限']
+        if len(charts) == 0:
+            return pd.DataFrame(columns=columns)
+
+        rules = [
+            ('X̄图', '超出上控制限', '均值', 'X̄上限'),
+            ('X̄图', '低于下控制限', '均值', 'X̄下限'),
+            ('X̄图', f'连续{self.run_length}点在中心线同侧', '均值', '中心线'),
+            ('R图', '超出上控制限', '极差', 'R上限'),
+            ('R图', '低于下控制限', '极差', 'R下限'),
+            ('EWMA', '超出上控制限', 'EWMA', 'EWMA上限'),
+            ('EWMA', '低于下控制限', 'EWMA', 'EWMA下限'),
+            ('CUSUM', '向上偏移', 'CUSUM上', None),
+            ('CUSUM', '向下偏移', 'CUSUM下', None),
+        ]
+        parts = []
+        for chart_type, rule, value_col, limit_col in rules:
+            flagged = charts[charts[f'{chart_type}_{rule}']]
+            if len(flagged) == 0:
+                continue
+            part = flagged[SERIES_KEYS + ['性状', '日期']].copy()
+            part['图表'] = chart_type
+            part['规则'] = rule
+            part['统计量'] = np.round(flagged[value_col].to_numpy(dtype=float), 3)
+            part['控制限'] = np.round(flagged[limit_col].to_numpy(dtype=float), 3) if limit_col else self.cusum_h
+            parts.append(part)
+
+        if not parts:
+            return pd.DataFrame(columns=columns)
+        results = pd.concat(parts, ignore_index=True)
+        for col in SERIES_KEYS:
+            results[col] = results[col].astype(object)
+        return results.sort_values(['日期', '区域', '奶源地名称', '性状'], kind='stable').reset_index(drop=True)
+
+    def _trait_chart(self, chart, series, count, mean, value_range):
+        """一个性状全部牧场的控制图（各数组按 牧场、日期 排序）"""
+        n_series = int(series.max()) + 1
+        # 子组在所属牧场中的序号
+        starts = np.flatnonzero(np.r_[True, series[1:] != series[:-1]])
+        lengths = np.diff(np.r_[starts, len(series)])
+        position = np.arange(len(series)) - np.repeat(starts, lengths)
+
+        # 中心线：牧场全部样本的均值
+        total = np.bincount(series, weights=count, minlength=n_series)
+        center = np.bincount(series, weights=count * mean, minlength=n_series) / np.where(total > 0, total, 1)
+
+        # σ（单个样本）：组内极差 R/d2 的平均值；样本数≥2的子组太少时用相邻子组均值的移动极差/1.128，
+        # 它估计的是子组均值的标准差，乘以 √n̄（该牧场平均子组样本数）换算为单个样本的σ
+        size = np.minimum(count, 25)
+        d2 = np.array([D2.get(value, np.nan) for value in range(26)])
+        d3 = np.array([D3.get(value, np.nan) for value in range(26)])
+        has_range = count > 1
+        range_count = np.bincount(series[has_range], minlength=n_series)
+        range_sigma = np.bincount(series[has_range], weights=value_range[has_range] / d2[size[has_range]],
+                                  minlength=n_series) / np.maximum(range_count, 1)
+        moving = position > 0
+        moving_range = np.abs(mean[1:] - mean[:-1])[moving[1:]]
+        moving_count = np.bincount(series[moving], minlength=n_series)
+        moving_sigma = np.bincount(series[moving], weights=moving_range, minlength=n_series) / np.maximum(moving_count, 1) / D2[2]
+        subgroups = np.bincount(series, minlength=n_series)
+        moving_sigma = moving_sigma * np.sqrt(total / np.maximum(subgroups, 1))
+        sigma = np.where(range_count >= MIN_RANGE_SUBGROUPS, range_sigma,
+                         np.where(moving_count > 0, moving_sigma, np.nan))
+
+        chart_center = center[series]
+        chart_sigma = sigma[series]
+        standard_error = chart_sigma / np.sqrt(count)
+
+        chart['样本数'] = count
+        chart['均值'] = mean
+        chart['极差'] = np.where(has_range, value_range, np.nan)
+        chart['中心线'] = chart_center
+        chart['X̄上限'] = chart_center + 3 * standard_error
+        chart['X̄下限'] = chart_center - 3 * standard_error
+        # R图只对样本数≥2的子组有意义：中心线 d2σ，控制限 (d2 ± 3d3)σ，下限不小于0
+        chart['R中心线'] = np.where(has_range, d2[size] * chart_sigma, np.nan)
+        chart['R上限'] = np.where(has_range, (d2[size] + 3 * d3[size]) * chart_sigma, np.nan)
+        chart['R下限'] = np.where(has_range, np.maximum(d2[size] - 3 * d3[size], 0) * chart_sigma, np.nan)
+
+        # EWMA控制限随序号收敛到稳态宽度
+        lam = self.ewma_lambda
+        ewma_width = self.ewma_l * standard_error * np.sqrt(lam / (2 - lam) * (1 - (1 - lam) ** (2 * (position + 1))))
+        chart['EWMA上限'] = chart_center + ewma_width
+        chart['EWMA下限'] = chart_center - ewma_width
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            standardized = np.where(standard_error > 0, (mean - chart_center) / standard_error, np.nan)
+        ewma, cusum_high, cusum_low, run = self._recursions(series, position, n_series, lengths.max(),
+                                                            mean, center, standardized)
+        chart['EWMA'] = ewma
+        chart['CUSUM上'] = cusum_high
+        chart['CUSUM下'] = cusum_low
+
+        valid = standard_error > 0
+        chart['X̄图_超出上控制限'] = valid & (mean > chart['X̄上限'].to_numpy())
+        chart['X̄图_低于下控制限'] = valid & (mean < chart['X̄下限'].to_numpy())
+        chart[f'X̄图_连续{self.run_length}点在中心线同侧'] = valid & (run >= self.run_length)
+        chart['R图_超出上控制限'] = has_range & valid & (chart['极差'].to_numpy() > chart['R上限'].to_numpy())
+        chart['R图_低于下控制限'] = has_range & valid & (chart['极差'].to_numpy() < chart['R下限'].to_numpy())
+        chart['EWMA_超出上控制限'] = valid & (ewma > chart['EWMA上限'].to_numpy())
+        chart['EWMA_低于下控制限'] = valid & (ewma < chart['EWMA下限'].to_numpy())
+        chart['CUSUM_向上偏移'] = cusum_high > self.cusum_h
+        chart['CUSUM_向下偏移'] = cusum_low > self.cusum_h
+        return chart
+
+    def _recursions(self, series, position, n_series, n_steps, mean, center, standardized):
+        """EWMA、CUSUM及同侧连续点数的递推：牧场 × 序号 矩阵逐列推进，每一步同时计算全部牧场
+
+        EWMA从中心线开始；CUSUM为标准化均值的表格CUSUM，超出判定界限后记一次偏移并归零重新累计
+        """
+        mean_matrix = np.full((n_series, n_steps), np.nan)
+        mean_matrix[series, position] = mean
+        z_matrix = np.full((n_series, n_steps), np.nan)
+        z_matrix[series, position] = standardized
+
+        lam, k, h = self.ewma_lambda, self.cusum_k, self.cusum_h
+        ewma = np.full((n_series, n_steps), np.nan)
+        cusum_high = np.full((n_series, n_steps), np.nan)
+        cusum_low = np.full((n_series, n_steps), np.nan)
+        run = np.zeros((n_series, n_steps), dtype=np.int64)
+
+        current = center.copy()
+        high = np.zeros(n_series)
+        low = np.zeros(n_series)
+        side = np.zeros(n_series)
+        streak = np.zeros(n_series, dtype=np.int64)
+        for step in range(n_steps):
+            x = mean_matrix[:, step]
+            z = z_matrix[:, step]
+            current = np.where(np.isnan(x), current, lam * x + (1 - lam) * current)
+            ewma[:, step] = current
+
+            valid = ~np.isnan(z)
+            high = np.where(valid, np.maximum(0.0, high + z - k), high)
+            low = np.where(valid, np.maximum(0.0, low - z - k), low)
+            cusum_high[:, step] = high
+            cusum_low[:, step] = low
+            high = np.where(high > h, 0.0, high)
+            low = np.where(low > h, 0.0, low)
+
+            point_side = np.sign(np.where(valid, z, 0.0))
+            streak = np.where(point_side == 0, 0, np.where(point_side == side, streak + 1, 1))
+            side = point_side
+            run[:, step] = streak
+
+        return (ewma[series, position], cusum_high[series, position], cusum_low[series, position],
+                run[series, position])
@@ -1,8 +1,7 @@
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import streamlit as st
-from .cache_helper import load_excel_file, get_file_hash
 
 class DataProcessor:
     def __init__(self):
@@ -15,7 +14,11 @@ class DataProcessor:
         }
     
     def load_data(self, file_path):
-        """加载Excel数据"""
+        """加载Excel数据（带Streamlit缓存，供页面使用；批量处理请直接用 parallel_loader.load_workbooks）"""
+        # 缓存依赖Streamlit，在使用时才导入，保证不使用页面时本模块不加载Streamlit
+        import streamlit as st
+        from .cache_helper import load_excel_file, get_file_hash
+        
         try:
             # 使用缓存的加载函数
             if hasattr(file_path, 'read'):
@@ -32,56 +35,67 @@ class DataProcessor:
             st.error(f"加载数据失败: {str(e)}")
             return None
     
-    def filter_data(self, df, zones=None, regions=None, areas=None, date_range=None, farms=None):
-        """根据条件筛选数据"""
-        filtered_df = df.copy()
+    def append_data(self, file_path, store=None):
+        """把新文件追加到本地累积数据集，返回追加摘要（新增/更新记录数、重算分组数等）"""
+        from .incremental_store import IncrementalStore
+        store = store or IncrementalStore()
+        source_name = getattr(file_path, 'name', None) or os.path.basename(str(file_path))
+        return store.append(file_path, source_name)
+    
+    def filter_data(self, df, zones=None, regions=None, areas=None, date_range=None, farms=None, index=None):
+        """根据条件筛选数据
+        
+        传入为该数据构建的 FilterIndex 时走索引筛选（有条件时结果按入库日期排序，可能是原数据的切片）；
+        否则合并所有条件为一个掩码后只取一次子集
+        """
+        if index is not None:
+            return index.filter(zones, regions, areas, date_range, farms)
+        
+        mask = np.ones(len(df), dtype=bool)
         
         # 大区筛选
         if zones and len(zones) > 0:
-            filtered_df = filtered_df[filtered_df['大区'].isin(zones)]
+            mask &= df['大区'].isin(zones).to_numpy()
         
         # 区域筛选
         if regions and len(regions) > 0:
-            filtered_df = filtered_df[filtered_df['区域'].isin(regions)]
+            mask &= df['区域'].isin(regions).to_numpy()
         
         # 地区筛选
         if areas and len(areas) > 0:
-            filtered_df = filtered_df[filtered_df['地区'].isin(areas)]
+            mask &= df['地区'].isin(areas).to_numpy()
         
         # 时间段筛选
         if date_range and len(date_range) == 2:
             start_date, end_date = date_range
-            if '入库日期' in filtered_df.columns:
+            if '入库日期' in df.columns:
                 # 设置开始日期为当天的00:00:00，结束日期为当天的23:59:59
                 start_datetime = pd.Timestamp(start_date).replace(hour=0, minute=0, second=0)
                 end_datetime = pd.Timestamp(end_date).replace(hour=23, minute=59, second=59)
                 
-                mask = (filtered_df['入库日期'] >= start_datetime) & \
-                       (filtered_df['入库日期'] <= end_datetime)
-                filtered_df = filtered_df[mask]
+                mask &= ((df['入库日期'] >= start_datetime) & 
+                         (df['入库日期'] <= end_datetime)).to_numpy()
         
         # 奶源地筛选
         if farms and len(farms) > 0:
-            filtered_df = filtered_df[filtered_df['奶源地名称'].isin(farms)]
+            mask &= df['奶源地名称'].isin(farms).to_numpy()
         
-        return filtered_df
+        if mask.all():
+            return df
+        return df[mask]
     
     def group_data_by_month_and_farm(self, df):
         """按月份和牧场分组数据"""
-        if '年月' not in df.columns:
-            if '入库日期' in df.columns:
-                df['年月'] = df['入库日期'].dt.to_period('M')
+        if '年月' not in df.columns and '入库日期' in df.columns:
+            df = df.assign(年月=df['入库日期'].dt.to_period('M'))
         
         # 按月份和奶源地分组
-        grouped = df.groupby(['年月', '奶源地名称'])
+        grouped = df.groupby(['年月', '奶源地名称'], observed=True)
         
         return grouped
     
     def clean_numeric_data(self, df, columns):
-        """清理数值列数据"""
-        for col in columns:
-            if col in df.columns:
-                # 转换为数值类型，非数值转为NaN
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        return df
\ No newline at end of file
+        """清理数值列数据，返回新的DataFrame（加载流程已完成转换，此处只用于其他来源的数据）"""
+        # 转换为数值类型，非数值转为NaN
+        converted = {col: pd.to_numeric(df[col], errors='coerce') for col in columns if col in df.columns}
+        return df.assign(**converted)
\ No newline at end of file
@@ -1,73 +1,117 @@
-import pandas as pd
-import numpy as np
-from datetime import datetime
-import streamlit as st
-import time
+import contextvars
+import functools
 import threading
-from queue import Queue
+import time
+
+from .metrics import stage
+from .parallel_loader import LoadCancelled, load_workbooks
+
 
 class AsyncDataProcessor:
-    """带进度显示的数据处理器"""
-    
+    """会话内的后台加载任务
+
+    在后台线程中解析上传的Excel并注册到共享数据集（同时构建立方体、索引等派生结构），
+    页面脚本只读取 progress/status 显示进度，加载期间仍可继续分析上一份数据。
+    每个会话在 session_state 中保存自己的实例，不在会话之间共享。
+    """
+
     def __init__(self):
-        self.progress = 0
+        self.key = None
+        self.progress = 0.0
         self.status = ""
-        self.result = None
         self.error = None
-    
-    def load_excel_with_progress(self, file_path_or_buffer):
-        """带进度的Excel读取"""
-        self.progress = 0
-        self.status = "开始读取文件..."
-        
+        self.cancelled = False
+        self.elapsed = None
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def finished(self):
+        """已成功完成（数据已注册到共享数据集）"""
+        return self._thread is not None and not self.running and self.error is None and not self.cancelled
+
+    def start(self, key, sources, registry, session_id, prepare=None, description=""):
+        """开始加载；sources 为文件路径或字节内容（上传文件先在页面脚本中取出字节，线程中不访问Streamlit对象）
+
+        prepare 为 {名称: builder(df)}，加载后在后台依次构建并登记为数据集的派生结构
+        """
+        if self.running:
+            # 只通知上一个任务取消，不在页面脚本中等待它结束；旧线程之后不再修改本实例的状态
+            self.cancel()
+        self._cancel_event = threading.Event()
+
+        self.key = key
+        self.progress = 0.0
+        self.status = f"正在打开 {description}..." if description else "正在打开Excel文件..."
+        self.error = None
+        self.cancelled = False
+        self.elapsed = None
+
+        # 复制当前上下文，后台线程中的阶段记录仍归入本会话的性能记录器
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(
+            target=context.run,
+            args=(self._run, key, list(sources), registry, session_id, prepare or {}, description, self._cancel_event),
+            daemon=True
+        )
+        self._thread.start()
+
+    def cancel(self):
+        """请求取消；读取线程在下一次报告进度时停止"""
+        self._cancel_event.set()
+        if self.running:
+            self.status = "正在取消..."
+
+    def _update(self, cancel_event, **state):
+        """更新进度和状态；已被新任务取代的旧任务不再修改"""
+        if cancel_event is self._cancel_event:
+            for name, value in state.items():
+                setattr(self, name, value)
+
+    def _report(self, cancel_event, fraction, message):
+        # 读取阶段占90%，其余为注册和构建派生结构
+        self._update(cancel_event, progress=fraction * 0.9, status=message)
+
+    def _run(self, key, sources, registry, session_id, prepare, description, cancel_event):
+        start = time.perf_counter()
+        registered = False
         try:
-            # 步骤1: 读取Excel文件 (30%)
-            self.status = "正在打开Excel文件..."
-            self.progress = 10
-            
-            # 重置文件指针到开始位置
-            if hasattr(file_path_or_buffer, 'seek'):
-                file_path_or_buffer.seek(0)
-            
-            if hasattr(file_path_or_buffer, 'read'):
-                df = pd.read_excel(file_path_or_buffer, engine='openpyxl')
-            else:
-                df = pd.read_excel(file_path_or_buffer, engine='openpyxl')
-            
-            self.progress = 30
-            total_rows = len(df)
-            self.status = f"已读取 {total_rows:,} 条记录，正在处理数据..."
-            
-            # 步骤2: 筛选列 (40%)
-            self.progress = 40
-            required_cols = ['大区', '区域', '地区', '奶源地编码', '奶源地名称', 
-                           '入库日期', '上号日期', '脂肪', '蛋白', '干物质', 
-                           '酸度', '微生物', '体细胞']
-            cols_to_keep = [col for col in required_cols if col in df.columns]
-            df = df[cols_to_keep]
-            
-            # 步骤3: 转换日期 (60%)
-            self.progress = 60
-            self.status = "正在转换日期格式..."
-            date_columns = ['上号日期', '入库日期']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            
-            # 步骤4: 添加月份列 (80%)
-            self.progress = 80
-            self.status = "正在生成月度分析数据..."
-            if '入库日期' in df.columns:
-                df['年月'] = df['入库日期'].dt.to_period('M')
-            
-            # 完成
-            self.progress = 100
-            self.status = "数据处理完成！"
-            self.result = df
-            
-            return df
-            
+            with stage('读取Excel', 文件=description) as record:
+                df = load_workbooks(sources, progress_callback=functools.partial(self._report, cancel_event),
+                                    cancel_event=cancel_event)
+                if df is None:
+                    raise ValueError("文件中没有数据工作表")
+                record['行数'] = len(df)
+
+            self._update(cancel_event, status="正在写入缓存...")
+            with stage('写入缓存', rows=len(df)):
+                df = registry.put(key, df, session_id)
+            registered = True
+
+            for position, (name, builder) in enumerate(prepare.items()):
+                if cancel_event.is_set():
+                    raise LoadCancelled("加载已取消")
+                self._update(cancel_event, status=f"正在准备数据（{name}）...", progress=0.9 + 0.1 * position / len(prepare))
+                registry.derived(key, name, lambda: builder(df))
+
+            self._update(cancel_event, progress=1.0, status="数据加载完成！")
+        except LoadCancelled:
+            self._update(cancel_event, cancelled=True, status="已取消加载")
+            # 已注册的数据集留给其他会话或下次使用，本会话不再引用
+            self._release(registry, key, session_id, cancel_event)
         except Exception as e:
-            self.error = str(e)
-            self.status = f"错误: {str(e)}"
-            return None
\ No newline at end of file
+            self._update(cancel_event, error=str(e), status=f"错误: {str(e)}")
+            # 注册后出错时同样释放本会话的引用，避免数据集一直被占用
+            if registered:
+                self._release(registry, key, session_id, cancel_event)
+        finally:
+            self._update(cancel_event, elapsed=time.perf_counter() - start)
+
+    def _release(self, registry, key, session_id, cancel_event):
+        # 新任务加载的是同一份数据时，会话引用归新任务所有
+        if cancel_event is self._cancel_event or key != self.key:
+            registry.release(key, session_id)
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import DATASET_MEMORY_MAX_MB, DATASET_REF_TTL
+from .disk_cache import DiskCache
+
+
+class DatasetRegistry:
+    """进程内共享的数据集注册表
+
+    解析后的数据按内容hash只保存一份，各会话只读共享；数据集上构建的立方体、索引等也随之共享。
+    每个数据集记录正在使用它的会话（引用计数），内存总量超过上限时，按最近使用时间淘汰
+    没有会话引用的数据集。数据集在注册时已写入磁盘缓存，淘汰后再次使用时从磁盘读回，无需重新解析Excel。
+    会话结束时Streamlit不会通知，超过 ref_ttl 秒未访问的引用视为已释放。
+    """
+
+    def __init__(self, max_bytes=None, disk_cache=None, ref_ttl=None):
+        self.max_bytes = max_bytes if max_bytes is not None else DATASET_MEMORY_MAX_MB * 1024 * 1024
+        self.disk_cache = disk_cache or DiskCache()
+        self.ref_ttl = ref_ttl if ref_ttl is not None else DATASET_REF_TTL
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def acquire(self, key, session_id):
+        """取出数据集并登记会话引用；内存中没有时从磁盘缓存读回，都没有时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                df = self.disk_cache.get(key)
+                if df is None:
+                    return None
+                entry = self._add(key, df)
+
+            self._entries.move_to_end(key)
+            entry['refs'][session_id] = time.time()
+            self._evict()
+            return entry['frame']
+
+    def put(self, key, df, session_id=None, spill=True):
+        """注册新解析的数据集（同时写入磁盘缓存），返回注册表中的共享副本"""
+        if spill:
+            self.disk_cache.put(key, df)
+
+        with self._lock:
+            if key not in self._entries:
+                self._add(key, df)
+            if session_id is not None:
+                return self.acquire(key, session_id)
+            self._evict()
+            return self._entries[key]['frame'] if key in self._entries else df
+
+    def release(self, key, session_id):
+        """会话不再使用该数据集（切换文件或退出时调用）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['refs'].pop(session_id, None)
+            self._evict()
+
+    def derived(self, key, name, builder):
+        """数据集上的派生结构（立方体、筛选索引等），每个数据集只构建一次并计入内存用量
+
+        构建时不持有锁，后台加载任务构建期间其他会话仍可访问注册表
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry['derived']:
+                return entry['derived'][name]
+
+        value = builder()
+        if entry is None:
+            return value
+
+        with self._lock:
+            # 同时构建时保留先完成的一份
+            if name not in entry['derived']:
+                entry['derived'][name] = value
+                # 派生结构可能直接引用原数据（如已按日期排好序时的筛选索引），不重复计算
+                entry['bytes'] += estimate_bytes(value, seen={id(entry['frame'])})
+                self._evict()
+            return entry['derived'][name]
+
+    def clear(self):
+        """清空内存中的全部数据集"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回内存中的数据集数、总字节数、正在使用的会话数"""
+        with self._lock:
+            self._expire_refs()
+            sessions = set()
+            for entry in self._entries.values():
+                sessions.update(entry['refs'])
+            return {
+                '数据集数': len(self._entries),
+                '总大小': sum(entry['bytes'] for entry in self._entries.values()),
+                '上限': self.max_bytes,
+                '会话数': len(sessions)
+            }
+
+    def _add(self, key, df):
+        entry = {'frame': df, 'bytes': estimate_bytes(df), 'refs': {}, 'derived': {}}
+        self._entries[key] = entry
+        return entry
+
+    def _expire_refs(self):
+        expire_before = time.time() - self.ref_ttl
+        for entry in self._entries.values():
+            for session_id in [sid for sid, seen in entry['refs'].items() if seen < expire_before]:
+                del entry['refs'][session_id]
+
+    def _evict(self):
+        """超过内存上限时从最久未使用的开始淘汰没有会话引用的数据集"""
+        total = sum(entry['bytes'] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+
+        self._expire_refs()
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry['refs']:
+                continue
+            del self._entries[key]
+            total -= entry['bytes']
+
+
+def estimate_bytes(value, seen=None):
+    """估算DataFrame、数组或由它们组成的对象占用的内存，同一对象只计算一次"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(estimate_bytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_bytes(item, seen) for item in value)
+    if hasattr(value, '__dict__'):
+        return sum(estimate_bytes(item, seen) for item in vars(value).values())
+    return 0
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import uuid
+
+import pandas as pd
+
+from config import DATA_CACHE_DIR, DATA_CACHE_MAX_MB
+from .excel_reader import restore_dtypes, schema_signature
+
+
+def content_hash(file_path_or_buffer):
+    """按文件内容计算SHA-256，用作缓存键"""
+    hasher = hashlib.sha256()
+
+    if hasattr(file_path_or_buffer, 'getvalue'):
+        # 上传的文件对象
+        hasher.update(file_path_or_buffer.getvalue())
+    elif hasattr(file_path_or_buffer, 'read'):
+        position = file_path_or_buffer.tell()
+        file_path_or_buffer.seek(0)
+        for chunk in iter(lambda: file_path_or_buffer.read(1024 * 1024), b''):
+            hasher.update(chunk)
+        file_path_or_buffer.seek(position)
+    else:
+        # 文件路径
+        with open(file_path_or_buffer, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def stringify_mixed_columns(df):
+    """把object列统一转为字符串（Parquet不支持同列中混有数字和文字，如结果表中的'/'）"""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def combine_hashes(hashes):
+    """多个文件一起读取时的缓存键：单个文件沿用其内容hash，多个文件按顺序合并计算"""
+    hashes = list(hashes)
+    if len(hashes) == 1:
+        return hashes[0]
+    return hashlib.sha256('-'.join(hashes).encode('ascii')).hexdigest()
+
+
+class DiskCache:
+    """解析后数据的磁盘缓存（Parquet），按内容hash存取，超出容量时淘汰最久未使用的文件"""
+
+    suffix = '.parquet'
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or DATA_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else DATA_CACHE_MAX_MB * 1024 * 1024
+
+    def _path(self, key):
+        # 文件名带上解析格式标识，格式升级或读取的列变化后旧缓存不再命中并随LRU淘汰
+        return os.path.join(self.cache_dir, f"{key}-{schema_signature()}{self.suffix}")
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            df = restore_dtypes(pd.read_parquet(path))
+        except Exception as e:
+            # 损坏的缓存文件直接删除，按未命中处理
+            print(f"读取缓存失败，已删除: {e}")
+            self.invalidate(key)
+            return None
+
+        # 更新修改时间，作为LRU淘汰的依据
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return df
+
+    def put(self, key, df):
+        """写入缓存并按容量上限淘汰旧文件"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+        try:
+            try:
+                df.to_parquet(tmp_path, index=False)
+            except Exception:
+                # 含有混合类型的object列（如同列中既有数字又有文字）无法直接写入，统一转为字符串
+                stringify_mixed_columns(df).to_parquet(tmp_path, index=False)
+            # 先写临时文件再替换，避免并发读到写了一半的文件
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"写入缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        self.evict()
+        return True
+
+    def invalidate(self, key=None):
+        """删除指定缓存；不指定key时清空全部缓存"""
+        if key is not None:
+            paths = [self._path(key)]
+        else:
+            paths = [path for path, _, _ in self._entries()]
+
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间从旧到新删除"""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """返回缓存文件数和总字节数"""
+        entries = self._entries()
+        return {
+            '文件数': len(entries),
+            '总大小': sum(size for _, _, size in entries)
+        }
+
+    def _entries(self):
+        """列出缓存文件：(路径, 最近使用时间, 大小)"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
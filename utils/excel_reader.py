@@ -0,0 +1,397 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from openpyxl.utils.exceptions import InvalidFileException
+
+from config import DROPPED_COLUMNS
+from .metrics import stage
+
+# 分析所需的列
+REQUIRED_COLUMNS = ['大区', '区域', '地区', '奶源地编码', '奶源地名称',
+                    '入库日期', '上号日期', '脂肪', '蛋白', '干物质',
+                    '酸度', '体细胞']
+NUMERIC_COLUMNS = ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
+DATE_COLUMNS = ['上号日期', '入库日期']
+HIERARCHY_COLUMNS = ['大区', '区域', '地区', '奶源地名称', '奶源地编码']
+
+# 表头含有这些列的工作表视为数据表（多工作表时据此跳过汇总、说明等工作表）
+SHEET_KEY_COLUMNS = ['奶源地名称', '入库日期']
+
+# 解析结果的格式版本，格式变化时递增以避免读到旧格式的磁盘缓存
+SCHEMA_VERSION = 5
+
+# 经过 finalize_columns 统一类型的数据在 DataFrame.attrs 中带有此标记（值为 schema_signature()）
+SCHEMA_ATTR = 'cpk_schema'
+
+# Excel 1900日期系统的序列日期起点（序列号1为1900-01-01，兼容Excel把1900年当作闰年的处理）
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'ns')
+EXCEL_MAX_SERIAL = 2958465  # 9999-12-31
+
+# 性状以float32保存时，还原为float64所尝试的小数位数
+RESTORE_DECIMALS = range(0, 8)
+
+# 进度回调的触发间隔（行）
+PROGRESS_EVERY = 5000
+
+
+def read_excel_columns(file_path_or_buffer, columns=None, sheet_name=None, progress_callback=None):
+    """以openpyxl只读模式逐行读取Excel，只保留需要的列并直接生成带类型的列
+
+    progress_callback(已读行数, 总行数) 按实际读取的行数回调，总行数未知时为None
+    """
+    columns = columns or analysis_columns()
+
+    if hasattr(file_path_or_buffer, 'seek'):
+        file_path_or_buffer.seek(0)
+
+    try:
+        workbook = load_workbook(file_path_or_buffer, read_only=True, data_only=True)
+    except InvalidFileException:
+        # 旧版.xls等openpyxl不支持的格式退回pandas读取（同样只解析需要的列）
+        if hasattr(file_path_or_buffer, 'seek'):
+            file_path_or_buffer.seek(0)
+        df = pd.read_excel(file_path_or_buffer, sheet_name=sheet_name or 0,
+                           usecols=lambda col: col in columns)
+        return finalize_columns(df)
+
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return finalize_columns(pd.DataFrame(columns=[]))
+
+        kept, kept_positions = _header_positions(header, columns)
+        buffers = [[] for _ in kept]
+
+        total_rows = worksheet.max_row - 1 if worksheet.max_row else None
+        rows_read = 0
+        with stage('读取并投影列', 工作表=worksheet.title) as record:
+            for row in rows:
+                values = [row[position] if position < len(row) else None for position in kept_positions]
+                # 与pandas一致：跳过整行为空的行
+                if all(value is None for value in values) and all(value is None for value in row):
+                    continue
+
+                for buffer, value in zip(buffers, values):
+                    buffer.append(value)
+
+                rows_read += 1
+                if progress_callback and rows_read % PROGRESS_EVERY == 0:
+                    progress_callback(rows_read, total_rows)
+            record['行数'] = rows_read
+    finally:
+        workbook.close()
+
+    if progress_callback:
+        progress_callback(rows_read, rows_read)
+
+    return _buffers_to_frame(kept, buffers, rows_read)
+
+
+def iter_excel_chunks(file_path_or_buffer, chunk_rows, columns=None, sheet_name=None):
+    """逐块读取工作表，每块最多 chunk_rows 行，各块的列类型与 read_excel_columns 相同
+
+    同一时间只保留一块的数据，用于数据量超出内存的分块统计
+    """
+    columns = columns or analysis_columns()
+
+    if hasattr(file_path_or_buffer, 'seek'):
+        file_path_or_buffer.seek(0)
+
+    try:
+        workbook = load_workbook(file_path_or_buffer, read_only=True, data_only=True)
+    except InvalidFileException:
+        # openpyxl不支持的格式无法逐行读取，整表读入后再分块
+        df = read_excel_columns(file_path_or_buffer, columns, sheet_name)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+
+    try:
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return
+
+        kept, kept_positions = _header_positions(header, columns)
+
+        buffers = [[] for _ in kept]
+        rows_read = 0
+        for row in rows:
+            values = [row[position] if position < len(row) else None for position in kept_positions]
+            if all(value is None for value in values) and all(value is None for value in row):
+                continue
+
+            for buffer, value in zip(buffers, values):
+                buffer.append(value)
+
+            rows_read += 1
+            if rows_read == chunk_rows:
+                yield _buffers_to_frame(kept, buffers, rows_read)
+                buffers = [[] for _ in kept]
+                rows_read = 0
+
+        if rows_read:
+            yield _buffers_to_frame(kept, buffers, rows_read)
+    finally:
+        workbook.close()
+
+
+def _header_positions(header, columns):
+    """按表头定位需要的列（同名列取第一个），返回 (列名列表, 列位置列表)"""
+    positions = {}
+    for position, name in enumerate(header):
+        if name is not None and str(name) in columns and str(name) not in positions:
+            positions[str(name)] = position
+    kept = [col for col in columns if col in positions]
+    return kept, [positions[col] for col in kept]
+
+
+def _buffers_to_frame(kept, buffers, rows_read):
+    """把逐行读取的各列值转为带类型的DataFrame"""
+    data = {}
+    with stage('类型转换', rows=rows_read):
+        for col, values in zip(kept, buffers):
+            if col in NUMERIC_COLUMNS:
+                data[col] = _to_float_array(values)
+            elif col not in DATE_COLUMNS:
+                data[col] = _to_text_series(values)
+
+    with stage('日期解析', rows=rows_read):
+        for col, values in zip(kept, buffers):
+            if col in DATE_COLUMNS:
+                data[col] = _to_datetime_series(values)
+
+    return finalize_columns(pd.DataFrame({col: data[col] for col in kept}))
+
+
+def analysis_columns():
+    """实际读取的列：分析所需的列去掉 config.DROPPED_COLUMNS 中配置为不读取的列"""
+    return [col for col in REQUIRED_COLUMNS if col not in DROPPED_COLUMNS]
+
+
+def schema_signature():
+    """解析结果格式的标识（格式版本 + 读取的列），用于区分磁盘缓存"""
+    signature = f"v{SCHEMA_VERSION}"
+    if DROPPED_COLUMNS:
+        dropped = ','.join(sorted(DROPPED_COLUMNS)).encode('utf-8')
+        signature += f"-{hashlib.sha1(dropped).hexdigest()[:8]}"
+    return signature
+
+
+def list_data_sheets(file_path_or_buffer):
+    """返回工作簿中的数据工作表名称；没有工作表符合条件时返回第一个工作表"""
+    if hasattr(file_path_or_buffer, 'seek'):
+        file_path_or_buffer.seek(0)
+
+    try:
+        workbook = load_workbook(file_path_or_buffer, read_only=True, data_only=True)
+    except InvalidFileException:
+        if hasattr(file_path_or_buffer, 'seek'):
+            file_path_or_buffer.seek(0)
+        with pd.ExcelFile(file_path_or_buffer) as excel_file:
+            sheet_names = excel_file.sheet_names
+            headers = {name: excel_file.parse(name, nrows=0).columns for name in sheet_names}
+    else:
+        try:
+            sheet_names = workbook.sheetnames
+            headers = {}
+            for name in sheet_names:
+                header = next(workbook[name].iter_rows(max_row=1, values_only=True), None) or ()
+                headers[name] = [str(value) for value in header if value is not None]
+        finally:
+            workbook.close()
+
+    data_sheets = [name for name in sheet_names
+                   if all(col in headers[name] for col in SHEET_KEY_COLUMNS)]
+    return data_sheets or sheet_names[:1]
+
+
+def finalize_columns(df):
+    """统一列类型：性状转为数值（能无损还原时压缩为float32）、日期列转为日期、层级列转为分类类型，并添加月份列"""
+    with stage('统一类型', rows=len(df)):
+        return _finalize_columns(df)
+
+
+def _finalize_columns(df):
+    for col in DROPPED_COLUMNS:
+        if col in df.columns:
+            df = df.drop(columns=col)
+
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = _compact_float(trait_values(df[col]))
+
+    for col in DATE_COLUMNS:
+        if col in df.columns and df[col].dtype.kind != 'M':
+            df[col] = _to_datetime_series(df[col])
+
+    # 层级列重复值多，转为分类类型（类别按值排序，与原先sorted(unique())的顺序一致）
+    for col in HIERARCHY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = _to_categorical(df[col])
+
+    # 添加月份列用于月度分析
+    if '入库日期' in df.columns:
+        df['年月'] = df['入库日期'].dt.to_period('M')
+
+    df.attrs[SCHEMA_ATTR] = schema_signature()
+    return df
+
+
+def is_validated(df):
+    """数据是否已由加载流程统一过类型（性状为数值、日期为datetime、层级为分类类型）
+
+    除 SCHEMA_ATTR 标记外还检查层级列确为分类类型：标记会随Parquet保存，但读回时类型不一定相同
+    """
+    if df.attrs.get(SCHEMA_ATTR) != schema_signature():
+        return False
+    return all(isinstance(df[col].dtype, pd.CategoricalDtype) for col in HIERARCHY_COLUMNS if col in df.columns)
+
+
+def restore_dtypes(df):
+    """还原Parquet读回时丢失的类型：取值为数字的分类列（如奶源地编码）会读回为普通整数列"""
+    for col in HIERARCHY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = _to_categorical(df[col])
+    return df
+
+
+def concat_frames(frames):
+    """合并多个已解析的数据，分类列的类别取并集并重新排序，保证合并后类型一致"""
+    frames = [frame for frame in frames if frame is not None]
+    categorical = [col for col in dict.fromkeys(col for frame in frames for col in frame.columns)
+                   if any(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames if col in frame.columns)]
+
+    combined = pd.concat(
+        [frame.astype({col: object for col in categorical if col in frame.columns}) for frame in frames],
+        ignore_index=True
+    )
+    for col in categorical:
+        combined[col] = _to_categorical(combined[col])
+    if frames and all(is_validated(frame) for frame in frames):
+        combined.attrs[SCHEMA_ATTR] = schema_signature()
+    return combined
+
+
+def trait_values(series):
+    """性状列转为float64数组：非数值记为NaN，float32压缩保存的值还原为原始数值"""
+    if series.dtype == np.float32:
+        return _restore_float32(series.to_numpy())
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+
+def memory_report(df):
+    """各列当前的内存占用，以及按pandas默认类型（文字为object、数值为float64）保存时的占用"""
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        current = series.memory_usage(index=False, deep=True)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            default = series.astype(object).memory_usage(index=False, deep=True)
+        elif series.dtype.kind == 'f':
+            default = len(series) * 8
+        else:
+            default = current
+        rows.append({'列': col, '类型': str(series.dtype), '压缩前(MB)': default / 1024 ** 2, '当前(MB)': current / 1024 ** 2})
+
+    report = pd.DataFrame(rows, columns=['列', '类型', '压缩前(MB)', '当前(MB)'])
+    total = pd.DataFrame([{'列': '合计', '类型': '',
+                           '压缩前(MB)': report['压缩前(MB)'].sum(), '当前(MB)': report['当前(MB)'].sum()}])
+    return pd.concat([report, total], ignore_index=True).round(2)
+
+
+def _compact_float(values):
+    """能从float32无损还原（见 _restore_float32）时压缩为float32，否则保持float64"""
+    compact = values.astype(np.float32)
+    if np.array_equal(_restore_float32(compact), values, equal_nan=True):
+        return compact
+    return values
+
+
+def _restore_float32(values):
+    """float32还原为float64：取能得到同一个float32值的最短小数
+
+    Excel中的性状值是位数有限的小数（如3.45），float32保存后取最短的对应小数即得原值；
+    写入时已校验整列都能还原，不能还原的列不会压缩
+    """
+    raw = values.astype(np.float64)
+    restored = raw.copy()
+    done = np.isnan(raw)
+    for decimals in RESTORE_DECIMALS:
+        candidate = np.round(raw, decimals)
+        hit = ~done & (candidate.astype(np.float32) == values)
+        restored[hit] = candidate[hit]
+        done |= hit
+        if done.all():
+            break
+    return restored
+
+
+def _to_datetime_series(values):
+    """日期列转为datetime：数字按Excel序列日期直接换算，其余按日期解析，无法解析的记为NaT"""
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if series.dtype.kind in 'iuf':
+        return pd.Series(_excel_serial_to_datetime(series.to_numpy(dtype=float)), index=series.index)
+
+    # 整列类型一致时（通常如此）直接整列转换，只有混合类型的列才逐个判断
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if inferred in ('integer', 'floating', 'mixed-integer-float'):
+        return pd.Series(_excel_serial_to_datetime(series.to_numpy(dtype=float, na_value=np.nan)), index=series.index)
+    if inferred in ('datetime', 'datetime64', 'date', 'string', 'empty'):
+        return pd.to_datetime(series, errors='coerce')
+
+    number_types = (int, float, np.integer, np.floating)
+    is_number = np.fromiter((isinstance(value, number_types) and not isinstance(value, bool)
+                             for value in series.to_numpy()), dtype=bool, count=len(series))
+
+    # 同一列中混有序列日期和日期/文字时分别转换
+    parsed = pd.to_datetime(series.where(~is_number), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    serial = _excel_serial_to_datetime(pd.to_numeric(series.where(is_number), errors='coerce').to_numpy(dtype=float))
+    return pd.Series(np.where(is_number, serial, parsed), index=series.index)
+
+
+def _excel_serial_to_datetime(serial):
+    """Excel序列日期（可带小数表示时间）转为datetime64，超出范围的记为NaT"""
+    valid = (serial > 0) & (serial <= EXCEL_MAX_SERIAL)
+    nanoseconds = np.round(np.where(valid, serial, 0) * 86400 * 10 ** 9).astype(np.int64)
+    result = EXCEL_EPOCH + nanoseconds.astype('timedelta64[ns]')
+    result[~valid] = np.datetime64('NaT')
+    return result
+
+
+def _to_categorical(series):
+    """转为类别有序排列的分类类型；数字与文字混合的列统一按文字处理"""
+    values = series.dropna().unique()
+    try:
+        categories = sorted(values)
+    except TypeError:
+        series = series.map(lambda value: value if pd.isna(value) else str(value))
+        categories = sorted(series.dropna().unique())
+    return pd.Series(pd.Categorical(series, categories=categories), index=series.index)
+
+
+def _to_float_array(values):
+    """把一列单元格值转为float数组，无法转换的值记为NaN"""
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+
+
+def _to_text_series(values):
+    """文本列：空字符串和Excel错误值记为缺失，整数形式的浮点数还原为整数（与pandas读取一致）"""
+    values = [
+        None if value == '' or value in ERROR_CODES
+        else int(value) if isinstance(value, float) and value.is_integer()
+        else value
+        for value in values
+    ]
+    return pd.Series(values).infer_objects()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+
+class FilterIndex:
+    """数据筛选索引
+
+    只保存按入库日期排序的行号（order），不复制数据：时间段筛选只需两次 searchsorted；
+    大区/区域/地区/奶源地名称为每个取值预先保存（排序后的）行位置，组合条件时对位置求交集，
+    最后经 order 换回原数据的行号，只做一次 take。筛选耗时与结果大小相关，而与数据总量无关。
+    筛选结果按入库日期排序；原数据已按日期排序时时间段筛选直接切片。
+    """
+
+    columns = ['大区', '区域', '地区', '奶源地名称']
+
+    def __init__(self, df):
+        # 按入库日期稳定排序，日期缺失的行排在最后
+        if '入库日期' in df.columns:
+            dates = df['入库日期'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            dates = np.where(dates == np.iinfo(np.int64).min, np.iinfo(np.int64).max, dates)
+            order = np.argsort(dates, kind='stable')
+            self.dates = dates[order]
+            # 已按日期排序时不保存 order
+            self.order = None if (order == np.arange(len(order))).all() else order
+        else:
+            self.dates = None
+            self.order = None
+        self.frame = df
+
+        # 每列：取值 → 行位置（升序）。positions 为按取值分段的行号，offsets 为各段起点
+        self.value_positions = {}
+        for col in self.columns:
+            if col not in df.columns:
+                continue
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                codes = df[col].cat.codes.to_numpy()
+                values = df[col].cat.categories
+            else:
+                codes, values = pd.factorize(df[col])
+            if self.order is not None:
+                codes = codes[self.order]
+
+            valid = codes >= 0
+            positions = np.flatnonzero(valid)[np.argsort(codes[valid], kind='stable')]
+            counts = np.bincount(codes[valid], minlength=len(values))
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            self.value_positions[col] = (
+                {value: code for code, value in enumerate(values)},
+                positions,
+                offsets
+            )
+
+    def filter(self, zones=None, regions=None, areas=None, date_range=None, farms=None):
+        """按条件筛选，条件与 DataProcessor.filter_data 相同"""
+        lo, hi = 0, len(self.frame)
+
+        # 时间段筛选：开始日期当天00:00:00至结束日期当天23:59:59
+        if date_range and len(date_range) == 2 and self.dates is not None:
+            start_date, end_date = date_range
+            start_datetime = pd.Timestamp(start_date).replace(hour=0, minute=0, second=0)
+            end_datetime = pd.Timestamp(end_date).replace(hour=23, minute=59, second=59)
+            lo = np.searchsorted(self.dates, start_datetime.as_unit('ns').value, side='left')
+            hi = np.searchsorted(self.dates, end_datetime.as_unit('ns').value, side='right')
+
+        selected_positions = None
+        for col, selected in (('大区', zones), ('区域', regions), ('地区', areas), ('奶源地名称', farms)):
+            if not selected or len(selected) == 0:
+                continue
+            if col not in self.value_positions:
+                raise KeyError(col)
+
+            positions = self._positions_for(col, selected, lo, hi)
+            if selected_positions is None:
+                selected_positions = positions
+            else:
+                selected_positions = np.intersect1d(selected_positions, positions, assume_unique=True)
+
+        if selected_positions is None:
+            # 没有条件时返回原数据；只有时间段条件且原数据已排序时直接切片，不复制数据
+            if lo == 0 and hi == len(self.frame):
+                return self.frame
+            if self.order is None:
+                return self.frame.iloc[lo:hi]
+            selected_positions = np.arange(lo, hi)
+
+        if self.order is not None:
+            selected_positions = self.order[selected_positions]
+        return self.frame.take(selected_positions)
+
+    def _positions_for(self, col, selected, lo, hi):
+        """所选取值在 [lo, hi) 范围内的行位置（升序、不重复）"""
+        codes, positions, offsets = self.value_positions[col]
+        parts = []
+        for value in selected:
+            code = codes.get(value)
+            if code is None:
+                continue
+            segment = positions[offsets[code]:offsets[code + 1]]
+            # 每段内行号升序，可直接二分截取时间段范围
+            parts.append(segment[np.searchsorted(segment, lo):np.searchsorted(segment, hi)])
+
+        if not parts:
+            return np.array([], dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts))
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+
+class HierarchyIndex:
+    """大区→区域→地区→奶源地 层级索引
+
+    加载数据时由去重后的层级组合构建一次，筛选控件的选项只查字典，不再扫描原始数据
+    """
+
+    levels = ['大区', '区域', '地区', '奶源地名称']
+
+    def __init__(self, df):
+        self.available = [level for level in self.levels if level in df.columns]
+        combos = df[self.available].drop_duplicates().reset_index(drop=True)
+
+        # 每个层级：值 → 含有该值的层级组合编号
+        self.combos = {level: combos[level].to_numpy(dtype=object) for level in self.available}
+        self.positions = {}
+        for level in self.available:
+            level_positions = {}
+            for position, value in enumerate(self.combos[level]):
+                if pd.isna(value):
+                    continue
+                level_positions.setdefault(value, []).append(position)
+            self.positions[level] = {value: np.array(pos) for value, pos in level_positions.items()}
+
+        self.all_options = {level: sorted(self.positions[level]) for level in self.available}
+
+    def options(self, level, zones=None, regions=None, areas=None):
+        """返回在已选上级条件下可选的值（已排序）；上级未选择时不限制"""
+        if level not in self.available:
+            return []
+
+        selected_positions = None
+        for parent, selected in (('大区', zones), ('区域', regions), ('地区', areas)):
+            if parent == level:
+                break
+            if not selected or parent not in self.available:
+                continue
+
+            parent_positions = [self.positions[parent][value] for value in selected if value in self.positions[parent]]
+            positions = np.unique(np.concatenate(parent_positions)) if parent_positions else np.array([], dtype=int)
+            if selected_positions is None:
+                selected_positions = positions
+            else:
+                selected_positions = np.intersect1d(selected_positions, positions, assume_unique=True)
+
+        if selected_positions is None:
+            return list(self.all_options[level])
+
+        values = self.combos[level][selected_positions]
+        return sorted({value for value in values if not pd.isna(value)})
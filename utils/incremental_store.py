@@ -0,0 +1,229 @@
+import glob
+import json
+import os
+import shutil
+import time
+import uuid
+
+import pandas as pd
+
+from config import DATA_STORE_DIR
+from .excel_reader import concat_frames, restore_dtypes
+from .parallel_loader import load_workbooks
+from .statistics_calculator import StatisticsCalculator
+
+# 判断重复记录的键：同一奶源地、同一入库日期和上号日期视为同一条记录
+DEDUP_KEYS = ['奶源地编码', '入库日期', '上号日期']
+# 持久化的分组统计量粒度，与 calculate_statistics 的分组一致
+MOMENT_KEYS = ['年月', '奶源地名称', '区域', '地区']
+# 判断分组是否需要重算的粒度（月份 × 牧场）
+DIRTY_KEYS = ['年月', '奶源地名称']
+# 入库日期缺失（没有月份）的记录所在的分区
+UNDATED_PARTITION = '无日期'
+
+
+class IncrementalStore:
+    """本地累积数据集：按月追加新数据，只重算受影响的（月份, 牧场）分组
+
+    数据按 年月 分区，每月一个Parquet文件（data/store/dataset/2024-03.parquet），各分组的统计量
+    （样本数、均值、σ）另存一个文件。同一记录的入库日期相同、必在同一分区，追加时只读取、去重并重写
+    新数据涉及的月份；统计量与系数无关，未受影响的分组直接复用。追加一个月的数据只与该月的数据量有关。
+    """
+
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir or DATA_STORE_DIR
+        self.calculator = StatisticsCalculator()
+
+    @property
+    def dataset_dir(self):
+        return os.path.join(self.store_dir, 'dataset')
+
+    @property
+    def legacy_dataset_path(self):
+        """分区前的单文件数据集，下次追加时拆分为按月分区"""
+        return os.path.join(self.store_dir, 'dataset.parquet')
+
+    @property
+    def moments_path(self):
+        return os.path.join(self.store_dir, 'moments.parquet')
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.store_dir, 'manifest.json')
+
+    def exists(self):
+        return bool(self.partitions()) or os.path.exists(self.legacy_dataset_path)
+
+    def partition_path(self, partition):
+        return os.path.join(self.dataset_dir, f'{partition}.parquet')
+
+    def partitions(self):
+        """已保存的分区名（按月份排序，无日期的分区在最后）"""
+        names = [os.path.basename(path)[:-len('.parquet')]
+                 for path in glob.glob(os.path.join(self.dataset_dir, '*.parquet'))]
+        return sorted(names, key=lambda name: (name == UNDATED_PARTITION, name))
+
+    def manifest(self):
+        """数据集版本与追加记录"""
+        if not os.path.exists(self.manifest_path):
+            return {'version': None, 'appends': []}
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_dataset(self):
+        """读取全部分区（按月份顺序）合并为一个DataFrame"""
+        if not self.exists():
+            return None
+        frames = [self.load_partition(partition) for partition in self.partitions()]
+        if os.path.exists(self.legacy_dataset_path):
+            frames.append(restore_dtypes(pd.read_parquet(self.legacy_dataset_path)))
+        return concat_frames(frames)
+
+    def load_partition(self, partition):
+        path = self.partition_path(partition)
+        if not os.path.exists(path):
+            return None
+        return restore_dtypes(pd.read_parquet(path))
+
+    def load_moments(self):
+        if not os.path.exists(self.moments_path):
+            return None
+        return pd.read_parquet(self.moments_path)
+
+    def append(self, file_path_or_buffer, source_name=None):
+        """追加一个新文件（或已解析的DataFrame），返回本次追加的摘要"""
+        if isinstance(file_path_or_buffer, pd.DataFrame):
+            new_df = file_path_or_buffer
+        else:
+            new_df = load_workbooks([file_path_or_buffer])
+
+        dedup_keys = [col for col in DEDUP_KEYS if col in new_df.columns]
+        moments = self.load_moments()
+        self._split_legacy_dataset()
+
+        # 新文件内部去重，同一记录以后出现的为准
+        incoming = new_df.drop_duplicates(subset=dedup_keys, keep='last') if dedup_keys else new_df
+        internal_duplicates = len(new_df) - len(incoming)
+        incoming_partitions = partition_labels(incoming)
+
+        # 只读取新数据涉及的月份分区，在分区内去重
+        partitions = {}
+        replaced_frames = []
+        for partition in sorted(set(incoming_partitions)):
+            incoming_part = incoming[incoming_partitions == partition]
+            existing = self.load_partition(partition)
+            if existing is None:
+                partitions[partition] = concat_frames([incoming_part])
+                continue
+            # 已有记录与新记录重复时用新记录替换（新文件可能包含更正）
+            existing_keys = pd.MultiIndex.from_frame(existing[dedup_keys].astype(object))
+            incoming_keys = pd.MultiIndex.from_frame(incoming_part[dedup_keys].astype(object))
+            is_replaced = existing_keys.isin(incoming_keys)
+            replaced_frames.append(existing[is_replaced])
+            partitions[partition] = concat_frames([existing[~is_replaced], incoming_part])
+        replaced_count = sum(len(frame) for frame in replaced_frames)
+
+        # 新增与被替换的记录所在的（月份, 牧场）分组需要重算，这些分组只在本次改写的分区中
+        dirty = pd.concat([incoming[DIRTY_KEYS].astype(object)] +
+                          [frame[DIRTY_KEYS].astype(object) for frame in replaced_frames]).drop_duplicates()
+        dirty_index = pd.MultiIndex.from_frame(dirty)
+
+        touched = concat_frames(list(partitions.values()))
+        in_dirty = pd.MultiIndex.from_frame(touched[DIRTY_KEYS].astype(object)).isin(dirty_index)
+        fresh_moments = self.calculator.calculate_group_moments(touched[in_dirty], MOMENT_KEYS)
+
+        if moments is not None and len(moments) > 0:
+            kept = ~pd.MultiIndex.from_frame(moments[DIRTY_KEYS].astype(object)).isin(dirty_index)
+            moments = concat_frames([moments[kept], fresh_moments])
+        else:
+            moments = fresh_moments
+        moments = moments.sort_values(MOMENT_KEYS).reset_index(drop=True)
+
+        # 各分区的记录数记在清单中，总记录数不需要读取未改动的分区
+        partition_rows = dict(self.manifest().get('partitions', {}))
+        partition_rows.update({partition: len(frame) for partition, frame in partitions.items()})
+
+        summary = {
+            '新增记录': int(len(incoming) - replaced_count),
+            '更新记录': int(replaced_count),
+            '文件内重复': int(internal_duplicates),
+            '重算分组': int(len(dirty)),
+            '复用分组': int(len(moments) - len(fresh_moments)),
+            '改写分区': len(partitions),
+            '总记录数': int(sum(partition_rows.values()))
+        }
+        self._save(partitions, moments, summary, source_name, partition_rows)
+        return summary
+
+    def statistics(self, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
+        """由保存的分组统计量直接得到详细分析结果（与 calculate_statistics 的输出相同）"""
+        moments = self.load_moments()
+        if moments is None or len(moments) == 0:
+            return pd.DataFrame()
+        return self.calculator.statistics_from_moments(
+            moments, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max
+        )
+
+    def clear(self):
+        """删除本地累积数据集"""
+        if os.path.isdir(self.dataset_dir):
+            shutil.rmtree(self.dataset_dir)
+        for path in (self.legacy_dataset_path, self.moments_path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _split_legacy_dataset(self):
+        """把分区前的单文件数据集拆分为按月分区（只在第一次追加时读取一次全部数据）"""
+        if not os.path.exists(self.legacy_dataset_path):
+            return
+        legacy = restore_dtypes(pd.read_parquet(self.legacy_dataset_path))
+        labels = partition_labels(legacy)
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        partition_rows = {}
+        for partition in sorted(set(labels)):
+            part = concat_frames([legacy[labels == partition]])
+            write_stored_frame(part, self.partition_path(partition))
+            partition_rows[partition] = len(part)
+        manifest = self.manifest()
+        manifest['partitions'] = partition_rows
+        self._write_manifest(manifest)
+        os.remove(self.legacy_dataset_path)
+
+    def _save(self, partitions, moments, summary, source_name, partition_rows):
+        os.makedirs(self.dataset_dir, exist_ok=True)
+        for partition, frame in partitions.items():
+            write_stored_frame(frame, self.partition_path(partition))
+        write_stored_frame(moments, self.moments_path)
+
+        manifest = self.manifest()
+        manifest['version'] = uuid.uuid4().hex
+        manifest['partitions'] = partition_rows
+        manifest['appends'].append({
+            '文件': source_name,
+            '时间': time.strftime('%Y-%m-%d %H:%M:%S'),
+            **summary
+        })
+        self._write_manifest(manifest)
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def partition_labels(df):
+    """每行所在的分区名：入库月份（如 2024-03），日期缺失时为 无日期"""
+    if '年月' in df.columns:
+        months = df['年月']
+    else:
+        months = df['入库日期'].dt.to_period('M')
+    return months.astype(str).where(months.notna(), UNDATED_PARTITION).to_numpy()
+
+
+def write_stored_frame(df, path):
+    """先写临时文件再替换，避免中途失败留下不完整的文件"""
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
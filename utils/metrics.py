@@ -0,0 +1,108 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import METRICS_LOG_PATH
+
+# 当前生效的记录器；没有时 stage() 不做任何记录
+_active_recorder = contextvars.ContextVar('cpk_metrics_recorder', default=None)
+_log_lock = threading.Lock()
+
+
+class MetricsRecorder:
+    """分阶段记录耗时、数据行数和内存变化
+
+    在加载、筛选、统计等步骤外包一层 stage()，记录保存在内存中供页面展示，并逐条追加到JSON-lines日志。
+    activate() 后，库函数中通过模块级 stage() 记录的阶段都归入此记录器。
+    """
+
+    def __init__(self, log_path=METRICS_LOG_PATH, session_id=None, keep=200):
+        self.log_path = log_path
+        self.session_id = session_id
+        self.records = deque(maxlen=keep)
+
+    def activate(self):
+        """设为当前线程（Streamlit中即当前会话的脚本线程）的记录器"""
+        _active_recorder.set(self)
+        return self
+
+    @contextmanager
+    def stage(self, name, rows=None, **context):
+        """记录一个阶段；可在阶段内设置 record['rows'] 等字段"""
+        record = {'阶段': name, '行数': rows, **context}
+        memory_before = current_memory()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['耗时(秒)'] = round(time.perf_counter() - start, 4)
+            memory_after = current_memory()
+            if memory_before is not None and memory_after is not None:
+                record['内存变化(MB)'] = round((memory_after - memory_before) / 1024 ** 2, 1)
+            self.add(record)
+
+    def add(self, record):
+        record = {'时间': time.strftime('%Y-%m-%d %H:%M:%S'), **record}
+        if self.session_id is not None:
+            record.setdefault('会话', self.session_id)
+        self.records.append(record)
+
+        if self.log_path:
+            try:
+                with _log_lock:
+                    os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            except OSError as e:
+                print(f"写入性能日志失败: {e}")
+
+
+@contextmanager
+def stage(name, rows=None, **context):
+    """在当前记录器中记录一个阶段；没有生效的记录器时只执行代码块"""
+    recorder = _active_recorder.get()
+    if recorder is None:
+        yield {}
+        return
+    with recorder.stage(name, rows, **context) as record:
+        yield record
+
+
+def collect_records(func, *args, **kwargs):
+    """在新记录器中执行 func，返回 (结果, 记录列表)；用于子进程把阶段记录带回主进程"""
+    recorder = MetricsRecorder(log_path=None)
+    token = _active_recorder.set(recorder)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _active_recorder.reset(token)
+    return result, list(recorder.records)
+
+
+def merge_records(records):
+    """把子进程带回的阶段记录并入当前记录器"""
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return
+    for record in records:
+        record = {key: value for key, value in record.items() if key != '时间'}
+        recorder.add(record)
+
+
+def current_memory():
+    """当前进程占用的物理内存（字节），无法获取时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
@@ -0,0 +1,165 @@
+import io
+import multiprocessing
+import os
+import queue
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from config import INGEST_MAX_WORKERS
+from .excel_reader import read_excel_columns, list_data_sheets, concat_frames
+from .metrics import collect_records, merge_records, stage
+
+# 并行读取时主进程汇总子进程进度、检查取消的间隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+
+class LoadCancelled(Exception):
+    """加载过程中被取消"""
+
+
+def load_workbooks(sources, max_workers=None, progress_callback=None, cancel_event=None):
+    """读取多个工作簿中的所有数据工作表并合并为一个DataFrame
+
+    每个（工作簿, 工作表）在单独的进程中解析，解析时间随CPU核数而不是文件数增长。
+    合并时分类列的类别取并集，结果的列类型与单文件读取一致，行按文件和工作表的顺序排列。
+    progress_callback(完成比例, 说明文字) 用于显示进度；
+    cancel_event（threading.Event）被设置后尽快停止读取并抛出 LoadCancelled
+    """
+    tasks = []
+    for source in sources:
+        _check_cancelled(cancel_event)
+        payload = _payload(source)
+        for sheet_name in list_data_sheets(_open(payload)):
+            tasks.append((payload, sheet_name))
+
+    if not tasks:
+        return None
+
+    workers = min(max_workers or INGEST_MAX_WORKERS or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        frames = _load_serial(tasks, progress_callback, cancel_event)
+    else:
+        frames = _load_parallel(tasks, workers, progress_callback, cancel_event)
+
+    if len(frames) == 1:
+        return frames[0]
+    with stage('合并工作表', rows=sum(len(frame) for frame in frames)):
+        return concat_frames(frames)
+
+
+def _load_parallel(tasks, workers, progress_callback, cancel_event):
+    """各工作表在进程池中解析
+
+    子进程每读取一批行把 (工作表序号, 已读行数, 总行数) 放入共享队列，主进程定期汇总为按行计的进度；
+    取消时通知子进程在下一次报告进度时停止，尚未开始的工作表不再解析
+    """
+    frames = [None] * len(tasks)
+    sheet_fractions = [0.0] * len(tasks)
+    sheet_rows = [0] * len(tasks)
+    context = _pool_context()
+    # 队列和取消标志在子进程启动时传入（不能随任务传递）
+    progress_queue = context.Queue()
+    worker_cancel = context.Event()
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(progress_queue, worker_cancel))
+    try:
+        futures = {executor.submit(_parse_sheet, payload, sheet_name, position): position
+                   for position, (payload, sheet_name) in enumerate(tasks)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            _check_cancelled(cancel_event)
+            _drain_progress(progress_queue, sheet_fractions, sheet_rows)
+            for future in done:
+                position = futures[future]
+                frames[position], records = future.result()
+                # 子进程中各阶段的记录并入当前记录器
+                merge_records(records)
+                sheet_fractions[position] = 1.0
+                sheet_rows[position] = len(frames[position])
+            if progress_callback:
+                completed = len(tasks) - len(pending)
+                progress_callback(sum(sheet_fractions) / len(tasks),
+                                  f"已读取 {sum(sheet_rows):,} 条记录（完成 {completed}/{len(tasks)} 个工作表）...")
+    except BaseException:
+        # 取消或出错时未开始的工作表不再解析，正在解析的在下一次报告进度时停止；
+        # 等子进程退出后再释放队列和取消标志（子进程仍在启动时需要它们）
+        worker_cancel.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown()
+    return frames
+
+
+def _drain_progress(progress_queue, sheet_fractions, sheet_rows):
+    """取出队列中子进程报告的进度，更新各工作表的完成比例和已读行数"""
+    while True:
+        try:
+            position, rows_read, total_rows = progress_queue.get_nowait()
+        except queue.Empty:
+            return
+        sheet_rows[position] = max(sheet_rows[position], rows_read)
+        if total_rows:
+            sheet_fractions[position] = max(sheet_fractions[position], min(rows_read / total_rows, 1.0))
+
+
+def _pool_context():
+    """进程池的启动方式：加载在后台线程中进行，从多线程进程中fork不安全，POSIX上改用forkserver（其余平台为spawn）"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _load_serial(tasks, progress_callback, cancel_event):
+    """只有一个工作表（或只允许一个进程）时在当前进程内读取，按读取行数报告进度"""
+    frames = []
+    for position, (payload, sheet_name) in enumerate(tasks):
+        def report(rows_read, total_rows):
+            _check_cancelled(cancel_event)
+            if progress_callback:
+                fraction = min(rows_read / total_rows, 1.0) if total_rows else 0
+                progress_callback((position + fraction) / len(tasks), f"已读取 {rows_read:,} 条记录...")
+
+        _check_cancelled(cancel_event)
+        frames.append(read_excel_columns(_open(payload), sheet_name=sheet_name, progress_callback=report))
+    return frames
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise LoadCancelled("加载已取消")
+
+
+# 子进程中的进度队列和取消标志（由 _init_worker 设置）
+_worker_progress = None
+_worker_cancel = None
+
+
+def _init_worker(progress_queue, cancel_event):
+    global _worker_progress, _worker_cancel
+    _worker_progress = progress_queue
+    _worker_cancel = cancel_event
+
+
+def _parse_sheet(payload, sheet_name, position=None):
+    """子进程入口：解析一个工作表，同时返回各阶段的耗时记录；读取过程中报告进度并检查是否已取消"""
+    def report(rows_read, total_rows):
+        _check_cancelled(_worker_cancel)
+        if _worker_progress is not None:
+            _worker_progress.put((position, rows_read, total_rows))
+
+    _check_cancelled(_worker_cancel)
+    return collect_records(read_excel_columns, _open(payload), sheet_name=sheet_name, progress_callback=report)
+
+
+def _payload(source):
+    """转为可传给子进程的形式：文件路径保持不变，上传的文件对象取出字节内容"""
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    return source
+
+
+def _open(payload):
+    return io.BytesIO(payload) if isinstance(payload, bytes) else payload
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+from config import RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_MB
+from .dataset_registry import estimate_bytes
+
+
+def make_key(dataset_key, kind, filters=None, **params):
+    """由数据集、结果类型、筛选条件和计算参数生成缓存键
+
+    筛选条件中的多选列表按值排序、日期统一为ISO格式，选择顺序不同但含义相同的条件得到同一个键
+    """
+    if dataset_key is None:
+        # 没有可标识的数据集时不缓存
+        return None
+
+    spec = {
+        'dataset': dataset_key,
+        'kind': kind,
+        'filters': {name: _normalize(value) for name, value in (filters or {}).items()},
+        'params': {name: _normalize(value) for name, value in params.items()}
+    }
+    payload = json.dumps(spec, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_normalize(item) for item in value]
+        # 多选列表不区分顺序；日期范围等有序的二元组保持顺序
+        return items if isinstance(value, tuple) else sorted(items, key=str)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # numpy标量
+        return value.item()
+    return value
+
+
+class ResultCache:
+    """分析结果缓存：相同数据集、筛选条件和参数的结果直接复用
+
+    进程内共享，按条目数和总字节数限制容量，超出时淘汰最久未使用的结果，并记录命中/未命中次数
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries if max_entries is not None else RESULT_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else RESULT_CACHE_MAX_MB * 1024 * 1024
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """命中时返回缓存的结果，否则调用 compute() 计算并缓存；key为None时不缓存"""
+        if key is None:
+            return compute()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = estimate_bytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回条目数、总字节数、命中和未命中次数"""
+        with self._lock:
+            return {
+                '条目数': len(self._entries),
+                '总大小': self._bytes,
+                '命中': self.hits,
+                '未命中': self.misses
+            }
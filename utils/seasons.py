@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+from config import SUMMER_END, SUMMER_START
+
+SEASON_COLUMN = '季节'
+SEASONS = ['夏季', '冬季']
+
+# 按季节取值的系数；酸度公差只影响CP，两季共用夏季的设置
+SEASONAL_KEYS = ['脂肪', '蛋白', '干物质', '体细胞', '酸度_min', '酸度_max']
+
+
+def default_window():
+    """config.py 中的夏季时间段（月-日）"""
+    return (SUMMER_START, SUMMER_END)
+
+
+def is_seasonal(coefficients):
+    """系数是否按季节给出（{'夏季': {...}, '冬季': {...}}）"""
+    return all(isinstance(coefficients.get(season), dict) for season in SEASONS)
+
+
+def season_labels(dates, summer_window):
+    """按入库日期的月-日判断季节（每年相同），夏季时间段包含首尾两天；日期缺失时为NaN
+
+    summer_window 为 (开始, 结束)，可以是日期或 'MM-DD' 字符串；开始晚于结束时视为跨年的时间段
+    """
+    dates = pd.to_datetime(pd.Series(dates))
+    month_day = (dates.dt.month * 100 + dates.dt.day).to_numpy()
+    start, end = (_month_day(value) for value in summer_window)
+
+    with np.errstate(invalid='ignore'):
+        if start <= end:
+            summer = (month_day >= start) & (month_day <= end)
+        else:
+            summer = (month_day >= start) | (month_day <= end)
+
+    codes = np.where(dates.isna().to_numpy(), -1, np.where(summer, 0, 1))
+    return pd.Categorical.from_codes(codes, categories=SEASONS)
+
+
+def add_season(df, summer_window):
+    """返回加上 季节 列的新DataFrame（不修改传入的数据）"""
+    return df.assign(**{SEASON_COLUMN: season_labels(df['入库日期'], summer_window)})
+
+
+def season_coefficients(coefficients, season):
+    """某一季节使用的系数字典"""
+    resolved = dict(coefficients['夏季'])
+    resolved.update({key: value for key, value in coefficients[season].items() if key in SEASONAL_KEYS})
+    return resolved
+
+
+def resolve_coefficients(coefficients, seasons):
+    """按季节给出的系数展开为与各分组对齐的系数：两季取值相同的系数保持原样，不同的为数组
+
+    系数值也可以是数组（如系数假设分析中各组合的取值，形状为 (组合数, 1)），按最后一维与分组对齐广播
+    """
+    summer = season_coefficients(coefficients, '夏季')
+    winter = season_coefficients(coefficients, '冬季')
+    is_summer = np.asarray(seasons) == '夏季'
+
+    resolved = dict(summer)
+    for key in SEASONAL_KEYS:
+        if key in summer and key in winter and np.any(np.not_equal(summer[key], winter[key])):
+            resolved[key] = np.where(is_summer, summer[key], winter[key])
+    return resolved
+
+
+def _month_day(value):
+    if isinstance(value, str):
+        month, day = value.split('-')[-2:]
+        return int(month) * 100 + int(day)
+    return value.month * 100 + value.day
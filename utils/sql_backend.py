@@ -0,0 +1,309 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import SQL_DB_DIR
+from .disk_cache import combine_hashes, content_hash
+from .excel_reader import HIERARCHY_COLUMNS, NUMERIC_COLUMNS, _to_categorical, trait_values
+from .metrics import stage
+from .seasons import SEASON_COLUMN, SEASONS, _month_day
+from .statistics_calculator import StatisticsCalculator
+from .streaming_stats import iter_chunks
+
+DB_PATH = os.path.join(SQL_DB_DIR, 'cpk.sqlite')
+
+# 入库日期以 'YYYY-MM-DD HH:MM:SS' 文本保存：按字符串比较即按时间比较，用 substr 取年、月、日
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 各时间粒度的 时间段 表达式，格式与 StatsCube.rollup 相同（2024-01、2024Q1、2024）
+_MONTH = 'CAST(substr("入库日期", 6, 2) AS INTEGER)'
+_QUARTER = f'(CASE WHEN {_MONTH} <= 3 THEN 1 WHEN {_MONTH} <= 6 THEN 2 WHEN {_MONTH} <= 9 THEN 3 ELSE 4 END)'
+PERIOD_EXPRESSIONS = {
+    '按月': 'substr("入库日期", 1, 7)',
+    '按季度': f'substr("入库日期", 1, 4) || \'Q\' || CAST({_QUARTER} AS VARCHAR)',
+    '按年': 'substr("入库日期", 1, 4)'
+}
+
+
+class SqlBackend:
+    """SQLite数据库中的累积数据集：筛选条件和分组汇总以SQL在数据库内执行，只把各分组的统计量取回Python
+
+    数据保存在 data/db/ 下的单个SQLite文件中，不需要数据库服务。
+    导入的每个文件按内容hash登记，重复导入时跳过；全部记录存放在 records 表，入库日期和各层级列建有索引。
+    每组返回 数据量 以及各性状的 n、Σ(x-偏移)、Σ(x-偏移)²，均值和σ在Python中推导（与读入内存时只差浮点舍入），
+    偏移为各性状的均值（避免大数相减），保存在 metadata 表中：
+    首次写入时取第一块数据的均值，向空数据库导入完成后（包括 reload 重新导入）按全部数据重算
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.traits = list(NUMERIC_COLUMNS)
+        self._create_tables()
+
+    def close(self):
+        self.connection.close()
+
+    def _create_tables(self):
+        # 层级列不声明类型：数字编码（如奶源地编码）按INTEGER保存、文字按TEXT保存，排序和分组与读入内存时相同
+        columns = ', '.join(
+            ['"来源" VARCHAR'] + [f'"{col}"' for col in HIERARCHY_COLUMNS] + ['"入库日期" VARCHAR'] +
+            [f'"{trait}" DOUBLE' for trait in self.traits]
+        )
+        statements = [
+            f'CREATE TABLE IF NOT EXISTS records ({columns})',
+            'CREATE TABLE IF NOT EXISTS sources ("hash" VARCHAR PRIMARY KEY, "文件" VARCHAR, "行数" BIGINT, "导入时间" VARCHAR)',
+            'CREATE TABLE IF NOT EXISTS metadata ("性状" VARCHAR PRIMARY KEY, "偏移" DOUBLE, "行数" BIGINT, "更新时间" VARCHAR)',
+            'CREATE INDEX IF NOT EXISTS idx_records_date ON records ("入库日期")'
+        ]
+        for position, col in enumerate(HIERARCHY_COLUMNS):
+            statements.append(f'CREATE INDEX IF NOT EXISTS idx_records_level{position} ON records ("{col}")')
+        for statement in statements:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def _query(self, sql, params=()):
+        cursor = self.connection.execute(sql, list(params))
+        columns = [description[0] for description in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    def sources(self):
+        """已导入的文件"""
+        return self._query('SELECT "文件", "行数", "导入时间", "hash" FROM sources ORDER BY "导入时间"')
+
+    def version(self):
+        """由已导入文件的hash组成的数据版本，导入新文件后改变（用作分析结果缓存键）"""
+        hashes = self._query('SELECT "hash" FROM sources ORDER BY "hash"')['hash'].tolist()
+        return combine_hashes(hashes) if hashes else None
+
+    def import_sources(self, sources, chunk_rows=None, progress_callback=None):
+        """分块导入Excel（或Parquet）文件，已导入过的文件（内容相同）跳过；返回本次导入的行数
+
+        向空数据库导入时，导入完成后按全部数据重算各性状的偏移。progress_callback(文件名, 已导入行数) 报告进度
+        """
+        full_load = self.row_count() == 0
+        imported = 0
+        for source in sources:
+            source_hash = content_hash(source)
+            if len(self._query('SELECT 1 FROM sources WHERE "hash" = ?', [source_hash])) > 0:
+                continue
+
+            name = os.path.basename(str(getattr(source, 'name', source)))
+            rows = 0
+            try:
+                for chunk in iter_chunks([source], chunk_rows):
+                    rows += self.insert_frame(chunk, source_hash)
+                    if progress_callback:
+                        progress_callback(name, rows)
+                self.connection.execute(
+                    'INSERT INTO sources VALUES (?, ?, ?, ?)',
+                    [source_hash, name, rows, time.strftime('%Y-%m-%d %H:%M:%S')]
+                )
+                self.connection.commit()
+            except Exception:
+                # 导入中断时不留下半个文件的数据，下次重新导入
+                self.connection.rollback()
+                raise
+            imported += rows
+
+        if full_load and imported > 0:
+            self.recompute_shifts()
+        return imported
+
+    def reload(self, sources, chunk_rows=None, progress_callback=None):
+        """清空数据库后重新导入全部文件，偏移按重新导入的全部数据计算；返回导入的行数"""
+        for table in ('records', 'sources', 'metadata'):
+            self.connection.execute(f'DELETE FROM {table}')
+        self.connection.commit()
+        return self.import_sources(sources, chunk_rows, progress_callback)
+
+    def insert_frame(self, df, source_key):
+        """写入一块数据（不提交），返回行数；数据库中还没有偏移时按这块数据记录"""
+        if len(df) == 0:
+            return 0
+
+        with stage('写入数据库', rows=len(df)):
+            frame = pd.DataFrame({'来源': np.full(len(df), source_key, dtype=object)})
+            for col in HIERARCHY_COLUMNS:
+                frame[col] = df[col].astype(object).where(df[col].notna(), None) if col in df.columns else None
+            dates = df['入库日期']
+            frame['入库日期'] = dates.dt.strftime(DATE_FORMAT).astype(object).where(dates.notna(), None)
+            for trait in self.traits:
+                values = trait_values(df[trait]) if trait in df.columns else np.full(len(df), np.nan)
+                frame[trait] = pd.Series(values, dtype=object).where(~np.isnan(values), None)
+
+            if len(self._query('SELECT 1 FROM metadata LIMIT 1')) == 0:
+                self._write_shifts({trait: pd.to_numeric(frame[trait], errors='coerce') for trait in self.traits})
+            placeholders = ', '.join(['?'] * len(frame.columns))
+            self.connection.executemany(f'INSERT INTO records VALUES ({placeholders})',
+                                        frame.itertuples(index=False, name=None))
+        return len(frame)
+
+    def recompute_shifts(self):
+        """按数据库中的全部记录重算各性状的偏移（均值）并提交"""
+        select = ', '.join(f'AVG("{trait}") AS "{trait}_均值", COUNT("{trait}") AS "{trait}_n"' for trait in self.traits)
+        totals = self._query(f'SELECT {select} FROM records').iloc[0]
+        updated = time.strftime('%Y-%m-%d %H:%M:%S')
+        for trait in self.traits:
+            shift = totals[f'{trait}_均值']
+            self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                                    [trait, 0.0 if pd.isna(shift) else float(shift), int(totals[f'{trait}_n']), updated])
+        self.connection.commit()
+
+    def _write_shifts(self, values):
+        updated = time.strftime('%Y-%m-%d %H:%M:%S')
+        for trait, series in values.items():
+            shift = float(series.mean()) if series.notna().any() else 0.0
+            self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                                    [trait, shift, int(series.notna().sum()), updated])
+
+    def shifts(self):
+        """各性状当前使用的偏移（metadata 表）"""
+        shifts = self._query('SELECT "性状", "偏移" FROM metadata')
+        return dict(zip(shifts['性状'], shifts['偏移']))
+
+    def where_clause(self, zones=None, regions=None, areas=None, date_range=None, farms=None):
+        """与 DataProcessor.filter_data 相同的筛选条件，返回 (WHERE子句, 参数)"""
+        conditions = []
+        params = []
+        for col, values in (('大区', zones), ('区域', regions), ('地区', areas), ('奶源地名称', farms)):
+            if values and len(values) > 0:
+                conditions.append(f'"{col}" IN ({", ".join(["?"] * len(values))})')
+                # 层级列按原类型保存，数字编码按数字比较
+                params.extend(value.item() if isinstance(value, np.generic) else value for value in values)
+
+        if date_range and len(date_range) == 2:
+            # 开始日期为当天的00:00:00，结束日期为当天的23:59:59
+            start_date, end_date = date_range
+            conditions.append('"入库日期" >= ? AND "入库日期" <= ?')
+            params.append(pd.Timestamp(start_date).replace(hour=0, minute=0, second=0).strftime(DATE_FORMAT))
+            params.append(pd.Timestamp(end_date).replace(hour=23, minute=59, second=59).strftime(DATE_FORMAT))
+
+        if not conditions:
+            return '', params
+        return 'WHERE ' + ' AND '.join(conditions), params
+
+    def row_count(self, **filters):
+        """满足筛选条件的记录数"""
+        where, params = self.where_clause(**filters)
+        return int(self._query(f'SELECT COUNT(*) AS "行数" FROM records {where}', params)['行数'].iloc[0])
+
+    def date_bounds(self):
+        """数据库中最早和最晚的入库日期（没有数据时为 (None, None)）"""
+        bounds = self._query('SELECT MIN("入库日期") AS "开始", MAX("入库日期") AS "结束" FROM records')
+        return tuple(None if pd.isna(value) else pd.Timestamp(value) for value in bounds.iloc[0])
+
+    def hierarchy(self):
+        """去重后的 大区、区域、地区、奶源地名称 组合（用于构建 HierarchyIndex）"""
+        columns = ', '.join(f'"{col}"' for col in HIERARCHY_COLUMNS)
+        return self._query(f'SELECT DISTINCT {columns} FROM records')
+
+    def category_dtype(self, col):
+        """层级列的分类类型：类别为数据库中的全部取值（与读入全部数据时相同，数字编码为整数类别）"""
+        # 按单列去重可直接扫描该列的索引
+        values = self._query(f'SELECT DISTINCT "{col}" FROM records WHERE "{col}" IS NOT NULL')[col]
+        return _to_categorical(values).dtype
+
+    def restore_categories(self, df):
+        """把查询结果中的层级列还原为读入内存时的分类类型"""
+        for col in HIERARCHY_COLUMNS:
+            if col in df.columns:
+                df[col] = _as_category(df[col], self.category_dtype(col))
+        return df
+
+    def records(self, **filters):
+        """满足筛选条件的原始记录（按入库日期排序），列类型与读入Excel时相同；用于需要逐条数据的分析"""
+        where, params = self.where_clause(**filters)
+        columns = ', '.join(f'"{col}"' for col in HIERARCHY_COLUMNS + ['入库日期'] + self.traits)
+        with stage('数据库读取记录') as record:
+            df = self._query(f'SELECT {columns} FROM records {where} ORDER BY "入库日期"', params)
+            record['行数'] = len(df)
+        df['入库日期'] = pd.to_datetime(df['入库日期'], format=DATE_FORMAT)
+        for trait in self.traits:
+            df[trait] = df[trait].astype(float)
+        return self.restore_categories(df)
+
+    def group_moments(self, group_cols, period=None, summer_window=None, **filters):
+        """在数据库内分组汇总，返回与 calculate_group_moments / StatsCube.rollup 相同格式的分组统计量
+
+        group_cols 可含层级列、年月（按入库日期的月份）和 季节（需给出 summer_window）；
+        period 给定时增加 时间段 分组列（放在最前）。group_cols 为空且没有 period 时返回一行总计。
+        filters 为 zones、regions、areas、date_range、farms，与 DataProcessor.filter_data 相同
+        """
+        key_cols = (['时间段'] if period else []) + list(group_cols)
+        expressions = [self._key_expression(col, period, summer_window) for col in key_cols]
+        shifts = self.shifts()
+
+        select = [f'{expression} AS "{col}"' for col, expression in zip(key_cols, expressions)]
+        select.append('COUNT(*) AS "数据量"')
+        for trait in self.traits:
+            shifted = f'("{trait}" - {float(shifts.get(trait, 0.0))!r})'
+            select.append(f'COUNT("{trait}") AS "{trait}_n"')
+            select.append(f'SUM({shifted}) AS "{trait}_s1"')
+            select.append(f'SUM({shifted} * {shifted}) AS "{trait}_s2"')
+
+        where, params = self.where_clause(**filters)
+        # 与pandas分组相同，分组键缺失的记录不参与
+        missing = ' AND '.join(f'{expression} IS NOT NULL' for expression in expressions)
+        if missing:
+            where = f'{where} AND {missing}' if where else f'WHERE {missing}'
+        sql = f'SELECT {", ".join(select)} FROM records {where}'
+        if key_cols:
+            sql += f' GROUP BY {", ".join(expressions)}'
+
+        with stage('数据库分组汇总', 分组=','.join(key_cols)) as record:
+            sums = self._query(sql, params)
+            record['行数'] = len(sums)
+        if key_cols and len(sums) == 0:
+            return pd.DataFrame(columns=key_cols + ['数据量'])
+
+        moments = sums[key_cols].copy()
+        if SEASON_COLUMN in moments.columns:
+            moments[SEASON_COLUMN] = pd.Categorical(moments[SEASON_COLUMN], categories=SEASONS)
+        moments['数据量'] = sums['数据量'].to_numpy(dtype=np.int64)
+        for trait in self.traits:
+            count = sums[f'{trait}_n'].to_numpy(dtype=np.int64)
+            s1 = sums[f'{trait}_s1'].to_numpy(dtype=float)
+            s2 = sums[f'{trait}_s2'].to_numpy(dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_shifted = np.where(count > 0, s1 / count, np.nan)
+                m2_raw = np.maximum(s2 - s1 * mean_shifted, 0.0)
+            moments[f'{trait}_n'] = count
+            moments[f'{trait}_均值'] = mean_shifted + float(shifts.get(trait, 0.0))
+            moments[f'{trait}_σ'] = StatisticsCalculator.sigma_from_m2(count, m2_raw)
+
+        # 与 calculate_group_moments 相同，按分组键（层级列按类别顺序，季节按 夏季、冬季）排序
+        moments = self.restore_categories(moments)
+        if key_cols:
+            moments = moments.sort_values(key_cols, kind='stable').reset_index(drop=True)
+        return moments
+
+    def _key_expression(self, col, period, summer_window):
+        if col == '时间段':
+            return PERIOD_EXPRESSIONS[period]
+        if col == '年月':
+            return PERIOD_EXPRESSIONS['按月']
+        if col == SEASON_COLUMN:
+            if summer_window is None:
+                raise ValueError("按季节分组需给出夏季时间段")
+            start, end = (_month_day(value) for value in summer_window)
+            month_day = f'({_MONTH} * 100 + CAST(substr("入库日期", 9, 2) AS INTEGER))'
+            if start <= end:
+                summer = f'{month_day} BETWEEN {start} AND {end}'
+            else:
+                summer = f'({month_day} >= {start} OR {month_day} <= {end})'
+            return f'(CASE WHEN "入库日期" IS NULL THEN NULL WHEN {summer} THEN \'夏季\' ELSE \'冬季\' END)'
+        if col not in HIERARCHY_COLUMNS:
+            raise ValueError(f"数据库中没有分组列: {col}")
+        return f'"{col}"'
+
+
+def _as_category(values, dtype):
+    """按给定的分类类型转换；数字与文字混合的列类别为文字，数字取值同样转为文字"""
+    if not pd.api.types.is_numeric_dtype(dtype.categories):
+        values = values.map(lambda value: value if pd.isna(value) else str(value))
+    return pd.Categorical(values, dtype=dtype)
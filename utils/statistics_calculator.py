@@ -1,43 +1,639 @@
 import pandas as pd
 import numpy as np
 
+from config import BOOTSTRAP_CONFIDENCE, BOOTSTRAP_REPLICATES, BOOTSTRAP_SEED, ROLLING_WINDOW_DAYS
+from .excel_reader import trait_values, is_validated
+from .seasons import (SEASON_COLUMN, SEASONS, add_season, default_window, is_seasonal, resolve_coefficients,
+                      season_coefficients, season_labels)
+
+# bootstrap时每批计算的 分组 × 重抽样次数 上限（控制中间数组的内存）
+BOOTSTRAP_BATCH_CELLS = 5_000_000
+
+# 置信区间列（酸度另有cp的区间）
+INTERVAL_SUFFIXES = ['cpk_下限', 'cpk_上限', 'cp_下限', 'cp_上限']
+
+# CPK状态（按是否异常取下标）
+CPK_STATUS_LABELS = np.array(['正常', '异常'], dtype=object)
+
 class StatisticsCalculator:
     def __init__(self):
         self.traits = ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
         self.display_traits = ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
     
-    def calculate_statistics(self, df, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
-        """计算所有统计指标，包括CPK异常状态"""
+    def calculate_statistics(self, df, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999, engine='vectorized',
+                             summer_window=None, confidence=None, status_bound=None, within_subgroup=False):
+        """计算所有统计指标，包括CPK异常状态
+        
+        engine='vectorized' 一次groupby算出全部分组的统计量；
+        engine='loop' 为逐组计算的参考实现，用于等价性校验。
+        coefficients 按季节给出（{'夏季': {...}, '冬季': {...}}）时，每行按入库日期是否在 summer_window
+        （默认取 config.py 中的夏季时间段）内归入夏季或冬季，分组增加 季节 列，各组使用对应季节的系数。
+        confidence（如0.95）给出时增加各组cpk、cp的bootstrap置信区间列（见 bootstrap_intervals），
+        status_bound='下限'/'上限' 时异常状态按置信区间的下限/上限判定（样本不足无法计算区间的分组仍按点估计）。
+        cpk 用组内全部样本的σ（即Ppk，包含日间波动）；within_subgroup=True 时另加按日子组合并方差的
+        组内σ 及对应的 组内cpk（即Cpk，见 within_subgroup_sigma）
+        """
         # 清理数据
-        numeric_columns = self.traits
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        df = self._numeric_traits(df)
+        if is_seasonal(coefficients):
+            df = add_season(df, summer_window or default_window())
         
-        # 按月份和牧场分组
-        results = []
+        if engine == 'loop':
+            if confidence or within_subgroup:
+                raise ValueError("置信区间和组内σ只支持 vectorized 计算引擎")
+            return self._calculate_statistics_loop(df, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max)
+        if engine != 'vectorized':
+            raise ValueError(f"未知的计算引擎: {engine}")
+        return self._calculate_statistics_vectorized(df, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max,
+                                                     confidence, status_bound, within_subgroup)
+    
+    def _calculate_statistics_vectorized(self, df, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max,
+                                         confidence=None, status_bound=None, within_subgroup=False):
+        """向量化计算：一次分组求出各组count/均值/σ，其余指标按整列运算"""
+        group_cols = self._detail_group_cols(df)
+        # 分组编码只求一次，组内σ、置信区间与分组统计量的行顺序相同，按位置并列
+        keys, codes = self._group_codes(df, group_cols)
+        moments = self._moments_from_codes(df, keys, codes)
+        if within_subgroup:
+            within = self._within_from_codes(df, keys, codes)
+            moments = pd.concat([moments, within.drop(columns=group_cols)], axis=1)
+        if confidence:
+            intervals = self._intervals_from_codes(df, keys, codes, coefficients, confidence)
+            moments = pd.concat([moments, intervals.drop(columns=group_cols)], axis=1)
+        return self.statistics_from_moments(moments, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max,
+                                            status_bound)
+    
+    def statistics_from_moments(self, moments, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999,
+                                status_bound=None):
+        """由分组统计量生成与 calculate_statistics 相同格式的详细结果
+        
+        moments 需含 奶源地名称、区域、地区 列，时间取 年月 或 时间段 列（都没有时为'全部'）；
+        含 {性状}_组内σ 列时增加 组内σ、组内cpk，含 {性状}_cpk_下限 等置信区间列时一并输出，
+        status_bound 见 calculate_statistics
+        """
+        if len(moments) == 0:
+            return pd.DataFrame()
+        
+        results = {}
+        period_col = next((col for col in ('年月', '时间段') if col in moments.columns), None)
+        if period_col:
+            results['时间'] = moments[period_col].map(str).to_numpy(dtype=object)
+        else:
+            results['时间'] = np.full(len(moments), '全部', dtype=object)
+        if SEASON_COLUMN in moments.columns:
+            results[SEASON_COLUMN] = moments[SEASON_COLUMN].to_numpy(dtype=object)
+        results['区域'] = moments['区域'].to_numpy(dtype=object)
+        results['地区'] = moments['地区'].to_numpy(dtype=object)
+        results['奶源地'] = moments['奶源地名称'].to_numpy(dtype=object)
+        coefficients = self._group_coefficients(moments, coefficients)
+        
+        for trait, display_trait in zip(self.traits, self.display_traits):
+            if f'{trait}_n' not in moments.columns:
+                continue
+            
+            columns = self._capability_columns(
+                trait,
+                moments[f'{trait}_n'].to_numpy(),
+                moments[f'{trait}_均值'].to_numpy(dtype=float),
+                moments[f'{trait}_σ'].to_numpy(dtype=float),
+                coefficients,
+                cpk_threshold_type, cpk_threshold, cpk_min, cpk_max
+            )
+            if f'{trait}_组内σ' in moments.columns:
+                columns = self._with_within(trait, moments, columns, coefficients)
+            if f'{trait}_cpk_下限' in moments.columns:
+                columns = self._with_intervals(trait, moments, columns, status_bound,
+                                               cpk_threshold_type, cpk_threshold, cpk_min, cpk_max)
+            for suffix, values in columns.items():
+                results[f'{display_trait}_{suffix}'] = values
+        
+        # 混合了'/'与数值的列按逐行构造DataFrame时的规则推断类型
+        results_df = pd.DataFrame(results).infer_objects()
+        
+        # 排序
+        results_df = results_df.sort_values(['时间', '区域', '奶源地'])
+        
+        return results_df
+    
+    def calculate_group_moments(self, df, group_cols, m2=False):
+        """一次分组求出每组的数据量及各性状的样本数、均值和σ（ddof=1），格式与 StatsCube.rollup 相同
+        
+        m2=True 时以离差平方和 {性状}_M2 代替σ，供分块计算时合并
+        """
+        keys, codes = self._group_codes(df, group_cols)
+        return self._moments_from_codes(df, keys, codes, m2)
+    
+    @staticmethod
+    def _group_codes(df, group_cols):
+        """一次分组得到各组的分组键和数据量（DataFrame）以及每行的分组编码（分组列缺失的行编码为-1）"""
+        grouped = df.groupby(group_cols, observed=True, sort=True)
+        sizes = grouped.size()
+        keys = sizes.index.to_frame(index=False)
+        keys['数据量'] = sizes.to_numpy()
+        return keys, grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    
+    def _moments_from_codes(self, df, keys, codes, m2=False):
+        moments = keys.copy()
+        if len(moments) == 0:
+            return moments
+        
+        # 按编码稳定排序后同组数据连续存放且保持原始顺序
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        
+        for trait in self.traits:
+            if trait not in df.columns:
+                continue
+            
+            sorted_values = trait_values(df[trait])[order]
+            count, mean_raw, m2_raw = self._segment_sums(sorted_values, sorted_codes, len(moments))
+            moments[f'{trait}_n'] = count
+            moments[f'{trait}_均值'] = mean_raw
+            if m2:
+                moments[f'{trait}_M2'] = m2_raw
+            else:
+                moments[f'{trait}_σ'] = self.sigma_from_m2(count, m2_raw)
+        
+        return moments
+    
+    def screen_cpk_anomalies(self, moments, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
+        """批量CPK异常筛选：一次得到所有分组各性状的CPK数值和状态
+        
+        moments 可来自 calculate_group_moments(df, 任意分组列) 或 StatsCube.rollup，
+        返回分组列、数据量以及 {性状}_CPK（数值）、{性状}_状态 列
+        """
+        capability = self.capability_from_moments(
+            moments, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max
+        )
+        
+        key_columns = [col for col in moments.columns if not col.startswith(tuple(f'{trait}_' for trait in self.traits))]
+        results = capability[key_columns].copy()
+        for col in key_columns:
+            # 时间段统一显示为字符串（如 2024-01、2024Q1、2024）
+            if isinstance(results[col].dtype, pd.PeriodDtype):
+                results[col] = results[col].astype(str)
+        
+        for trait, display_trait in zip(self.traits, self.display_traits):
+            if f'{display_trait}_cpk' in capability.columns:
+                results[f'{display_trait}_CPK'] = capability[f'{display_trait}_cpk'].astype(float)
+                results[f'{display_trait}_状态'] = capability[f'{display_trait}_cpk_状态']
+        
+        return results
+    
+    @staticmethod
+    def abnormal_mask(results):
+        """任一状态列为'异常'的行（整列比较，不逐行apply）"""
+        status_columns = [col for col in results.columns if col.endswith('_状态')]
+        if not status_columns:
+            return pd.Series(False, index=results.index)
+        return results[status_columns].eq('异常').any(axis=1)
+    
+    def capability_from_moments(self, moments, coefficients, cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
+        """由各组的样本数、均值和σ（如 StatsCube.rollup 的结果）推导全部能力指标
+        
+        moments 中每个性状需有 {性状}_n、{性状}_均值、{性状}_σ 三列，其余列作为分组信息原样保留
+        """
+        moment_columns = {f'{trait}_{suffix}' for trait in self.traits for suffix in ('n', '均值', 'σ')}
+        results = {col: moments[col].to_numpy() for col in moments.columns if col not in moment_columns}
+        coefficients = self._group_coefficients(moments, coefficients)
+        
+        for trait, display_trait in zip(self.traits, self.display_traits):
+            if f'{trait}_n' not in moments.columns:
+                continue
+            
+            columns = self._capability_columns(
+                trait,
+                moments[f'{trait}_n'].to_numpy(),
+                moments[f'{trait}_均值'].to_numpy(dtype=float),
+                moments[f'{trait}_σ'].to_numpy(dtype=float),
+                coefficients,
+                cpk_threshold_type, cpk_threshold, cpk_min, cpk_max
+            )
+            for suffix, values in columns.items():
+                results[f'{display_trait}_{suffix}'] = values
+        
+        return pd.DataFrame(results, index=moments.index).infer_objects()
+    
+    def within_subgroup_sigma(self, df, group_cols):
+        """各分组的组内σ：组内数据按入库日期分为日子组，合并各子组的方差 σ = √(Σ子组离差平方和 / Σ(子组样本数-1))
+        
+        不含日间均值的变化，对应Cpk；整体σ（calculate_group_moments 的 σ）对应Ppk。
+        各性状的日子组 n、Σx、Σx² 由 bincount 求出后按分组累加
+        （x 先减去所在分组的均值，避免大数相减）；行顺序与 calculate_group_moments(df, group_cols) 相同，
+        没有样本数≥2的日子组时为空
+        """
+        keys, codes = self._group_codes(df, group_cols)
+        return self._within_from_codes(df, keys, codes)
+    
+    def _within_from_codes(self, df, keys, codes):
+        within = keys.drop(columns='数据量')
+        n_groups = len(within)
+        if n_groups == 0:
+            return within
+        
+        # (分组, 日期) 合成整数键后编码，日子组编码整除 span 即为所属分组
+        day_values = df['入库日期'].to_numpy(dtype='datetime64[D]')
+        rows = (codes >= 0) & ~np.isnat(day_values)
+        if not rows.any():
+            return within
+        group_codes = codes[rows]
+        days = day_values[rows].astype(np.int64)
+        days = days - days.min()
+        span = int(days.max()) + 1
+        day_codes, day_keys = pd.factorize(group_codes * span + days)
+        day_groups = np.asarray(day_keys) // span
+        
+        for trait in self.traits:
+            if trait not in df.columns:
+                continue
+            
+            values = trait_values(df[trait])[rows]
+            valid = ~np.isnan(values)
+            count = np.bincount(group_codes[valid], minlength=n_groups)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                center = np.bincount(group_codes[valid], weights=values[valid], minlength=n_groups) / count
+            shifted = values[valid] - center[group_codes[valid]]
+            
+            day_count = np.bincount(day_codes[valid], minlength=len(day_keys))
+            day_sum = np.bincount(day_codes[valid], weights=shifted, minlength=len(day_keys))
+            day_square_sum = np.bincount(day_codes[valid], weights=shifted ** 2, minlength=len(day_keys))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                day_m2 = np.where(day_count > 1, np.maximum(day_square_sum - day_sum ** 2 / day_count, 0.0), 0.0)
+            
+            dof = np.bincount(day_groups, weights=np.maximum(day_count - 1, 0), minlength=n_groups)
+            m2_raw = np.bincount(day_groups, weights=day_m2, minlength=n_groups)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                within[f'{trait}_组内σ'] = np.where(dof > 0, np.sqrt(m2_raw / dof), np.nan)
+        
+        return within
+    
+    def _with_within(self, trait, moments, columns, coefficients):
+        """在能力指标中加入 组内σ 和 组内cpk（放在cp之后）"""
+        mean_raw = moments[f'{trait}_均值'].to_numpy(dtype=float)
+        sigma_raw = moments[f'{trait}_组内σ'].to_numpy(dtype=float)
+        process_diff_raw, _ = self._process_diff(trait, mean_raw, coefficients)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 与cpk相同，σ为0时记为0；没有可用的日子组时为空
+            cpk_raw = np.where(sigma_raw > 0, process_diff_raw / (3 * sigma_raw), np.where(sigma_raw == 0, 0.0, np.nan))
+        
+        result = {}
+        for suffix, values in columns.items():
+            if suffix == 'cpk_状态':
+                result['组内σ'] = np.round(sigma_raw, 3)
+                result['组内cpk'] = np.round(cpk_raw, 3)
+            result[suffix] = values
+        return result
+    
+    def bootstrap_intervals(self, df, group_cols, coefficients, confidence=BOOTSTRAP_CONFIDENCE,
+                            n_boot=BOOTSTRAP_REPLICATES, seed=BOOTSTRAP_SEED):
+        """各分组cpk、cp的bootstrap百分位置信区间，行顺序与 calculate_group_moments(df, group_cols) 相同
+        
+        样本数相同的分组为一类，每类只抽一次 n_boot × 样本数 的重抽样下标，换算为每个样本被抽中的次数矩阵W，
+        同类所有分组的重抽样均值和平方和由 分组数据 × Wᵀ 的矩阵乘法一次得到，不逐组、逐次循环。
+        返回分组列以及 {性状}_cpk_下限、{性状}_cpk_上限（酸度另有 cp_下限、cp_上限）；样本数少于2的分组为空
+        """
+        keys, codes = self._group_codes(df, group_cols)
+        return self._intervals_from_codes(df, keys, codes, coefficients, confidence, n_boot, seed)
+    
+    def _intervals_from_codes(self, df, keys, codes, coefficients, confidence=BOOTSTRAP_CONFIDENCE,
+                              n_boot=BOOTSTRAP_REPLICATES, seed=BOOTSTRAP_SEED):
+        intervals = keys.drop(columns='数据量')
+        n_groups = len(intervals)
+        if n_groups == 0:
+            return intervals
+        
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        coefficients = self._group_coefficients(intervals, coefficients)
+        rng = np.random.default_rng(seed)
+        alpha = (1 - confidence) / 2
+        
+        for trait in self.traits:
+            if trait not in df.columns:
+                continue
+            
+            sorted_values = trait_values(df[trait])[order]
+            valid = ~np.isnan(sorted_values) & (sorted_codes >= 0)
+            values = sorted_values[valid]
+            count = np.bincount(sorted_codes[valid], minlength=n_groups)
+            starts = np.cumsum(count) - count
+            
+            bounds = {suffix: np.full(n_groups, np.nan) for suffix in INTERVAL_SUFFIXES}
+            for size in np.unique(count[count > 1]):
+                # 每次重抽样中各样本被抽中的次数（n_boot × size）
+                draws = rng.integers(0, size, size=(n_boot, size))
+                weights = np.bincount((np.arange(n_boot)[:, None] * size + draws).ravel(),
+                                      minlength=n_boot * size).reshape(n_boot, size).astype(float)
+                
+                group_idx = np.flatnonzero(count == size)
+                batch = max(1, BOOTSTRAP_BATCH_CELLS // n_boot)
+                for first in range(0, len(group_idx), batch):
+                    idx = group_idx[first:first + batch]
+                    block = values[starts[idx][:, None] + np.arange(size)]
+                    # 减去组均值后再求平方和，避免大数相减
+                    center = block.mean(axis=1)
+                    block = block - center[:, None]
+                    sums = block @ weights.T
+                    square_sums = (block ** 2) @ weights.T
+                    mean_raw = sums / size
+                    # 重抽样取值全部相同时离差平方和只剩舍入误差，按0处理（与直接计算的σ=0一致）
+                    m2_raw = square_sums - sums * mean_raw
+                    m2_raw = np.where(m2_raw > 64 * np.finfo(float).eps * square_sums, m2_raw, 0.0)
+                    sigma_raw = np.sqrt(m2_raw / (size - 1))
+                    mean_raw = mean_raw + center[:, None]
+                    
+                    group_coefficients = {
+                        key: value[idx][:, None] if isinstance(value, np.ndarray) else value
+                        for key, value in coefficients.items()
+                    }
+                    process_diff_raw, tolerance = self._process_diff(trait, mean_raw, group_coefficients)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        # 与点估计相同：σ为0时CPK记为0；cp的σ为0时记为无穷大，区间端点为无穷大时输出为空
+                        cpk_raw = np.where(sigma_raw > 0, process_diff_raw / (3 * sigma_raw), 0.0)
+                        low, high = np.quantile(cpk_raw, [alpha, 1 - alpha], axis=1)
+                        bounds['cpk_下限'][idx] = low
+                        bounds['cpk_上限'][idx] = high
+                        if tolerance:
+                            cp_raw = np.where(sigma_raw > 0, tolerance / (6 * sigma_raw), np.inf)
+                            low, high = np.quantile(cp_raw, [alpha, 1 - alpha], axis=1)
+                            bounds['cp_下限'][idx] = np.where(np.isinf(low), np.nan, low)
+                            bounds['cp_上限'][idx] = np.where(np.isinf(high), np.nan, high)
+            
+            for suffix in INTERVAL_SUFFIXES:
+                if suffix.startswith('cp_') and trait != '酸度':
+                    continue
+                intervals[f'{trait}_{suffix}'] = bounds[suffix]
+        
+        return intervals
+    
+    def _with_intervals(self, trait, moments, columns, status_bound, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max):
+        """在能力指标中加入置信区间列（放在cp之后），按 status_bound 改用区间端点判定异常状态"""
+        result = {}
+        for suffix, values in columns.items():
+            if suffix == 'cpk_状态':
+                for interval_suffix in INTERVAL_SUFFIXES:
+                    if f'{trait}_{interval_suffix}' in moments.columns:
+                        result[interval_suffix] = np.round(moments[f'{trait}_{interval_suffix}'].to_numpy(dtype=float), 3)
+            result[suffix] = values
+        
+        if status_bound:
+            if status_bound not in ('下限', '上限'):
+                raise ValueError(f"未知的判定依据: {status_bound}")
+            bound = moments[f'{trait}_cpk_{status_bound}'].to_numpy(dtype=float)
+            status = self._cpk_status(bound, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max)
+            result['cpk_状态'] = np.where(np.isnan(bound), result['cpk_状态'], status).astype(object)
+        return result
+    
+    def rolling_capability(self, df, coefficients, window_days=ROLLING_WINDOW_DAYS, min_periods=2, summer_window=None):
+        """各牧场的滚动窗口CPK时间序列
+        
+        每个牧场在每个有数据的入库日期输出一行，窗口为截至当天（含）的 window_days 个自然日内的全部样本。
+        全部数据按 (牧场, 日期) 排序一次，各牧场分别对各性状的样本数、Σx、Σx² 做前缀和，
+        窗口统计量为两端前缀和之差，排序后的计算量与行数成正比，与窗口长度无关。
+        窗口内样本数少于 min_periods 时该性状的指标为空。
+        返回 奶源地名称、日期、数据量 以及 {性状}_n、{性状}_均值、{性状}_σ、{性状}_cpk 列；
+        coefficients 按季节给出时，各行按当天所属季节取系数
+        """
+        df = self._numeric_traits(df)
+        df = df[df['入库日期'].notna() & df['奶源地名称'].notna()]
+        if len(df) == 0:
+            return pd.DataFrame(columns=['奶源地名称', '日期', '数据量'])
         
-        # 获取所有唯一的年月和奶源地组合
+        # 按 (牧场, 日期) 排序；两者合成一个整数键，窗口起点可直接二分查找
+        farm_codes, farm_names = pd.factorize(df['奶源地名称'], sort=True)
+        day_values = df['入库日期'].to_numpy(dtype='datetime64[D]')
+        days = day_values.astype(np.int64)
+        days = days - days.min()
+        span = int(days.max()) + window_days + 1
+        keys = farm_codes.astype(np.int64) * span + days
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        farm_sorted = farm_codes[order]
+        
+        # 每个 (牧场, 日期) 取当天最后一行为窗口终点，窗口从 window_days-1 天前的第一行开始
+        ends = np.flatnonzero(np.append(keys[1:] != keys[:-1], True)) + 1
+        starts = np.searchsorted(keys, keys[ends - 1] - (window_days - 1), side='left')
+        
+        farm_starts = np.searchsorted(keys, keys[ends - 1] - days[order][ends - 1], side='left')
+        dates = pd.to_datetime(day_values[order][ends - 1])
+        end_farms = farm_sorted[ends - 1]
+        results = {
+            '奶源地名称': farm_names[end_farms],
+            '日期': dates,
+            '数据量': ends - starts
+        }
+        if is_seasonal(coefficients):
+            coefficients = resolve_coefficients(coefficients, season_labels(dates, summer_window or default_window()))
+        
+        for trait in self.traits:
+            if trait not in df.columns:
+                continue
+            
+            values = trait_values(df[trait])[order]
+            valid = ~np.isnan(values)
+            # 减去各牧场均值后再求平方和，避免 Σx² - (Σx)²/n 的大数相减
+            farm_count = np.bincount(farm_sorted[valid], minlength=len(farm_names))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                farm_mean = np.bincount(farm_sorted[valid], weights=values[valid], minlength=len(farm_names)) / farm_count
+            farm_mean = np.nan_to_num(farm_mean)
+            shifted = np.where(valid, values - farm_mean[farm_sorted], 0.0)
+            
+            count = self._window_sums(valid.astype(np.int64), farm_sorted, starts, ends, farm_starts)
+            window_sum = self._window_sums(shifted, farm_sorted, starts, ends, farm_starts)
+            window_square_sum, square_prefix = self._window_sums(shifted ** 2, farm_sorted, starts, ends, farm_starts,
+                                                                 return_prefix=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                window_mean = window_sum / count
+                m2_raw = window_square_sum - window_sum * window_mean
+            # 前缀和相减的舍入误差与牧场累计平方和成正比，低于此量级的离差平方和视为0（窗口内取值全部相同）
+            m2_raw = np.where(m2_raw > 64 * np.finfo(float).eps * square_prefix, m2_raw, 0.0)
+            mean_raw = window_mean + farm_mean[end_farms]
+            sigma_raw = self.sigma_from_m2(count, m2_raw)
+            
+            # 样本不足的窗口按没有数据处理
+            enough = np.where(count >= max(min_periods, 1), count, 0)
+            columns = self._capability_columns(trait, enough, mean_raw, sigma_raw, coefficients)
+            results[f'{trait}_n'] = count
+            results[f'{trait}_均值'] = np.where(enough > 0, mean_raw, np.nan)
+            results[f'{trait}_σ'] = np.where(enough > 0, sigma_raw, np.nan)
+            results[f'{trait}_cpk'] = columns['cpk'].astype(float)
+        
+        return pd.DataFrame(results)
+    
+    @staticmethod
+    def _window_sums(values, farm_sorted, starts, ends, farm_starts, return_prefix=False):
+        """按牧场分别累加的前缀和求窗口 [starts, ends) 内的和（前缀和在每个牧场起点重新开始，误差不跨牧场累积）"""
+        prefix = pd.Series(values).groupby(farm_sorted, sort=False).cumsum().to_numpy()
+        total = prefix[ends - 1]
+        sums = total - np.where(starts > farm_starts, prefix[np.maximum(starts - 1, 0)], 0)
+        if return_prefix:
+            return sums, total
+        return sums
+    
+    def _detail_group_cols(self, df):
+        """详细分析的分组列：月份 × 牧场（没有年月列时只按牧场），按季节计算时在月份后加 季节"""
         if '年月' in df.columns and '奶源地名称' in df.columns:
-            groups = df.groupby(['年月', '奶源地名称', '区域', '地区'])
+            group_cols = ['年月', '奶源地名称', '区域', '地区']
         else:
-            # 如果没有年月列，则只按奶源地分组
-            groups = df.groupby(['奶源地名称', '区域', '地区'])
+            group_cols = ['奶源地名称', '区域', '地区']
+        if SEASON_COLUMN in df.columns:
+            group_cols.insert(1 if group_cols[0] == '年月' else 0, SEASON_COLUMN)
+        return group_cols
+    
+    def _group_coefficients(self, moments, coefficients):
+        """按季节给出的系数按各分组的 季节 列展开"""
+        if not is_seasonal(coefficients):
+            return coefficients
+        if SEASON_COLUMN not in moments.columns:
+            raise ValueError("按季节给出系数时，分组统计量需包含季节列")
+        return resolve_coefficients(coefficients, moments[SEASON_COLUMN].to_numpy(dtype=object))
+    
+    def _numeric_traits(self, df):
+        """性状列统一为float64，返回新的DataFrame，不修改传入的数据（数据集由各会话共享）
         
-        for group_keys, group_data in groups:
-            if len(group_keys) == 4:
-                period, farm, region, area = group_keys
+        加载流程已统一类型的数据（带 SCHEMA_ATTR 标记）只需还原float32压缩保存的列；
+        其他来源的数据才逐列做数值转换（非数值记为NaN）
+        """
+        if is_validated(df):
+            traits = [col for col in self.traits if col in df.columns and df[col].dtype == np.float32]
+        else:
+            traits = [col for col in self.traits if col in df.columns and df[col].dtype != np.float64]
+        if not traits:
+            return df
+        return df.assign(**{col: trait_values(df[col]) for col in traits})
+    
+    @staticmethod
+    def sigma_from_m2(count, m2_raw):
+        """由样本数和离差平方和得到样本标准差（ddof=1），样本数不足2时为NaN"""
+        count = np.asarray(count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 1, np.sqrt(m2_raw / (count - 1)), np.nan)
+    
+    def _segment_sums(self, sorted_values, sorted_codes, n_groups):
+        """按已排序的分组编码计算各组样本数、均值和离差平方和
+        
+        样本数相同的分组排成矩阵按行求和，与 Series.mean()/Series.std() 的
+        两遍成对求和顺序相同，保证舍入后逐位一致
+        """
+        valid = ~np.isnan(sorted_values) & (sorted_codes >= 0)
+        values = sorted_values[valid]
+        count = np.bincount(sorted_codes[valid], minlength=n_groups)
+        starts = np.cumsum(count) - count
+        
+        mean_raw = np.full(n_groups, np.nan)
+        m2_raw = np.full(n_groups, np.nan)
+        for size in np.unique(count[count > 0]):
+            group_idx = np.flatnonzero(count == size)
+            block = values[starts[group_idx][:, None] + np.arange(size)]
+            block_mean = block.sum(axis=1) / size
+            mean_raw[group_idx] = block_mean
+            m2_raw[group_idx] = ((block_mean[:, None] - block) ** 2).sum(axis=1)
+        
+        return count, mean_raw, m2_raw
+    
+    def _capability_columns(self, trait, count, mean_raw, sigma_raw, coefficients,
+                            cpk_threshold_type=None, cpk_threshold=1.0, cpk_min=-999, cpk_max=999):
+        """由各分组的样本数、均值和σ整列推导过程值差值、6σ、3σ、cpk、cp及异常状态"""
+        process_diff_raw, tolerance = self._process_diff(trait, mean_raw, coefficients)
+        
+        six_sigma_raw = sigma_raw * 6
+        three_sigma_raw = sigma_raw * 3
+        
+        cpk_raw = self._cpk(process_diff_raw, three_sigma_raw)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valid_six = six_sigma_raw > 0
+            if tolerance:
+                cp_raw = np.where(valid_six, tolerance / np.where(valid_six, six_sigma_raw, 1), np.nan)
             else:
-                farm, region, area = group_keys
-                period = '全部'
+                cp_raw = np.full(len(count), np.nan)
+        
+        empty = np.asarray(count) == 0
+        
+        tolerance_col = np.full(len(count), round(tolerance, 3) if tolerance else '/', dtype=object)
+        cp_col = np.where(np.isnan(cp_raw) | (cp_raw == 0), '/', np.round(cp_raw, 3).astype(object)).astype(object)
+        
+        # 添加CPK异常状态判断
+        status = self._cpk_status(cpk_raw, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max)
+        
+        columns = {
+            'σ': np.round(sigma_raw, 3),
+            '均值': np.round(mean_raw, 3),
+            '过程值差值': np.round(process_diff_raw, 3),
+            '6σ': np.round(six_sigma_raw, 3),
+            '3σ': np.round(three_sigma_raw, 3),
+            'cpk': np.round(cpk_raw, 3),
+            '公差': tolerance_col,
+            'cp': cp_col,
+            'cpk_状态': status
+        }
+        
+        # 没有数据时填充空值
+        if empty.any():
+            for suffix, values in columns.items():
+                if suffix == 'cpk_状态':
+                    values[empty] = '-'
+                else:
+                    values[empty] = np.nan
+        
+        return columns
+    
+    def _process_diff(self, trait, mean_raw, coefficients):
+        """过程值差值（整列计算）及公差（只有酸度有公差）"""
+        if trait == '酸度':
+            # 酸度特殊处理
+            acid_min = coefficients.get('酸度_min', 12)
+            acid_max = coefficients.get('酸度_max', 17.5)
+            process_diff_raw = np.minimum(mean_raw - acid_min, acid_max - mean_raw)
+            tolerance = coefficients.get('酸度_tolerance', 5.5)
+        else:
+            coef = coefficients.get(trait, 0)
+            process_diff_raw = np.abs(mean_raw - coef)
+            tolerance = None
+        return process_diff_raw, tolerance
+    
+    @staticmethod
+    def _cpk(process_diff_raw, three_sigma_raw):
+        """整列计算CPK（可广播）"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # σ为0或无法计算时CPK记为0
+            valid_three = three_sigma_raw > 0
+            return np.where(valid_three, process_diff_raw / np.where(valid_three, three_sigma_raw, 1), 0.0)
+    
+    @staticmethod
+    def _cpk_status(cpk_raw, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max):
+        """按判定方式整列判断CPK异常状态"""
+        if cpk_threshold_type == "小于阈值为异常":
+            abnormal = cpk_raw < cpk_threshold
+        elif cpk_threshold_type == "自定义范围":
+            abnormal = (cpk_raw < cpk_min) | (cpk_raw > cpk_max)
+        else:
+            return np.full(len(cpk_raw), '-', dtype=object)
+        # 按下标取标签得到对象数组（比先生成字符串数组再转换快，系数假设分析中数组很大）
+        return CPK_STATUS_LABELS[abnormal.astype(np.intp)]
+    
+    def _calculate_statistics_loop(self, df, coefficients, cpk_threshold_type, cpk_threshold, cpk_min, cpk_max):
+        """逐组计算的参考实现"""
+        # 按月份和牧场分组
+        results = []
+        
+        # 获取所有唯一的年月和奶源地组合（没有年月列时只按奶源地分组）
+        group_cols = self._detail_group_cols(df)
+        groups = df.groupby(group_cols, observed=True)
+        
+        for group_keys, group_data in groups:
+            keys = dict(zip(group_cols, group_keys))
             
             # 计算每个性状的统计指标
-            row_data = {
-                '时间': str(period),
-                '区域': region,
-                '地区': area,
-                '奶源地': farm
-            }
+            row_data = {'时间': str(keys.get('年月', '全部'))}
+            if SEASON_COLUMN in keys:
+                row_data[SEASON_COLUMN] = keys[SEASON_COLUMN]
+            row_data.update({
+                '区域': keys['区域'],
+                '地区': keys['地区'],
+                '奶源地': keys['奶源地名称']
+            })
+            group_coefficients = season_coefficients(coefficients, keys[SEASON_COLUMN]) if SEASON_COLUMN in keys else coefficients
             
             for trait, display_trait in zip(self.traits, self.display_traits):
                 if trait in group_data.columns:
@@ -53,12 +649,12 @@ class StatisticsCalculator:
                         # 获取系数
                         if trait == '酸度':
                             # 酸度特殊处理
-                            acid_min = coefficients.get('酸度_min', 12)
-                            acid_max = coefficients.get('酸度_max', 17.5)
+                            acid_min = group_coefficients.get('酸度_min', 12)
+                            acid_max = group_coefficients.get('酸度_max', 17.5)
                             process_diff_raw = min(mean_raw - acid_min, acid_max - mean_raw)
-                            tolerance = coefficients.get('酸度_tolerance', 5.5)
+                            tolerance = group_coefficients.get('酸度_tolerance', 5.5)
                         else:
-                            coef = coefficients.get(trait, 0)
+                            coef = group_coefficients.get(trait, 0)
                             process_diff_raw = abs(mean_raw - coef)
                             tolerance = None
                         
@@ -111,13 +707,27 @@ class StatisticsCalculator:
         
         return results_df
     
-    def calculate_summary_table(self, df, coefficients):
-        """计算汇总表格（横向展示）"""
+    def calculate_summary_table(self, df, coefficients, summer_window=None):
+        """计算汇总表格（横向展示）
+        
+        coefficients 按季节给出时夏季、冬季的数据分别汇总，结果前加 季节 列
+        """
         # 清理数据
-        numeric_columns = self.traits
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        df = self._numeric_traits(df)
+        
+        if is_seasonal(coefficients):
+            df = add_season(df, summer_window or default_window())
+            tables = []
+            for season in SEASONS:
+                season_df = df[df[SEASON_COLUMN] == season]
+                if len(season_df) == 0:
+                    continue
+                table = self.calculate_summary_table(season_df, season_coefficients(coefficients, season))
+                table.insert(0, SEASON_COLUMN, season)
+                tables.append(table)
+            if not tables:
+                return self.calculate_summary_table(df, season_coefficients(coefficients, '夏季'))
+            return pd.concat(tables, ignore_index=True)
         
         # 准备结果表格
         result_data = {
@@ -130,50 +740,10 @@ class StatisticsCalculator:
                 
                 if len(trait_data) > 0:
                     # 使用原始数据计算，避免累积舍入误差
-                    # 计算基本统计量（不提前舍入）
                     # 使用ddof=1计算样本标准差（与Excel的STDEV.S相同）
-                    sigma_raw = trait_data.std(ddof=1)
-                    mean_raw = trait_data.mean()
-                    
-                    # 获取系数
-                    if trait == '酸度':
-                        # 酸度特殊处理
-                        acid_min = coefficients.get('酸度_min', 12)
-                        acid_max = coefficients.get('酸度_max', 17.5)
-                        process_diff_raw = min(mean_raw - acid_min, acid_max - mean_raw)
-                        tolerance = coefficients.get('酸度_tolerance', 5.5)
-                    else:
-                        coef = coefficients.get(trait, 0)
-                        process_diff_raw = abs(mean_raw - coef)
-                        tolerance = None
-                    
-                    # 使用原始值计算其他指标
-                    six_sigma_raw = sigma_raw * 6
-                    three_sigma_raw = sigma_raw * 3
-                    
-                    # 计算CPK（使用原始值）
-                    if three_sigma_raw > 0:
-                        cpk_raw = process_diff_raw / three_sigma_raw
-                    else:
-                        cpk_raw = 0
-                    
-                    # 计算CP（使用原始值）
-                    if tolerance and six_sigma_raw > 0:
-                        cp_raw = tolerance / six_sigma_raw
-                    else:
-                        cp_raw = None
-                    
-                    # 最后统一舍入显示
-                    result_data[display_trait] = [
-                        f"{sigma_raw:.3f}",
-                        f"{mean_raw:.3f}",
-                        f"{process_diff_raw:.3f}",
-                        f"{six_sigma_raw:.3f}",
-                        f"{three_sigma_raw:.3f}",
-                        f"{cpk_raw:.3f}",
-                        f"{tolerance:.1f}" if tolerance else "/",
-                        f"{cp_raw:.3f}" if cp_raw else "/"
-                    ]
+                    result_data[display_trait] = self._summary_column(
+                        trait, trait_data.std(ddof=1), trait_data.mean(), coefficients
+                    )
                 else:
                     result_data[display_trait] = ['-'] * 8
             else:
@@ -181,4 +751,63 @@ class StatisticsCalculator:
         
         # 转换为DataFrame
         summary_df = pd.DataFrame(result_data)
-        return summary_df
\ No newline at end of file
+        return summary_df
+    
+    def summary_from_moments(self, total, coefficients):
+        """由全部数据的样本数、均值和σ（如分块计算合并后的结果）生成与 calculate_summary_table 相同的汇总表
+        
+        total 为含 {性状}_n、{性状}_均值、{性状}_σ 的字典或Series
+        """
+        result_data = {
+            '能力分析': ['σ（标准差）', 'X（平均值）', '过程值差值', '6σ', '3σ', 'cpk', '公差', 'cp']
+        }
+        for trait, display_trait in zip(self.traits, self.display_traits):
+            if f'{trait}_n' in total and total[f'{trait}_n'] > 0:
+                result_data[display_trait] = self._summary_column(
+                    trait, float(total[f'{trait}_σ']), float(total[f'{trait}_均值']), coefficients
+                )
+            else:
+                result_data[display_trait] = ['-'] * 8
+        return pd.DataFrame(result_data)
+    
+    def _summary_column(self, trait, sigma_raw, mean_raw, coefficients):
+        """汇总表中一个性状的一列（各指标格式化为字符串）"""
+        # 获取系数
+        if trait == '酸度':
+            # 酸度特殊处理
+            acid_min = coefficients.get('酸度_min', 12)
+            acid_max = coefficients.get('酸度_max', 17.5)
+            process_diff_raw = min(mean_raw - acid_min, acid_max - mean_raw)
+            tolerance = coefficients.get('酸度_tolerance', 5.5)
+        else:
+            coef = coefficients.get(trait, 0)
+            process_diff_raw = abs(mean_raw - coef)
+            tolerance = None
+        
+        # 使用原始值计算其他指标
+        six_sigma_raw = sigma_raw * 6
+        three_sigma_raw = sigma_raw * 3
+        
+        # 计算CPK（使用原始值）
+        if three_sigma_raw > 0:
+            cpk_raw = process_diff_raw / three_sigma_raw
+        else:
+            cpk_raw = 0
+        
+        # 计算CP（使用原始值）
+        if tolerance and six_sigma_raw > 0:
+            cp_raw = tolerance / six_sigma_raw
+        else:
+            cp_raw = None
+        
+        # 最后统一舍入显示
+        return [
+            f"{sigma_raw:.3f}",
+            f"{mean_raw:.3f}",
+            f"{process_diff_raw:.3f}",
+            f"{six_sigma_raw:.3f}",
+            f"{three_sigma_raw:.3f}",
+            f"{cpk_raw:.3f}",
+            f"{tolerance:.1f}" if tolerance else "/",
+            f"{cp_raw:.3f}" if cp_raw else "/"
+        ]
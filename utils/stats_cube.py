@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+from .excel_reader import trait_values
+from .seasons import SEASON_COLUMN, season_labels
+
+
+class StatsCube:
+    """日 × 牧场 粒度的充分统计量立方体
+
+    每个单元格保存各性状的样本数 n、Σx、Σx²（x 先减去该性状的全局均值，避免大数相减损失精度），
+    任意 时间粒度 × 分析维度 的汇总只需对单元格求和，再推导均值和σ，不再扫描原始数据
+    """
+
+    traits = ['脂肪', '蛋白', '干物质', '酸度', '体细胞']
+    dimension_columns = ['大区', '区域', '地区', '奶源地编码', '奶源地名称']
+    period_freqs = {'按月': 'M', '按季度': 'Q', '按年': 'Y'}
+
+    def __init__(self, cells, shifts):
+        self.cells = cells
+        self.shifts = shifts
+
+    @classmethod
+    def from_frame(cls, df):
+        """由原始数据构建立方体（加载数据后执行一次）"""
+        dims = [col for col in cls.dimension_columns if col in df.columns]
+        frame = pd.DataFrame({col: df[col] for col in dims})
+        if '入库日期' in df.columns:
+            frame['日期'] = df['入库日期'].dt.normalize()
+        else:
+            frame['日期'] = pd.NaT
+        frame['数据量'] = 1
+
+        shifts = {}
+        for trait in cls.traits:
+            if trait not in df.columns:
+                continue
+            values = trait_values(df[trait])
+            valid = ~np.isnan(values)
+            shift = float(values[valid].mean()) if valid.any() else 0.0
+            deviation = np.where(valid, values - shift, 0.0)
+
+            frame[f'{trait}_n'] = valid.astype(np.int64)
+            frame[f'{trait}_s1'] = deviation
+            frame[f'{trait}_s2'] = deviation ** 2
+            shifts[trait] = shift
+
+        # 维度为空的行也保留，汇总时只按所选维度剔除缺失值（与直接groupby原始数据一致）
+        cells = frame.groupby(dims + ['日期'], observed=True, dropna=False, sort=False).sum().reset_index()
+        return cls(cells, shifts)
+
+    def filter(self, zones=None, regions=None, areas=None, date_range=None, farms=None):
+        """按与 DataProcessor.filter_data 相同的条件筛选单元格，返回新的立方体"""
+        cells = self.cells
+        mask = np.ones(len(cells), dtype=bool)
+
+        for col, selected in (('大区', zones), ('区域', regions), ('地区', areas), ('奶源地名称', farms)):
+            if selected and len(selected) > 0:
+                mask &= cells[col].isin(selected).to_numpy()
+
+        # 单元格按天划分，按天比较即可包含所选日期当天
+        if date_range and len(date_range) == 2:
+            start_date, end_date = date_range
+            days = cells['日期']
+            mask &= ((days >= pd.Timestamp(start_date).normalize()) &
+                     (days <= pd.Timestamp(end_date).normalize())).to_numpy()
+
+        if mask.all():
+            return self
+        return StatsCube(cells[mask], self.shifts)
+
+    def rollup(self, period='按月', group_cols=('区域',), summer_window=None):
+        """按时间粒度和维度汇总，返回每组的数据量及各性状的样本数、均值和σ（ddof=1）
+
+        给出 summer_window 时按单元格日期区分夏季/冬季，在时间段后增加 季节 分组列
+        """
+        cells = self.cells
+        group_cols = list(group_cols)
+
+        keys = [cells['日期'].dt.to_period(self.period_freqs[period]).rename('时间段')]
+        if summer_window is not None:
+            keys.append(pd.Series(season_labels(cells['日期'], summer_window), index=cells.index, name=SEASON_COLUMN))
+        keys += [cells[col] for col in group_cols]
+
+        value_cols = ['数据量'] + [f'{trait}_{suffix}' for trait in self.shifts for suffix in ('n', 's1', 's2')]
+        sums = cells[value_cols].groupby(keys, observed=True, sort=True).sum()
+
+        moments = pd.DataFrame(index=sums.index)
+        moments['数据量'] = sums['数据量'].to_numpy()
+        for trait, shift in self.shifts.items():
+            n = sums[f'{trait}_n'].to_numpy(dtype=float)
+            s1 = sums[f'{trait}_s1'].to_numpy()
+            s2 = sums[f'{trait}_s2'].to_numpy()
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = np.where(n > 0, shift + s1 / n, np.nan)
+                variance = np.where(n > 1, (s2 - s1 * s1 / n) / (n - 1), np.nan)
+
+            moments[f'{trait}_n'] = n.astype(np.int64)
+            moments[f'{trait}_均值'] = mean
+            moments[f'{trait}_σ'] = np.sqrt(np.maximum(variance, 0.0))
+
+        moments = moments.reset_index()
+        moments['时间段'] = moments['时间段'].astype(str)
+        return moments
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from config import STREAM_CHUNK_ROWS
+from .excel_reader import finalize_columns, iter_excel_chunks, list_data_sheets
+from .metrics import stage
+from .seasons import SEASON_COLUMN, add_season, default_window, is_seasonal
+from .statistics_calculator import StatisticsCalculator
+from .stats_cube import StatsCube
+
+# 与 calculate_statistics 相同的分组
+DETAIL_KEYS = ['年月', '奶源地名称', '区域', '地区']
+
+# 不分组（整体汇总）时使用的常量分组列
+TOTAL_KEY = '合计'
+
+
+class MomentAccumulator:
+    """可合并的分组统计量：每组保存数据量及各性状的样本数、均值和离差平方和（M2）
+
+    数据按块送入 update()，块内用 calculate_group_moments 求出各组的 n/均值/M2，
+    再与已有结果按 Chan 等人的合并公式累加（δ为两部分均值之差）：
+        n = na + nb，均值 = 均值a + δ·nb/n，M2 = M2a + M2b + δ²·na·nb/n
+    不做大数相减，数值稳定；内存占用只与分组数有关，与行数无关。
+    period 给定（如'按月'）时按入库日期增加 时间段 分组列，结果格式与 StatsCube.rollup 相同；
+    group_cols 为空时汇总全部数据。
+    """
+
+    def __init__(self, group_cols, period=None, calculator=None):
+        self.group_cols = list(group_cols)
+        self.period = period
+        self.calculator = calculator or StatisticsCalculator()
+        self.key_cols = (['时间段'] if period else []) + (self.group_cols or [TOTAL_KEY])
+        self.state = None
+        self.categories = {}
+        self.rows = 0
+
+    def update(self, chunk):
+        """累加一块数据"""
+        self.rows += len(chunk)
+        if self.period:
+            chunk = chunk.assign(时间段=chunk['入库日期'].dt.to_period(StatsCube.period_freqs[self.period]))
+        if not self.group_cols:
+            chunk = chunk.assign(**{TOTAL_KEY: '全部'})
+
+        part = self.calculator.calculate_group_moments(chunk, self.key_cols, m2=True)
+        if len(part) == 0:
+            return self
+
+        # 各块的分类类别不同，分组键统一为普通值后再对齐，类别另外记录，输出时还原为分类列
+        for col in self.key_cols:
+            if isinstance(part[col].dtype, pd.CategoricalDtype):
+                self.categories[col] = _merge_categories(self.categories.get(col, []), part[col].cat.categories)
+                part[col] = part[col].astype(object)
+        self._merge_state(part.set_index(self.key_cols))
+        return self
+
+    def merge(self, other):
+        """并入另一个累加器（如另一批文件的结果）"""
+        if other.state is not None:
+            for col, categories in other.categories.items():
+                self.categories[col] = _merge_categories(self.categories.get(col, []), categories)
+            self._merge_state(other.state)
+        self.rows += other.rows
+        return self
+
+    def moments(self):
+        """各组的数据量及各性状的样本数、均值和σ（ddof=1），格式与 calculate_group_moments 相同"""
+        if self.state is None:
+            return pd.DataFrame(columns=self.key_cols + ['数据量'])
+
+        state = self.state.reset_index()
+        for col, categories in self.categories.items():
+            state[col] = pd.Categorical(state[col], categories=categories)
+        # 与 calculate_group_moments 相同，按分组键（分类列按类别顺序）排序
+        state = state.sort_values(self.key_cols, kind='stable').reset_index(drop=True)
+        moments = state[self.key_cols + ['数据量']].copy()
+        for trait in self._traits(self.state):
+            count = state[f'{trait}_n'].to_numpy()
+            moments[f'{trait}_n'] = count
+            moments[f'{trait}_均值'] = state[f'{trait}_均值'].to_numpy()
+            moments[f'{trait}_σ'] = self.calculator.sigma_from_m2(count, state[f'{trait}_M2'].to_numpy())
+
+        if self.period:
+            moments['时间段'] = moments['时间段'].astype(str)
+        if not self.group_cols:
+            moments = moments.drop(columns=TOTAL_KEY)
+        return moments
+
+    def _traits(self, frame):
+        return [trait for trait in self.calculator.traits if f'{trait}_n' in frame.columns]
+
+    def _merge_state(self, part):
+        if self.state is None:
+            self.state = part
+            return
+
+        index = self.state.index.union(part.index)
+        left = self.state.reindex(index)
+        right = part.reindex(index)
+
+        merged = pd.DataFrame(index=index)
+        merged['数据量'] = left['数据量'].fillna(0).to_numpy(np.int64) + right['数据量'].fillna(0).to_numpy(np.int64)
+
+        for trait in dict.fromkeys(self._traits(left) + self._traits(right)):
+            n_a, mean_a, m2_a = _trait_sums(left, trait)
+            n_b, mean_b, m2_b = _trait_sums(right, trait)
+            n = n_a + n_b
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = mean_b - mean_a
+                # 一侧没有样本时直接取另一侧，保证只出现在一块中的分组与整体计算逐位一致
+                mean = np.where(n_b == 0, mean_a, np.where(n_a == 0, mean_b, mean_a + delta * (n_b / n)))
+                m2 = np.where(n_b == 0, m2_a, np.where(n_a == 0, m2_b, m2_a + m2_b + delta ** 2 * (n_a * n_b / n)))
+
+            merged[f'{trait}_n'] = n
+            merged[f'{trait}_均值'] = mean
+            merged[f'{trait}_M2'] = m2
+
+        self.state = merged
+
+
+def _merge_categories(existing, new):
+    """合并分类列的类别：各块的类别都已排序时结果也排序，否则保持出现顺序（如 夏季、冬季）"""
+    existing, new = list(existing), list(new)
+    merged = existing + [value for value in new if value not in set(existing)]
+    if existing == sorted(existing) and new == sorted(new):
+        return sorted(merged)
+    return merged
+
+
+def _trait_sums(frame, trait):
+    """取出一个性状的 (样本数, 均值, M2)，缺少该性状或分组时样本数为0"""
+    if f'{trait}_n' not in frame.columns:
+        empty = np.full(len(frame), np.nan)
+        return np.zeros(len(frame), dtype=np.int64), empty, empty
+    return (frame[f'{trait}_n'].fillna(0).to_numpy(np.int64),
+            frame[f'{trait}_均值'].to_numpy(dtype=float),
+            frame[f'{trait}_M2'].to_numpy(dtype=float))
+
+
+def iter_chunks(sources, chunk_rows=None):
+    """依次产生各数据源的数据块：Excel读取全部数据工作表，Parquet（如本地累积数据集）按批读取"""
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    for source in sources:
+        if str(source).endswith('.parquet'):
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+                yield finalize_columns(batch.to_pandas())
+            continue
+
+        for sheet_name in list_data_sheets(source):
+            yield from iter_excel_chunks(source, chunk_rows, sheet_name=sheet_name)
+
+
+def accumulate(sources, accumulators, chunk_rows=None, chunk_filter=None, progress_callback=None):
+    """分块读取数据源并更新所有累加器；chunk_filter(块) 返回筛选后的块，progress_callback(已读行数) 报告进度"""
+    rows_read = 0
+    for chunk in iter_chunks(sources, chunk_rows):
+        rows_read += len(chunk)
+        if chunk_filter is not None:
+            chunk = chunk_filter(chunk)
+        with stage('分块统计', rows=len(chunk)):
+            for accumulator in accumulators:
+                accumulator.update(chunk)
+        if progress_callback:
+            progress_callback(rows_read)
+    return accumulators
+
+
+def seasonal_chunks(coefficients, summer_window=None, chunk_filter=None):
+    """系数按季节给出时返回 ([季节列], 先筛选再加上季节列的 chunk_filter)，否则原样返回 ([], chunk_filter)"""
+    if not is_seasonal(coefficients):
+        return [], chunk_filter
+    summer_window = summer_window or default_window()
+
+    def prepare(chunk):
+        if chunk_filter is not None:
+            chunk = chunk_filter(chunk)
+        return add_season(chunk, summer_window)
+
+    return [SEASON_COLUMN], prepare
+
+
+def streaming_statistics(sources, coefficients, chunk_rows=None, chunk_filter=None, calculator=None,
+                         summer_window=None, **threshold_args):
+    """分块计算详细分析结果，与对全部数据调用 calculate_statistics 的结果相同"""
+    calculator = calculator or StatisticsCalculator()
+    season_keys, chunk_filter = seasonal_chunks(coefficients, summer_window, chunk_filter)
+    accumulator = MomentAccumulator(DETAIL_KEYS[:1] + season_keys + DETAIL_KEYS[1:], calculator=calculator)
+    accumulate(sources, [accumulator], chunk_rows, chunk_filter)
+    return calculator.statistics_from_moments(accumulator.moments(), coefficients, **threshold_args)